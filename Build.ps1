@@ -7,7 +7,7 @@ param(
 
 $buildWiiPy = {
     Write-Host "Building WiiPy..."
-    python -m nuitka --show-progress --assume-yes-for-downloads --onefile wiipy.py --onefile-tempdir-spec="{CACHE_DIR}/NinjaCheetah/WiiPy"
+    python -m nuitka --show-progress --assume-yes-for-downloads --onefile wiipy.py --include-package=commands --include-package=modules --onefile-tempdir-spec="{CACHE_DIR}/NinjaCheetah/WiiPy"
 }
 
 $cleanWiiPy = {
@@ -2,12 +2,31 @@
 # https://github.com/NinjaCheetah/WiiPy
 
 import pathlib
-import libWiiPy
+from modules.ash import compress_ash
+from modules.compression import decompress, detect_compression
 from modules.core import fatal_error
 
 
 def handle_ash_compress(args):
-    print("Compression is not implemented yet.")
+    input_path = pathlib.Path(args.input)
+    if args.output is not None:
+        output_path = pathlib.Path(args.output)
+    else:
+        output_path = pathlib.Path(input_path.name + ".ash")
+
+    if not input_path.exists():
+        fatal_error(f"The specified file \"{input_path}\" does not exist!")
+
+    data = input_path.read_bytes()
+    # Compress the file using the provided symbol/distance tree widths. The same widths will need to be used when
+    # decompressing it again.
+    try:
+        ash_data = compress_ash(data, sym_tree_bits=args.sym_bits, dist_tree_bits=args.dist_bits)
+    except ValueError as e:
+        fatal_error(str(e))
+    output_path.write_bytes(ash_data)
+
+    print("ASH file compressed!")
 
 
 def handle_ash_decompress(args):
@@ -17,17 +36,24 @@ def handle_ash_decompress(args):
     else:
         output_path = pathlib.Path(input_path.name + ".arc")
 
-    # These default to 9 and 11, respectively, so we can always read them.
-    sym_tree_bits = args.sym_bits
-    dist_tree_bits = args.dist_bits
+    # If either width is provided, the other one uses its usual default of 9 or 11. If neither is provided, the known
+    # widths are tried until one works.
+    ash_tree_bits = None
+    if args.sym_bits is not None or args.dist_bits is not None:
+        ash_tree_bits = (args.sym_bits if args.sym_bits is not None else 9,
+                         args.dist_bits if args.dist_bits is not None else 11)
 
     if not input_path.exists():
         fatal_error(f"The specified ASH file \"{input_path}\" does not exist!")
 
     ash_data = input_path.read_bytes()
-    # Decompress ASH file using the provided symbol/distance tree widths.
-    ash_decompressed = libWiiPy.archive.decompress_ash(ash_data, sym_tree_bits=sym_tree_bits,
-                                                       dist_tree_bits=dist_tree_bits)
+    if detect_compression(ash_data) != "ASH":
+        fatal_error("This is not a valid ASH file!")
+    # Decompress ASH file using the provided (or detected) symbol/distance tree widths.
+    try:
+        ash_decompressed = decompress(ash_data, ash_tree_bits).data
+    except ValueError as e:
+        fatal_error(str(e))
     output_path.write_bytes(ash_decompressed)
 
     print("ASH file decompressed!")
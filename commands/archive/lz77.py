@@ -2,8 +2,9 @@
 # https://github.com/NinjaCheetah/WiiPy
 
 import pathlib
-import libWiiPy
+from modules.compression import decompress_to_file, detect_compression
 from modules.core import fatal_error
+from modules.lz77 import compress_lz77, decompress_lz77_to_file
 
 
 def handle_lz77_compress(args):
@@ -17,7 +18,7 @@ def handle_lz77_compress(args):
         fatal_error(f"The specified file \"{input_path}\" does not exist!")
 
     lz77_data = input_path.read_bytes()
-    data = libWiiPy.archive.compress_lz77(lz77_data)
+    data = compress_lz77(lz77_data, args.level)
     output_path.write_bytes(data)
 
     print("LZ77 file compressed!")
@@ -34,8 +35,19 @@ def handle_lz77_decompress(args):
         fatal_error(f"The specified file \"{input_path}\" does not exist!")
 
     lz77_data = input_path.read_bytes()
-    data = libWiiPy.archive.decompress_lz77(lz77_data)
-    output_path.write_bytes(data)
+    # The decompressed data is streamed to the output file as it's produced, so large files never need to be held in
+    # memory all at once.
+    try:
+        with open(output_path, "wb") as output_file:
+            # Data with the "LZ77" magic number can use either type 0x10 or type 0x11 compression, and the shared
+            # decompression layer handles both. Data without it is assumed to be type 0x10, like libWiiPy does.
+            if detect_compression(lz77_data) in ("LZ77", "LZ11"):
+                decompress_to_file(lz77_data, output_file)
+            else:
+                decompress_lz77_to_file(lz77_data, output_file)
+    except ValueError as e:
+        output_path.unlink(missing_ok=True)
+        fatal_error(f"The specified file could not be decompressed: {e}")
 
     print("LZ77 file decompressed!")
 
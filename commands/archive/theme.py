@@ -7,6 +7,7 @@ import shutil
 import tempfile
 import zipfile
 import libWiiPy
+from modules.compression import decompress
 from modules.core import fatal_error
 
 
@@ -32,9 +33,10 @@ def handle_apply_mym(args):
         except zipfile.BadZipfile:
             fatal_error("The provided MYM theme is not valid!")
         mym_tmp_path = pathlib.Path(tmp_path.joinpath("mym_out"))
-        # Extract the asset archive into the temp directory.
+        # Extract the asset archive into the temp directory, decompressing it first if it's compressed. The themed
+        # archive is always written out uncompressed.
         try:
-            libWiiPy.archive.extract_u8(base_path.read_bytes(), str(tmp_path.joinpath("base_out")))
+            libWiiPy.archive.extract_u8(decompress(base_path.read_bytes()).data, str(tmp_path.joinpath("base_out")))
         except ValueError:
             fatal_error("The provided base assets are not valid!")
         base_temp_path = pathlib.Path(tmp_path.joinpath("base_out"))
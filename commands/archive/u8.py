@@ -3,6 +3,7 @@
 
 import pathlib
 import libWiiPy
+from modules.compression import decompress
 from modules.core import fatal_error
 
 
@@ -28,10 +29,12 @@ def handle_u8_unpack(args):
         fatal_error(f"The specified input file \"{input_path}\" does not exist!")
 
     u8_data = input_path.read_bytes()
-    # U8 archives are sometimes compressed. In the event that the provided data is LZ77 data, assume it's a compressed
+    # U8 archives are sometimes compressed. In the event that the provided data is compressed, assume it's a compressed
     # U8 archive and decompress it before continuing. Standard checks will then catch it if it was something else.
-    if u8_data[0:4] == b'LZ77':
-        u8_data = libWiiPy.archive.decompress_lz77(u8_data)
+    try:
+        u8_data = decompress(u8_data).data
+    except ValueError as e:
+        fatal_error(f"The specified file could not be decompressed: {e}")
 
     # Output path is deliberately not checked in any way because libWiiPy already has those checks, and it's easier
     # and cleaner to only have one component doing all the checks.
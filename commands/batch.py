@@ -0,0 +1,96 @@
+# "commands/batch.py" from WiiPy by NinjaCheetah
+# https://github.com/NinjaCheetah/WiiPy
+
+import json
+import pathlib
+import shlex
+import sys
+import time
+from modules.core import fatal_error
+from modules.dispatch import resolve_handler
+
+
+def _parse_job(line: str) -> list[str]:
+    # Jobs can either be a JSON array of arguments, a JSON object with an "args" key holding either form, or a plain
+    # command line that gets split the same way a shell would split it.
+    if line.startswith("[") or line.startswith("{"):
+        job = json.loads(line)
+        if isinstance(job, dict):
+            job = job.get("args")
+        if isinstance(job, str):
+            return shlex.split(job)
+        if not isinstance(job, list) or not all(isinstance(arg, str) for arg in job):
+            raise ValueError("JSON jobs must be an array of strings, or an object with an \"args\" key!")
+        return job
+    return shlex.split(line)
+
+
+def _run_job(parser, job_args: list[str]) -> int:
+    # Run a single job the same way wiipy.py would, but catch the SystemExit that both argparse and fatal_error() raise
+    # so that a failing job only ends that job rather than the whole batch. The handler is resolved through the same
+    # dispatch table as a normal run, so every command module only gets imported once per batch.
+    try:
+        args = parser.parse_args(job_args)
+        if args.func == "handle_batch":
+            print("\033[31mError:\033[0m Batch jobs cannot start another batch!")
+            return 1
+        resolve_handler(args.func)(args)
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        print(f"\033[31mError:\033[0m {e}")
+        return 1
+    return 0
+
+
+def handle_batch(args):
+    if args.jobs == "-":
+        job_lines = sys.stdin.read().splitlines()
+    else:
+        jobs_path = pathlib.Path(args.jobs)
+        if not jobs_path.exists():
+            fatal_error(f"The specified job list \"{jobs_path}\" does not exist!")
+        job_lines = jobs_path.read_text().splitlines()
+
+    # Blank lines and lines starting with # are skipped, so job lists can be commented.
+    jobs = []
+    for line_num, line in enumerate(job_lines, start=1):
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        try:
+            jobs.append((line_num, _parse_job(line)))
+        except ValueError as e:
+            fatal_error(f"Job on line {line_num} could not be parsed: {e}")
+    if not jobs:
+        fatal_error("No jobs were found in the provided job list!")
+
+    results = []
+    failed_count = 0
+    batch_start = time.perf_counter()
+    for job_num, (line_num, job_args) in enumerate(jobs, start=1):
+        print(f"[{job_num}/{len(jobs)}] wiipy {shlex.join(job_args)}")
+        job_start = time.perf_counter()
+        status = _run_job(args.parser, job_args)
+        job_time = time.perf_counter() - job_start
+        # Commands usually don't flush their output before returning, so do it here to make sure that output from
+        # each job stays grouped together when stdout is being piped elsewhere.
+        sys.stdout.flush()
+        results.append({"line": line_num, "args": job_args, "status": status, "time": round(job_time, 4)})
+        if status != 0:
+            failed_count += 1
+            print(f"  - Job failed with exit status {status}!")
+            if args.exit_on_error:
+                break
+
+    if args.results is not None:
+        with open(args.results, "w") as results_file:
+            for result in results:
+                results_file.write(json.dumps(result) + "\n")
+
+    print(f"\nRan {len(results)} of {len(jobs)} job(s) in {round(time.perf_counter() - batch_start, 2)}s, "
+          f"{len(results) - failed_count} succeeded and {failed_count} failed.")
+    if failed_count > 0:
+        sys.exit(1)
@@ -1,10 +1,20 @@
 # "commands/nand/emunand.py" from WiiPy by NinjaCheetah
 # https://github.com/NinjaCheetah/WiiPy
 
-import math
+import collections
+import concurrent.futures
 import pathlib
+import shutil
+import sys
+import tempfile
+import time
 import libWiiPy
+from modules.cache import NUSCache
 from modules.core import fatal_error
+from modules.emunand import (TitleIndex, commit_staged_title, get_shared_content_usage, get_shared_hashes,
+                             remove_shared_contents, scan_space_usage, size_to_blocks, stage_wad)
+from modules.nus import fetch_title, open_session
+from modules.wad import WADReader, write_title_wad
 
 
 def handle_emunand_info(args):
@@ -12,13 +22,16 @@ def handle_emunand_info(args):
     # Basic info.
     print(f"EmuNAND Info")
     print(f"  Path: {str(emunand.emunand_root.absolute())}")
+    # Versions and required IOSes all come from the title index, rather than from loading every TMD.
+    title_index = TitleIndex(emunand)
+    title_index.save()
     is_vwii = False
-    try:
-        tmd = emunand.get_title_tmd("0000000100000002")
-        is_vwii = bool(tmd.vwii)
-        print(f"  System Menu Version: {libWiiPy.title.title_ver_dec_to_standard(tmd.title_version, '0000000100000002',
-                                                                                 vwii=is_vwii)}")
-    except FileNotFoundError:
+    system_menu = title_index.get_title("0000000100000002")
+    if system_menu is not None:
+        is_vwii = system_menu.vwii
+        print(f"  System Menu Version: {libWiiPy.title.title_ver_dec_to_standard(system_menu.title_version,
+                                                                                 '0000000100000002', vwii=is_vwii)}")
+    else:
         print(f"  System Menu Version: None")
     settings_path = emunand.title_dir.joinpath("00000001", "00000002", "data", "setting.txt")
     if settings_path.exists():
@@ -31,16 +44,21 @@ def handle_emunand_info(args):
         print(f"  Type: vWii")
     else:
         print(f"  Type: Wii")
-    categories = emunand.get_installed_titles()
+    categories = title_index.get_installed_titles()
     installed_count = 0
     for category in categories:
         if category.type != "00010000":
             for _ in category.titles:
                 installed_count += 1
     print(f"  Installed Titles: {installed_count}")
-    total_size = sum(file.stat().st_size for file in emunand.emunand_root.rglob('*'))
-    total_size_blocks = math.ceil(total_size / 131072)
-    print(f"  Space Used: {total_size_blocks} blocks ({round(total_size / 1048576, 2)} MB)")
+    space_usage = scan_space_usage(emunand)
+    total_size = space_usage.total
+    print(f"  Space Used: {size_to_blocks(total_size)} blocks ({round(total_size / 1048576, 2)} MB)")
+    print(f"    Titles: {size_to_blocks(sum(space_usage.title_content.values()))} blocks")
+    print(f"    Save Data: {size_to_blocks(sum(space_usage.title_data.values()))} blocks")
+    print(f"    Shared Content: {size_to_blocks(space_usage.shared_content)} blocks")
+    print(f"    Tickets: {size_to_blocks(space_usage.tickets)} blocks")
+    print(f"    System Files: {size_to_blocks(space_usage.system)} blocks")
     print("")
 
     installed_ioses = []
@@ -73,13 +91,14 @@ def handle_emunand_info(args):
                 print(f"  BC-NAND ({ios.upper()})")
             elif ios[8:] == "00000201":
                 print(f"  BC-WFS ({ios.upper()})")
-            tmd = emunand.get_title_tmd(ios)
-            print(f"    Version: {tmd.title_version}")
+            title_info = title_index.get_title(ios)
+            print(f"    Version: {title_info.title_version}")
         else:
             print(f"  IOS{int(ios[-2:], 16)} ({ios.upper()})")
-            tmd = emunand.get_title_tmd(ios)
-            print(f"    Version: {tmd.title_version} "
-                  f"({libWiiPy.title.title_ver_dec_to_standard(tmd.title_version, tmd.title_id, bool(tmd.vwii))})")
+            title_info = title_index.get_title(ios)
+            ios_version = libWiiPy.title.title_ver_dec_to_standard(title_info.title_version, title_info.title_id,
+                                                                   title_info.vwii)
+            print(f"    Version: {title_info.title_version} ({ios_version})")
     print("")
 
     print(f"Installed Titles:")
@@ -94,13 +113,16 @@ def handle_emunand_info(args):
             print(f"  {title.upper()} ({ascii_tid})")
         else:
             print(f"  {title.upper()}")
-        tmd = emunand.get_title_tmd(f"{title}")
-        print(f"    Version: {tmd.title_version}")
-        print(f"    Required IOS: IOS{int(tmd.ios_tid[-2:], 16)} ({tmd.ios_tid.upper()})", end="", flush=True)
-        if tmd.ios_tid.upper() not in installed_ioses:
+        title_info = title_index.get_title(title)
+        print(f"    Version: {title_info.title_version}")
+        print(f"    Space Used: {size_to_blocks(space_usage.title_content.get(title.upper(), 0))} blocks, plus "
+              f"{size_to_blocks(space_usage.title_data.get(title.upper(), 0))} blocks of save data")
+        print(f"    Required IOS: IOS{int(title_info.ios_tid[-2:], 16)} ({title_info.ios_tid.upper()})", end="",
+              flush=True)
+        if title_info.ios_tid.upper() not in installed_ioses:
             print(" *")
-            if tmd.ios_tid not in missing_ioses:
-                missing_ioses.append(tmd.ios_tid)
+            if title_info.ios_tid not in missing_ioses:
+                missing_ioses.append(title_info.ios_tid)
         else:
             print("")
     print("")
@@ -130,17 +152,18 @@ def handle_emunand_info(args):
 def handle_emunand_install_missing(args):
     # Get an index of all installed titles, and check their required IOSes. Then compare the required IOSes with the
     # installed IOSes, and build a list of IOSes we need to obtain.
+    if args.jobs < 1:
+        fatal_error("The number of jobs must be at least 1!")
     emunand = libWiiPy.nand.EmuNAND(args.emunand)
+    title_index = TitleIndex(emunand)
+    title_index.save()
     if args.vwii:
         is_vwii = True
     else:
         # Try and detect a vWii System Menu, if one is installed, so that we get vWii IOSes if they're needed.
-        try:
-            tmd = emunand.get_title_tmd("0000000100000002")
-            is_vwii = bool(tmd.vwii)
-        except FileNotFoundError:
-            is_vwii = False
-    categories = emunand.get_installed_titles()
+        system_menu = title_index.get_title("0000000100000002")
+        is_vwii = system_menu.vwii if system_menu is not None else False
+    categories = title_index.get_installed_titles()
     installed_ioses = []
     installed_titles = []
     for category in categories:
@@ -155,10 +178,10 @@ def handle_emunand_install_missing(args):
                 installed_titles.append(f"{category.type}{title}")
     missing = []
     for title in installed_titles:
-        tmd = emunand.get_title_tmd(title)
-        if tmd.ios_tid.upper() not in installed_ioses:
-            if int(tmd.ios_tid[8:], 16) not in missing:
-                missing.append(int(tmd.ios_tid[8:], 16))
+        title_info = title_index.get_title(title)
+        if title_info.ios_tid.upper() not in installed_ioses:
+            if int(title_info.ios_tid[8:], 16) not in missing:
+                missing.append(int(title_info.ios_tid[8:], 16))
     missing.sort()
     if is_vwii:
         missing_ioses = [f"00000007{i:08X}" for i in missing]
@@ -171,20 +194,253 @@ def handle_emunand_install_missing(args):
     for ios in missing_ioses:
         print(f"  IOS{int(ios[-2:], 16)} ({ios.upper()})")
     print("")
-    # Download and then install each missing IOS to the EmuNAND.
-    for ios in missing_ioses:
-        print(f"Downloading IOS{int(ios[-2:], 16)} ({ios.upper()})...")
-        title = libWiiPy.title.download_title(ios)
-        print(f"  Installing IOS{int(ios[-2:], 16)} ({ios.upper()}) v{title.tmd.title_version}...")
-        emunand.install_title(title)
-        print(f"  Installed IOS{int(ios[-2:], 16)} ({ios.upper()}) v{title.tmd.title_version}!")
+    # IOSes that can be found in the provided WAD directory are installed from there. Everything else is downloaded,
+    # with several downloads running at once, while IOSes are installed one at a time in order as their downloads
+    # finish. IOSes that are already in the local NUS cache are loaded from there instead of being downloaded again.
+    # Each finished download holds an entire title in memory, so only a few are started ahead of the IOS that's being
+    # installed, and each one is let go of as soon as it's been installed.
+    local_wads = _find_local_wads(pathlib.Path(args.wad_dir)) if args.wad_dir is not None else {}
+    cache = None if args.no_cache else NUSCache()
+    open_session(args.jobs)
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        download_queue = collections.deque(ios for ios in missing_ioses if ios.upper() not in local_wads)
+        downloads = {}
+        for ios in missing_ioses:
+            # Drop the last IOS that was downloaded before starting more downloads in its place.
+            title = None
+            while download_queue and len(downloads) < args.jobs:
+                next_ios = download_queue.popleft()
+                downloads[next_ios] = executor.submit(fetch_title, next_ios, endpoint_override=args.endpoint,
+                                                      cache=cache, offline=args.offline)
+            ios_name = f"IOS{int(ios[-2:], 16)} ({ios.upper()})"
+            try:
+                if ios.upper() in local_wads:
+                    print(f"Installing {ios_name} from {local_wads[ios.upper()]}...")
+                    staged = _install_wad(emunand, local_wads[ios.upper()], False)
+                    title_version = staged.title_version
+                else:
+                    print(f"Downloading {ios_name}...")
+                    title = downloads.pop(ios).result()
+                    title_version = title.tmd.title_version
+                    print(f"  Installing {ios_name} v{title_version}...")
+                    emunand.install_title(title)
+            except Exception as e:
+                print(f"  \033[31mError:\033[0m {ios_name} could not be installed: {e}")
+                failed.append(ios_name)
+                continue
+            title_index.update_title(ios)
+            title_index.save()
+            print(f"  Installed {ios_name} v{title_version}!")
+    if failed:
+        print(f"\n{len(missing_ioses) - len(failed)} of {len(missing_ioses)} missing IOSes were installed. The "
+              f"following IOSes could not be installed:")
+        for ios_name in failed:
+            print(f"  {ios_name}")
+        sys.exit(1)
     print(f"\nAll missing IOSes have been installed!")
 
 
+def _find_local_wads(wad_dir: pathlib.Path) -> dict[str, pathlib.Path]:
+    # Index the WADs in a directory by Title ID. Only the TMD of each WAD is read, and when there's more than one WAD
+    # for the same title, the newest version is used.
+    if not wad_dir.is_dir():
+        fatal_error(f"The specified WAD directory \"{wad_dir}\" does not exist!")
+    local_wads = {}
+    local_versions = {}
+    for wad in sorted(wad_dir.glob("*.[wW][aA][dD]")):
+        try:
+            with WADReader(wad) as wad_reader:
+                tmd = libWiiPy.title.TMD()
+                tmd.load(wad_reader.get_tmd_data())
+        except (TypeError, ValueError):
+            continue
+        tid = tmd.title_id.upper()
+        if tmd.title_version >= local_versions.get(tid, -1):
+            local_wads[tid] = wad
+            local_versions[tid] = tmd.title_version
+    return local_wads
+
+
+def handle_emunand_gc(args):
+    emunand = libWiiPy.nand.EmuNAND(args.emunand)
+    title_index = TitleIndex(emunand)
+    title_index.save()
+    try:
+        usage, stray_files = get_shared_content_usage(emunand, title_index)
+    except ValueError as e:
+        fatal_error(f"The EmuNAND's content.map could not be read: {e}")
+
+    referenced = [content for content in usage if content.titles]
+    orphaned = [content for content in usage if not content.titles]
+    print(f"Shared Content:")
+    print(f"  Entries in content.map: {len(usage)}")
+    print(f"  Used by installed titles: {len(referenced)}")
+    print(f"  Unused: {len(orphaned)}")
+    if args.verbose:
+        for content in referenced:
+            print(f"  {content.shared_id}.app ({content.content_hash}) used by: {', '.join(content.titles)}")
+    print("")
+    if not orphaned and not stray_files:
+        print("There are no unused shared contents to remove!")
+        return
+
+    reclaimed_size = sum(content.size for content in orphaned) + sum(file.stat().st_size for file in stray_files)
+    action = "Would remove" if args.dry_run else "Removing"
+    print(f"{action} {len(orphaned) + len(stray_files)} unused shared content(s):")
+    for content in orphaned:
+        print(f"  {content.shared_id}.app ({content.content_hash}), {size_to_blocks(content.size)} blocks")
+    for file in stray_files:
+        print(f"  {file.name} (not in content.map), {size_to_blocks(file.stat().st_size)} blocks")
+    if not args.dry_run:
+        if orphaned:
+            remove_shared_contents(emunand, {content.shared_id for content in orphaned})
+        for file in stray_files:
+            file.unlink()
+    print(f"\n{'Would reclaim' if args.dry_run else 'Reclaimed'} {size_to_blocks(reclaimed_size)} blocks "
+          f"({round(reclaimed_size / 1048576, 2)} MB)!")
+
+
+def _read_manifest(manifest_path: pathlib.Path) -> list[tuple[str, pathlib.Path | str, int | None]]:
+    # Manifests have one title per line, either as the path to a WAD (relative to the manifest) or as a Title ID to
+    # download, optionally followed by a version. Blank lines and lines starting with # are skipped.
+    entries = []
+    for line_num, line in enumerate(manifest_path.read_text().splitlines(), start=1):
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        wad_path = manifest_path.parent.joinpath(line)
+        if wad_path.is_file():
+            entries.append(("wad", wad_path, None))
+            continue
+        fields = line.split()
+        if len(fields) > 2 or len(fields[0]) != 16:
+            fatal_error(f"Line {line_num} of the manifest is invalid! Each line must contain either the path to a WAD "
+                        f"that exists, or a 16 character Title ID optionally followed by a version.")
+        try:
+            version = int(fields[1].lstrip("vV")) if len(fields) == 2 else None
+        except ValueError:
+            fatal_error(f"The version on line {line_num} of the manifest must be a valid integer!")
+        entries.append(("tid", fields[0].upper(), version))
+    return entries
+
+
+def handle_emunand_provision(args):
+    manifest_path = pathlib.Path(args.manifest)
+    if not manifest_path.is_file():
+        fatal_error(f"The specified manifest \"{manifest_path}\" does not exist!")
+    if args.jobs < 1:
+        fatal_error("The number of jobs must be at least 1!")
+    entries = _read_manifest(manifest_path)
+    if not entries:
+        fatal_error("No titles were found in the provided manifest!")
+    emunands = []
+    for target in args.emunands:
+        pathlib.Path(target).mkdir(parents=True, exist_ok=True)
+        emunands.append(libWiiPy.nand.EmuNAND(target))
+
+    # Every title is staged once, into the /tmp/ directory of the first EmuNAND so that it's on the same filesystem as
+    # at least one target, and then committed to each target by linking to or copying the staged files. Titles given
+    # as Title IDs are downloaded into WADs first, so that they can be staged the same way.
+    provision_dir = pathlib.Path(tempfile.mkdtemp(dir=emunands[0].tmp_dir, prefix="wiipy-provision-"))
+    try:
+        wad_files = []
+        cache = None if args.no_cache else NUSCache()
+        for entry_type, entry, version in entries:
+            if entry_type == "wad":
+                wad_files.append(entry)
+                continue
+            print(f"Downloading title {entry}{f' v{version}' if version is not None else ''}...")
+            try:
+                title = fetch_title(entry, version, endpoint_override=args.endpoint, cache=cache,
+                                    offline=args.offline)
+            except ValueError as e:
+                fatal_error(str(e))
+            wad_path = provision_dir.joinpath(f"{entry}-v{title.tmd.title_version}.wad")
+            write_title_wad(wad_path, title)
+            wad_files.append(wad_path)
+
+        print(f"Decrypting and verifying {len(wad_files)} title(s)...")
+        staged_titles = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = []
+            for wad_num, wad in enumerate(wad_files):
+                staging_dir = provision_dir.joinpath(str(wad_num))
+                staging_dir.mkdir()
+                futures.append((wad, executor.submit(stage_wad, wad, staging_dir, args.skip_hash)))
+            for wad, future in futures:
+                try:
+                    staged_titles.append(future.result())
+                except Exception as e:
+                    fatal_error(f"WAD \"{wad}\" could not be decrypted: {str(e).splitlines()[0]}")
+                print(f"  {staged_titles[-1].title_id.upper()} v{staged_titles[-1].title_version} "
+                      f"({staged_titles[-1].stage_time:.2f}s)")
+
+        for emunand in emunands:
+            print(f"Provisioning EmuNAND at {emunand.emunand_root}...")
+            commit_start = time.perf_counter()
+            title_index = TitleIndex(emunand, refresh=False)
+            for staged in staged_titles:
+                commit_staged_title(emunand, staged, args.link)
+                title_index.update_title(staged.title_id)
+            title_index.save()
+            print(f"  Installed {len(staged_titles)} title(s) in {time.perf_counter() - commit_start:.2f}s")
+    finally:
+        shutil.rmtree(provision_dir, ignore_errors=True)
+    print(f"\nProvisioned {len(emunands)} EmuNAND(s) with {len(staged_titles)} title(s)!")
+
+
 def _emunand_logger(log):
     print(log)
 
 
+def _install_wad(emunand: libWiiPy.nand.EmuNAND, wad_path: pathlib.Path, skip_hash: bool):
+    # Installs a single WAD, staging and committing it in one go.
+    staging_dir = pathlib.Path(tempfile.mkdtemp(dir=emunand.tmp_dir, prefix="wiipy-"))
+    try:
+        staged = stage_wad(wad_path, staging_dir, skip_hash, get_shared_hashes(emunand))
+        commit_staged_title(emunand, staged)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return staged
+
+
+def _install_wads(emunand: libWiiPy.nand.EmuNAND, wad_files: list[pathlib.Path], skip_hash: bool, jobs: int) -> list:
+    # Installs WADs as a pipeline. Worker processes decrypt and verify each WAD into its own staging directory inside
+    # the EmuNAND's /tmp/, while this process is the only one that writes to the EmuNAND itself, moving each staged
+    # title into place once it's ready. Titles are committed in the order they were provided rather than the order
+    # they finish in, so shared contents always get the same names as they would from installing one at a time. Only
+    # a few titles are staged ahead of the one being committed, so that staging doesn't take up much more space than
+    # the titles being installed.
+    shared_hashes = get_shared_hashes(emunand)
+    results = []
+    pending = collections.deque()
+    wad_queue = collections.deque(wad_files)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        while wad_queue or pending:
+            while wad_queue and len(pending) < jobs * 2:
+                wad = wad_queue.popleft()
+                staging_dir = pathlib.Path(tempfile.mkdtemp(dir=emunand.tmp_dir, prefix="wiipy-"))
+                pending.append((wad, staging_dir, executor.submit(stage_wad, wad, staging_dir, skip_hash,
+                                                                  shared_hashes)))
+            wad, staging_dir, future = pending.popleft()
+            result = {"wad": wad}
+            try:
+                staged = future.result()
+                commit_start = time.perf_counter()
+                commit_staged_title(emunand, staged)
+                result.update({"tid": staged.title_id, "version": staged.title_version,
+                               "stage_time": staged.stage_time, "commit_time": time.perf_counter() - commit_start})
+                print(f"Installed {wad.name} ({staged.title_id.upper()} v{staged.title_version})")
+            except Exception as e:
+                result["error"] = str(e).splitlines()[0]
+                print(f"WAD {wad} could not be installed!")
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            results.append(result)
+    return results
+
+
 def handle_emunand_title(args):
     logger = _emunand_logger if args.verbose else lambda _: None
     emunand = libWiiPy.nand.EmuNAND(args.emunand, logger)
@@ -199,34 +455,48 @@ def handle_emunand_title(args):
 
         if not input_path.exists():
             fatal_error("The specified WAD file does not exist!")
+        if args.jobs < 1:
+            fatal_error("The number of jobs must be at least 1!")
 
         if input_path.is_dir():
-            wad_files = list(input_path.glob("*.[wW][aA][dD]"))
+            wad_files = sorted(input_path.glob("*.[wW][aA][dD]"))
             if not wad_files:
                 fatal_error("No WAD files were found in the provided input directory!")
-            wad_count = 0
-            for wad in wad_files:
-                title = libWiiPy.title.Title()
-                title.load_wad(open(wad, "rb").read())
-                try:
-                    emunand.install_title(title, skip_hash=skip_hash)
-                    wad_count += 1
-                except ValueError:
-                    print(f"WAD {wad} could not be installed!")
-            print(f"Successfully installed {wad_count} WAD(s) to EmuNAND!")
+            results = _install_wads(emunand, wad_files, skip_hash, args.jobs)
+            title_index = TitleIndex(emunand, refresh=False)
+            for tid in {result["tid"] for result in results if "error" not in result}:
+                title_index.update_title(tid)
+            title_index.save()
+            failed = [result for result in results if "error" in result]
+            print(f"\nInstall Report:")
+            for result in results:
+                if "error" in result:
+                    print(f"  {result['wad'].name}: \033[31mfailed\033[0m ({result['error']})")
+                else:
+                    print(f"  {result['wad'].name}: {result['tid'].upper()} v{result['version']} "
+                          f"(decrypted in {result['stage_time']:.2f}s, written in {result['commit_time']:.2f}s)")
+            print(f"\nSuccessfully installed {len(results) - len(failed)} WAD(s) to EmuNAND!")
+            if failed:
+                print(f"{len(failed)} WAD(s) could not be installed!")
+                sys.exit(1)
         else:
-            title = libWiiPy.title.Title()
-            title.load_wad(open(input_path, "rb").read())
-            emunand.install_title(title, skip_hash=skip_hash)
+            try:
+                staged = _install_wad(emunand, input_path, skip_hash)
+            except ValueError as e:
+                fatal_error(str(e))
+            title_index = TitleIndex(emunand, refresh=False)
+            title_index.update_title(staged.title_id)
+            title_index.save()
             print("Successfully installed WAD to EmuNAND!")
 
     # Code for if the --uninstall argument was passed.
     elif args.uninstall:
         input_str = args.uninstall
         if pathlib.Path(input_str).exists():
-            title = libWiiPy.title.Title()
-            title.load_wad(pathlib.Path(input_str).read_bytes())
-            target_tid = title.tmd.title_id
+            with WADReader(pathlib.Path(input_str)) as wad_reader:
+                tmd = libWiiPy.title.TMD()
+                tmd.load(wad_reader.get_tmd_data())
+            target_tid = tmd.title_id
         else:
             target_tid = input_str
 
@@ -234,5 +504,8 @@ def handle_emunand_title(args):
             fatal_error("The provided Title ID is invalid! Title IDs must be 16 characters long.")
 
         emunand.uninstall_title(target_tid.lower())
+        title_index = TitleIndex(emunand, refresh=False)
+        title_index.update_title(target_tid)
+        title_index.save()
 
         print("Title uninstalled from EmuNAND!")
@@ -7,6 +7,8 @@ import xml.etree.ElementTree as ET
 import pathlib
 import libWiiPy
 from modules.core import fatal_error
+from modules.fakesign import fakesign_title
+from modules.wad import load_wad_file, write_title_wad
 
 
 def build_cios(args):
@@ -25,8 +27,7 @@ def build_cios(args):
     if not modules_path.exists():
         fatal_error(f"The specified cIOS modules directory \"{modules_path}\" does not exist!")
 
-    title = libWiiPy.title.Title()
-    title.load_wad(open(base_path, 'rb').read())
+    title = load_wad_file(base_path)
 
     cios_tree = ET.parse(map_path)
     cios_root = cios_tree.getroot()
@@ -137,9 +138,9 @@ def build_cios(args):
     title.ticket.common_key_index = 0
 
     # Ensure the WAD is fakesigned.
-    title.fakesign()
+    fakesign_title(title)
 
     # Write the new cIOS to the specified output path.
-    output_path.write_bytes(title.dump_wad())
+    write_title_wad(output_path, title)
 
     print(f"Successfully built cIOS \"{args.cios_ver}\"!")
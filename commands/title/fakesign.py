@@ -1,38 +1,187 @@
 # "commands/title/fakesign.py" from WiiPy by NinjaCheetah
 # https://github.com/NinjaCheetah/WiiPy
 
+import concurrent.futures
+import glob
+import json
 import pathlib
+import shutil
+import sys
+import time
 import libWiiPy
 from modules.core import fatal_error
+from modules.fakesign import fakesign_ticket, fakesign_tmd
+from modules.wad import load_wad_metadata, write_title_wad
 
+_fakesign_suffixes = (".tmd", ".tik", ".wad")
 
-def handle_fakesign(args):
-    input_path = pathlib.Path(args.input)
-    if args.output is not None:
-        output_path = pathlib.Path(args.output)
+
+def _fakesign_file(input_path: pathlib.Path, output_path: pathlib.Path, search_jobs: int = 1) -> dict:
+    # Fakesign a single TMD, Ticket, or WAD. This runs in a worker process when fakesigning a batch, so rather than
+    # exiting, it reports what happened in a result that the main process can print and write to the summary.
+    result = {"input": str(input_path), "output": str(output_path), "type": input_path.suffix.lower()[1:],
+              "status": "fakesigned"}
+    start_time = time.perf_counter()
+    try:
+        if input_path.suffix.lower() == ".tmd":
+            tmd = libWiiPy.title.TMD()
+            tmd.load(input_path.read_bytes())
+            if tmd.get_is_fakesigned():
+                result["status"] = "skipped"
+            else:
+                fakesign_tmd(tmd, search_jobs)
+                output_path.write_bytes(tmd.dump())
+        elif input_path.suffix.lower() == ".tik":
+            tik = libWiiPy.title.Ticket()
+            tik.load(input_path.read_bytes())
+            if tik.get_is_fakesigned():
+                result["status"] = "skipped"
+            else:
+                fakesign_ticket(tik, search_jobs)
+                output_path.write_bytes(tik.dump())
+        elif input_path.suffix.lower() == ".wad":
+            # Fakesigning only touches the TMD and Ticket, so the contents are copied over from the input untouched.
+            # libWiiPy's Title.get_is_fakesigned() only really checks the Ticket, so both are checked separately here,
+            # and only the one that isn't fakesigned yet gets fakesigned.
+            title = load_wad_metadata(input_path, output_path)
+            tmd_fakesigned = title.tmd.get_is_fakesigned()
+            ticket_fakesigned = title.ticket.get_is_fakesigned()
+            if tmd_fakesigned and ticket_fakesigned:
+                result["status"] = "skipped"
+            else:
+                if not tmd_fakesigned:
+                    fakesign_tmd(title.tmd, search_jobs)
+                if not ticket_fakesigned:
+                    fakesign_ticket(title.ticket, search_jobs)
+                write_title_wad(output_path, title)
+        # Files that are already fakesigned are left alone, but still need to end up at the output path.
+        if result["status"] == "skipped" and output_path.resolve() != input_path.resolve():
+            shutil.copyfile(input_path, output_path)
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+    result["time"] = round(time.perf_counter() - start_time, 4)
+    return result
+
+
+def _collect_inputs(inputs: list[str]) -> list[tuple[pathlib.Path, pathlib.Path]]:
+    # Expand the provided inputs into a list of files, each paired with the path relative to where it was found. That
+    # relative path is what's used to place the file inside the output directory. Directories are searched recursively
+    # for TMDs, Tickets, and WADs, and anything that doesn't exist as a path is treated as a glob pattern. Glob matches
+    # are kept relative to the part of the pattern before its first wildcard, so that "dir/**/*.wad" keeps the same
+    # folder structure as passing "dir" would.
+    files = []
+    for entry in inputs:
+        entry_path = pathlib.Path(entry)
+        if entry_path.is_dir():
+            for file in sorted(entry_path.rglob("*")):
+                if file.is_file() and file.suffix.lower() in _fakesign_suffixes:
+                    files.append((file, file.relative_to(entry_path)))
+        elif entry_path.exists():
+            files.append((entry_path, pathlib.Path(entry_path.name)))
+        elif glob.has_magic(entry):
+            matches = sorted(pathlib.Path(match) for match in glob.glob(entry, recursive=True))
+            matches = [match for match in matches if match.is_file() and match.suffix.lower() in _fakesign_suffixes]
+            if not matches:
+                fatal_error(f"No TMDs, Tickets, or WADs matched the pattern \"{entry}\"!")
+            pattern_parts = pathlib.Path(entry).parts
+            root_parts = []
+            for part in pattern_parts:
+                if glob.has_magic(part):
+                    break
+                root_parts.append(part)
+            glob_root = pathlib.Path(*root_parts) if root_parts else None
+            files.extend((match, match.relative_to(glob_root) if glob_root is not None else match)
+                         for match in matches)
+        else:
+            fatal_error(f"The specified input file \"{entry_path}\" does not exist!")
+    # The same file can be picked up more than once when inputs overlap, but it should only be fakesigned once.
+    unique_files = {}
+    for file, relative_path in files:
+        unique_files.setdefault(file.resolve(), (file, relative_path))
+    return list(unique_files.values())
+
+
+def _fakesign_single(input_path: pathlib.Path, output_path: pathlib.Path, jobs: int):
+    if input_path.suffix.lower() not in _fakesign_suffixes:
+        fatal_error("The provided file does not appear to be a TMD, Ticket, or WAD and cannot be fakesigned!")
+    result = _fakesign_file(input_path, output_path, jobs)
+    if result["status"] == "failed":
+        fatal_error(result["error"])
+    name = {"tmd": "TMD", "tik": "Ticket", "wad": "WAD"}[result["type"]]
+    if result["status"] == "skipped":
+        print(f"{name} is already fakesigned, skipping!")
     else:
-        output_path = pathlib.Path(args.input)
-
-    if not input_path.exists():
-        fatal_error(f"The specified input file \"{input_path}\" does not exist!")
-
-    if input_path.suffix.lower() == ".tmd":
-        tmd = libWiiPy.title.TMD()
-        tmd.load(input_path.read_bytes())
-        tmd.fakesign()
-        output_path.write_bytes(tmd.dump())
-        print("TMD fakesigned successfully!")
-    elif input_path.suffix.lower() == ".tik":
-        tik = libWiiPy.title.Ticket()
-        tik.load(input_path.read_bytes())
-        tik.fakesign()
-        output_path.write_bytes(tik.dump())
-        print("Ticket fakesigned successfully!")
-    elif input_path.suffix.lower() == ".wad":
-        title = libWiiPy.title.Title()
-        title.load_wad(input_path.read_bytes())
-        title.fakesign()
-        output_path.write_bytes(title.dump_wad())
-        print("WAD fakesigned successfully!")
+        print(f"{name} fakesigned successfully!")
+    return result
+
+
+def _print_result(file_num: int, file_count: int, result: dict):
+    if result["status"] == "failed":
+        print(f"[{file_num}/{file_count}] {result['input']}: \033[31mfailed\033[0m ({result['error']})")
+    elif result["status"] == "skipped":
+        print(f"[{file_num}/{file_count}] {result['input']}: already fakesigned, skipped")
     else:
-        fatal_error("The provided file does not appear to be a TMD, Ticket, or WAD and cannot be fakesigned!")
+        print(f"[{file_num}/{file_count}] {result['input']}: fakesigned")
+
+
+def handle_fakesign(args):
+    if args.jobs < 1:
+        fatal_error("The number of jobs must be at least 1!")
+
+    # A single file keeps working the same way it always has, with the output being a file. Anything else is a batch,
+    # where the output (if there is one) is a directory that the fakesigned files are written into.
+    is_batch = len(args.input) > 1 or not pathlib.Path(args.input[0]).is_file()
+    if not is_batch:
+        input_path = pathlib.Path(args.input[0])
+        output_path = pathlib.Path(args.output) if args.output is not None else input_path
+        results = [_fakesign_single(input_path, output_path, args.jobs)]
+    else:
+        files = _collect_inputs(args.input)
+        if not files:
+            fatal_error("No TMDs, Tickets, or WADs were found to fakesign!")
+        output_dir = None
+        if args.output is not None:
+            output_dir = pathlib.Path(args.output)
+            if output_dir.is_file():
+                fatal_error("The output path must be a directory when fakesigning more than one file!")
+        jobs = []
+        output_sources = {}
+        for input_path, relative_path in files:
+            output_path = output_dir.joinpath(relative_path) if output_dir is not None else input_path
+            # Different inputs can still end up at the same output path, like two files with the same name passed from
+            # different directories, and one would silently overwrite the other.
+            if output_path in output_sources:
+                fatal_error(f"Both \"{output_sources[output_path]}\" and \"{input_path}\" would be written to "
+                            f"\"{output_path}\"! Pass their parent directory instead so that they're kept apart.")
+            output_sources[output_path] = input_path
+            jobs.append((input_path, output_path))
+        for _, output_path in jobs:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Each file only takes a fraction of a second, so with a batch it's the files that are split across processes
+        # rather than the search for each one.
+        results = []
+        batch_start = time.perf_counter()
+        if args.jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+                futures = [executor.submit(_fakesign_file, input_path, output_path) for input_path, output_path in jobs]
+                for future in futures:
+                    results.append(future.result())
+                    _print_result(len(results), len(jobs), results[-1])
+        else:
+            for input_path, output_path in jobs:
+                results.append(_fakesign_file(input_path, output_path))
+                _print_result(len(results), len(jobs), results[-1])
+        counts = {status: sum(1 for result in results if result["status"] == status)
+                  for status in ("fakesigned", "skipped", "failed")}
+        print(f"\nProcessed {len(results)} file(s) in {round(time.perf_counter() - batch_start, 2)}s, "
+              f"{counts['fakesigned']} fakesigned, {counts['skipped']} already fakesigned, and {counts['failed']} "
+              f"failed.")
+
+    if args.results is not None:
+        with open(args.results, "w") as results_file:
+            for result in results:
+                results_file.write(json.dumps(result) + "\n")
+    if any(result["status"] == "failed" for result in results):
+        sys.exit(1)
@@ -5,7 +5,9 @@ import binascii
 import pathlib
 import re
 import libWiiPy
+from modules.compression import decompress, detect_compression
 from modules.core import fatal_error
+from modules.wad import WADReader
 
 
 def _print_tmd_info(tmd: libWiiPy.title.TMD, signing_cert=None):
@@ -171,14 +173,13 @@ def _print_ticket_info(ticket: libWiiPy.title.Ticket, signing_cert=None):
 
 def _print_wad_info(title: libWiiPy.title.Title):
     print(f"WAD Info")
-    banner_data = title.get_content_by_index(0)
     banner_u8 = libWiiPy.archive.U8Archive()
     try:
-        banner_u8.load(banner_data)
+        banner_u8.load(decompress(title.get_content_by_index(0)).data)
         if banner_u8.imet_header.magic != "":
             channel_title = banner_u8.imet_header.get_channel_names(banner_u8.imet_header.LocalizedTitles.TITLE_ENGLISH)
             print(f"  Channel Name: {channel_title}")
-    except TypeError:
+    except (TypeError, ValueError):
         pass
     match title.wad.wad_type:
         case "Is":
@@ -227,6 +228,50 @@ def _print_wad_info(title: libWiiPy.title.Title):
     _print_tmd_info(title.tmd, tmd_cert)
 
 
+def _print_wad_file_info(wad_path: pathlib.Path):
+    try:
+        with WADReader(wad_path) as wad_reader:
+            _print_wad_info(wad_reader.load_title())
+    except ValueError as e:
+        fatal_error(str(e))
+
+
+def _is_u8_archive(data: bytes) -> bool:
+    # U8 archives either start with the U8 magic number, or with an IMET header at 0x40 or 0x80 if they're a banner.
+    return data[0:4] == b'\x55\xAA\x38\x2D' or data[0x40:0x44] == b'IMET' or data[0x80:0x84] == b'IMET'
+
+
+def _print_u8_info(u8_data: bytes, compression: str | None, compressed_size: int):
+    # Banners start with an IMET header, and the archive itself comes after it at 0x600 (or 0x640 with a build tag).
+    # libWiiPy only reads the IMET header when loading a banner, so the archive is loaded separately to list its files.
+    archive_start = 0
+    if u8_data[0x40:0x44] == b'IMET':
+        archive_start = 0x600
+    elif u8_data[0x80:0x84] == b'IMET':
+        archive_start = 0x640
+    banner_u8 = libWiiPy.archive.U8Archive()
+    u8_archive = libWiiPy.archive.U8Archive()
+    try:
+        if archive_start:
+            banner_u8.load(u8_data)
+        u8_archive.load(u8_data[archive_start:])
+    except (TypeError, ValueError):
+        fatal_error("This does not appear to be a valid U8 archive! No info can be provided.")
+    print("U8 Archive Info")
+    if banner_u8.imet_header.magic != "":
+        channel_title = banner_u8.imet_header.get_channel_names(banner_u8.imet_header.LocalizedTitles.TITLE_ENGLISH)
+        print(f"  Channel Name: {channel_title}")
+    # Node type 0 is a file and type 1 is a directory. The root node is a directory too, but it isn't counted.
+    file_count = sum(1 for node in u8_archive.u8_node_list if node.type == 0)
+    print(f"  Files: {file_count}")
+    print(f"  Directories: {len(u8_archive.u8_node_list) - file_count - 1}")
+    print(f"  Size: {len(u8_data)} bytes")
+    if compression is not None:
+        print(f"  Compression: {compression} ({compressed_size} bytes compressed)")
+    else:
+        print(f"  Compression: None")
+
+
 def handle_info(args):
     input_path = pathlib.Path(args.input)
 
@@ -243,16 +288,30 @@ def handle_info(args):
         tik.load(input_path.read_bytes())
         _print_ticket_info(tik)
     elif input_path.suffix.lower() == ".wad":
-        title = libWiiPy.title.Title()
-        title.load_wad(input_path.read_bytes())
-        _print_wad_info(title)
+        # WADs are read through a memory map, since only the TMD, Ticket, and banner are needed here.
+        _print_wad_file_info(input_path)
     else:
         # Try file types that have a matchable magic number if we can't tell the easy way.
-        magic_number = open(input_path, "rb").read(8)
+        header = open(input_path, "rb").read(0x84)
+        magic_number = header[0:8]
         if magic_number == b'\x00\x00\x00\x20\x49\x73\x00\x00' or magic_number == b'\x00\x00\x00\x20\x69\x62\x00\x00':
-            title = libWiiPy.title.Title()
-            title.load_wad(input_path.read_bytes())
-            _print_wad_info(title)
+            _print_wad_file_info(input_path)
+            return
+        elif detect_compression(header) is not None or _is_u8_archive(header):
+            # Compressed files are decompressed to find out what's inside of them. Archives (and banners) get their
+            # own info, and anything else just gets info about the compression.
+            data = input_path.read_bytes()
+            try:
+                decompressed = decompress(data)
+            except ValueError as e:
+                fatal_error(f"The specified file could not be decompressed: {e}")
+            if _is_u8_archive(decompressed.data):
+                _print_u8_info(decompressed.data, decompressed.compression, len(data))
+            else:
+                print("Compressed Data Info")
+                print(f"  Compression: {decompressed.compression}")
+                print(f"  Compressed Size: {len(data)} bytes")
+                print(f"  Decompressed Size: {len(decompressed.data)} bytes")
             return
         else:
             fatal_error("This does not appear to be a supported file type! No info can be provided.")
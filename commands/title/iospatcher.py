@@ -4,6 +4,8 @@
 import pathlib
 import libWiiPy
 from modules.core import fatal_error
+from modules.fakesign import fakesign_title
+from modules.wad import load_wad_file, write_title_wad
 
 
 def _patch_fakesigning(ios_patcher: libWiiPy.title.IOSPatcher) -> int:
@@ -68,8 +70,7 @@ def handle_iospatch(args):
     if not input_path.exists():
         fatal_error(f"The specified IOS file \"{input_path}\" does not exist!")
 
-    title = libWiiPy.title.Title()
-    title.load_wad(input_path.read_bytes())
+    title = load_wad_file(input_path, output_path)
 
     tid = title.tmd.title_id
     if tid[:8] != "00000001" or tid[8:] == "00000001" or tid[8:] == "00000002":
@@ -121,7 +122,7 @@ def handle_iospatch(args):
             if ios_patcher.dip_module_index != -1:
                 ios_patcher.title.content.content_records[ios_patcher.dip_module_index].content_type = 1
 
-        ios_patcher.title.fakesign()  # Signature is broken anyway, so fakesign for maximum installation openings
-        output_path.write_bytes(ios_patcher.title.dump_wad())
+        fakesign_title(ios_patcher.title)  # Signature is broken anyway, so fakesign for maximum installation openings
+        write_title_wad(output_path, ios_patcher.title)
 
     print("IOS successfully patched!")
@@ -1,11 +1,18 @@
 # "commands/title/nus.py" from WiiPy by NinjaCheetah
 # https://github.com/NinjaCheetah/WiiPy
 
-import hashlib
+import concurrent.futures
 import pathlib
 import binascii
+import sys
+import tempfile
+import time
 import libWiiPy
 from modules.core import fatal_error
+from modules.cache import NUSCache
+from modules.nus import (download_content_to_file, fetch_cert_chain, fetch_content_to_file, fetch_ticket, fetch_tmd,
+                         open_session)
+from modules.wad import write_wad
 
 
 def handle_nus_content(args):
@@ -16,6 +23,7 @@ def handle_nus_content(args):
         decrypt_content = True
     else:
         decrypt_content = False
+    cache = None if args.no_cache else NUSCache()
 
     # Only accepting the 000000xx format because it's the one that would be most commonly known, rather than using the
     # actual integer that the hex Content ID translates to.
@@ -35,86 +43,65 @@ def handle_nus_content(args):
     # Ensure that a version was supplied before downloading, because we need the matching TMD for decryption to work.
     if decrypt_content is True and version is None:
         fatal_error("You must specify the version that the requested content belongs to for decryption!")
+    # Contents are cached by the hash in their record, so without a version there's no TMD to find that hash in.
+    if args.offline and version is None:
+        fatal_error("You must specify the version that the requested content belongs to when using --offline!")
 
-    # Try to download the content, and catch the ValueError libWiiPy will throw if it can't be found.
-    print(f"Downloading content with Content ID {cid}...")
-    content_data = None
-    try:
-        content_data = libWiiPy.title.download_content(tid, content_id)
-    except ValueError:
-        fatal_error("The specified Title ID or Content ID could not be found!")
+    # Find the record for the content in the TMD for the specified version, if one was specified.
+    record = None
+    if version is not None:
+        tmd = libWiiPy.title.TMD()
+        try:
+            tmd.load(fetch_tmd(tid, version, cache=cache, offline=args.offline))
+        except ValueError as e:
+            fatal_error(str(e))
+        for content_record in tmd.content_records:
+            if content_record.content_id == content_id:
+                record = content_record
+        # If no record was found, then the content doesn't exist in this version, which most likely means that the
+        # wrong version was specified.
+        if record is None and decrypt_content is True:
+            fatal_error("Content was not found in the TMD for the specified version! Content cannot be decrypted.")
+        elif record is None and args.offline:
+            fatal_error("Content was not found in the TMD for the specified version!")
 
+    # Try to get a Ticket for the title, if a common one is available.
+    title_key = None
     if decrypt_content is True:
         output_path = output_path.with_suffix(".app")
-        tmd = libWiiPy.title.TMD()
-        tmd.load(libWiiPy.title.download_tmd(tid, version))
-        # Try to get a Ticket for the title, if a common one is available.
-        ticket = None
+        ticket = libWiiPy.title.Ticket()
         try:
-            ticket = libWiiPy.title.Ticket()
-            ticket.load(libWiiPy.title.download_ticket(tid, wiiu_endpoint=True))
+            ticket.load(fetch_ticket(tid, wiiu_endpoint=True, cache=cache, offline=args.offline))
         except ValueError:
             fatal_error("No Ticket is available! Content cannot be decrypted.")
+        title_key = ticket.get_title_key()
 
-        content_hash = 'gggggggggggggggggggggggggggggggggggggggg'
-        content_size = 0
-        content_index = 0
-        for record in tmd.content_records:
-            if record.content_id == content_id:
-                content_hash = record.content_hash.decode()
-                content_size = record.content_size
-                content_index = record.index
-
-        # If the default hash never changed, then a content record matching the downloaded content couldn't be found,
-        # which most likely means that the wrong version was specified.
-        if content_hash == 'gggggggggggggggggggggggggggggggggggggggg':
-            fatal_error("Content was not found in the TMD for the specified version! Content cannot be decrypted.")
-
-        # Manually decrypt the content and verify its hash, which is what libWiiPy's get_content() methods do. We just
-        # can't really use that here because that require setting up a lot more of the title than is necessary.
-        content_dec = libWiiPy.title.decrypt_content(content_data, ticket.get_title_key(), content_index, content_size)
-        content_dec_hash = hashlib.sha1(content_dec).hexdigest()
-        if content_hash != content_dec_hash:
-            fatal_error("The decrypted content provided does not match the record at the provided index. \n"
-                        "Expected hash is: {}\n".format(content_hash) +
-                        "Actual hash is: {}".format(content_dec_hash))
-        output_path.write_bytes(content_dec)
-    else:
-        output_path.write_bytes(content_data)
+    # Try to download the content, and catch the ValueError that will be thrown if it can't be found. Decrypted contents
+    # are decrypted and verified against their record while they're being written.
+    print(f"Downloading content with Content ID {cid}...")
+    try:
+        if record is None:
+            download_content_to_file(tid, content_id, output_path)
+        elif decrypt_content is True:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                fetch_content_to_file(tid, record, pathlib.Path(tmp_dir).joinpath(f"{content_id:08X}".lower()),
+                                      title_key, output_path, cache=cache, offline=args.offline)
+        else:
+            fetch_content_to_file(tid, record, output_path, cache=cache, offline=args.offline)
+    except ValueError as e:
+        fatal_error(str(e))
 
     print(f"Downloaded content with Content ID \"{cid}\"!")
 
 
-def handle_nus_title(args):
-    title_version = None
-    wad_file = None
-    output_dir = None
+def _download_title(tid: str, title_version: int | None, output_dir: pathlib.Path | None,
+                    wad_file: pathlib.Path | None, executor: concurrent.futures.Executor, jobs: int,
+                    wiiu_nus_enabled: bool, endpoint_override: str | None, cache: NUSCache | None,
+                    offline: bool) -> int:
+    # Downloads a single title, either to a directory or into a WAD. Contents are downloaded by the provided executor,
+    # which is shared between titles when downloading from a list. Returns the number of bytes downloaded, and raises a
+    # ValueError if anything goes wrong.
     can_decrypt = False
-    tid = args.tid
-    wiiu_nus_enabled = False if args.wii else True
-    endpoint_override = args.endpoint if args.endpoint else None
-
-    # Check if --version was passed, because it'll be None if it wasn't.
-    if args.version is not None:
-        try:
-            title_version = int(args.version)
-        except ValueError:
-            fatal_error("The specified Title Version must be a valid integer!")
-
-    # If --wad was passed, check to make sure the path is okay.
-    if args.wad is not None:
-        wad_file = pathlib.Path(args.wad)
-        if wad_file.suffix != ".wad":
-            wad_file = wad_file.with_suffix(".wad")
-
-    # If --output was passed, make sure the directory either doesn't exist or is empty.
-    if args.output is not None:
-        output_dir = pathlib.Path(args.output)
-        if output_dir.exists():
-            if output_dir.is_file():
-                fatal_error("A file already exists with the provided directory name!")
-        else:
-            output_dir.mkdir()
 
     # Download the title from the NUS. This is done "manually" (as opposed to using download_title()) so that we can
     # provide verbose output.
@@ -126,14 +113,11 @@ def handle_nus_title(args):
     else:
         print(f"Downloading title {tid} vLatest, please wait...")
     print(" - Downloading and parsing TMD...")
-    # Download a specific TMD version if a version was specified, otherwise just download the latest TMD.
-    if title_version is not None:
-        title.load_tmd(libWiiPy.title.download_tmd(tid, title_version, wiiu_endpoint=wiiu_nus_enabled,
-                                                   endpoint_override=endpoint_override))
-    else:
-        title.load_tmd(libWiiPy.title.download_tmd(tid, wiiu_endpoint=wiiu_nus_enabled,
-                                                   endpoint_override=endpoint_override))
-        title_version = title.tmd.title_version
+    # Download a specific TMD version if a version was specified, otherwise just download the latest TMD. Anything
+    # that's already in the local NUS cache is loaded from there instead of being downloaded again.
+    title.load_tmd(fetch_tmd(tid, title_version, wiiu_endpoint=wiiu_nus_enabled, endpoint_override=endpoint_override,
+                             cache=cache, offline=offline))
+    title_version = title.tmd.title_version
     # Write out the TMD to a file.
     if output_dir is not None:
         output_dir.joinpath(f"tmd.{title_version}").write_bytes(title.tmd.dump())
@@ -141,8 +125,8 @@ def handle_nus_title(args):
     # Download the ticket, if we can.
     print(" - Downloading and parsing Ticket...")
     try:
-        title.load_ticket(libWiiPy.title.download_ticket(tid, wiiu_endpoint=wiiu_nus_enabled,
-                                                         endpoint_override=endpoint_override))
+        title.load_ticket(fetch_ticket(tid, wiiu_endpoint=wiiu_nus_enabled, endpoint_override=endpoint_override,
+                                       cache=cache, offline=offline))
         can_decrypt = True
         if output_dir is not None:
             output_dir.joinpath("tik").write_bytes(title.ticket.dump())
@@ -151,54 +135,192 @@ def handle_nus_title(args):
         # ticket so that they aren't attempted later.
         print("  - No Ticket is available!")
         if wad_file is not None and output_dir is None:
-            fatal_error("--wad was passed, but this title has no common ticket and cannot be packed into a WAD!")
+            raise ValueError("--wad was passed, but this title has no common ticket and cannot be packed into a WAD!")
 
-    # Load the content records from the TMD, and begin iterating over the records.
+    # Load the content records from the TMD, and then download all the contents. Contents are downloaded in parallel
+    # by a pool of workers when --jobs is greater than 1. Each content is streamed straight to a file rather than being
+    # held in memory, and if a Ticket is available it's decrypted and verified against its record as it arrives. When
+    # only a WAD was requested, the encrypted contents go to a temporary directory and the WAD is assembled from there.
+    # When downloading to a directory, contents that are already there from an earlier run are checked and skipped, and
+    # partially downloaded ones are resumed from where they left off.
     title.load_content_records()
-    content_list = []
-    for content in range(len(title.tmd.content_records)):
-        # Generate the content file name by converting the Content ID to hex and then removing the 0x.
-        content_file_name = hex(title.tmd.content_records[content].content_id)[2:]
-        while len(content_file_name) < 8:
-            content_file_name = "0" + content_file_name
-        print(f" - Downloading content {content + 1} of {len(title.tmd.content_records)} "
-              f"(Content ID: {title.tmd.content_records[content].content_id}, "
-              f"Size: {title.tmd.content_records[content].content_size} bytes)...")
-        content_list.append(libWiiPy.title.download_content(tid, title.tmd.content_records[content].content_id,
-                                                            wiiu_endpoint=wiiu_nus_enabled,
-                                                            endpoint_override=endpoint_override))
-        print("   - Done!")
-        # If we're supposed to be outputting to a folder, then write these files out.
-        if output_dir is not None:
-            output_dir.joinpath(content_file_name).write_bytes(content_list[content])
-    title.content.content_list = content_list
+    content_records = title.tmd.content_records
+    title_key = title.ticket.get_title_key() if can_decrypt else None
+    if output_dir is not None and can_decrypt is False:
+        print("Title has no Ticket, so content will not be decrypted!")
 
-    # Try to decrypt the contents for this title if a ticket was available.
-    if output_dir is not None:
-        if can_decrypt is True:
-            for content in range(len(title.tmd.content_records)):
-                print(f" - Decrypting content {content + 1} of {len(title.tmd.content_records)} "
-                      f"(Content ID: {title.tmd.content_records[content].content_id})...")
-                dec_content = title.get_content_by_index(content)
-                content_file_name = f"{title.tmd.content_records[content].content_id:08X}".lower() + ".app"
-                output_dir.joinpath(content_file_name).write_bytes(dec_content)
-        else:
-            print("Title has no Ticket, so content will not be decrypted!")
-
-    # If --wad was passed, pack a WAD and output that.
-    if wad_file is not None:
-        # Get the WAD certificate chain.
-        print(" - Building certificate...")
-        title.load_cert_chain(libWiiPy.title.download_cert_chain(wiiu_endpoint=wiiu_nus_enabled,
-                                                                 endpoint_override=endpoint_override))
-        # Ensure that the path ends in .wad, and add that if it doesn't.
-        print("Packing WAD...")
-        if wad_file.suffix != ".wad":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        content_dir = output_dir if output_dir is not None else pathlib.Path(tmp_dir)
+        content_files = [content_dir.joinpath(f"{record.content_id:08X}".lower()) for record in content_records]
+
+        print(f" - Downloading {len(content_records)} content(s) using {jobs} worker(s)...")
+        download_start = time.perf_counter()
+        download_size = 0
+        futures = {}
+        for index in range(len(content_records)):
+            dec_path = content_files[index].with_suffix(".app") if output_dir is not None else None
+            future = executor.submit(fetch_content_to_file, tid, content_records[index], content_files[index],
+                                     title_key, dec_path, wiiu_nus_enabled, endpoint_override, cache, offline,
+                                     output_dir is not None)
+            futures[future] = index
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                content = futures[future]
+                download_size += future.result()
+                print(f"   - Downloaded content {content + 1} of {len(content_records)} "
+                      f"(Content ID: {content_records[content].content_id}, "
+                      f"Size: {content_records[content].content_size} bytes)")
+        except BaseException:
+            # Stop anything that hasn't started yet, and wait for anything that has so that the temporary directory
+            # isn't removed out from under it. This has to happen no matter what went wrong, including errors that
+            # aren't ValueErrors and Ctrl+C.
+            for future in futures:
+                future.cancel()
+            concurrent.futures.wait(futures)
+            raise
+        download_time = time.perf_counter() - download_start
+        print(f"   - Downloaded {round(download_size / 1048576, 2)} MB in {round(download_time, 2)}s "
+              f"({round(download_size / 1048576 / max(download_time, 0.001), 2)} MB/s)")
+
+        # If --wad was passed, pack a WAD and output that.
+        if wad_file is not None:
+            # Get the WAD certificate chain.
+            print(" - Building certificate...")
+            title.load_cert_chain(fetch_cert_chain(wiiu_endpoint=wiiu_nus_enabled,
+                                                   endpoint_override=endpoint_override, cache=cache, offline=offline))
+            # Ensure that the path ends in .wad, and add that if it doesn't.
+            print("Packing WAD...")
+            if wad_file.suffix != ".wad":
+                wad_file = wad_file.with_suffix(".wad")
+            # Write the WAD out section by section, copying each content in from the files it was downloaded to.
+            wad_type = "ib" if title.tmd.title_id == "0000000100000001" else "Is"
+            write_wad(wad_file, title.cert_chain.dump(), title.ticket.dump(), title.tmd.dump(), content_records,
+                      content_files, wad_type=wad_type)
+
+    print(f"Downloaded title with Title ID \"{tid}\"!")
+    return download_size
+
+
+def _read_title_list(list_path: pathlib.Path) -> list[tuple[str, int | None]]:
+    # Title lists have one Title ID per line, optionally followed by a version. Blank lines and lines starting with #
+    # are skipped, so lists can be commented.
+    titles = []
+    for line_num, line in enumerate(list_path.read_text().splitlines(), start=1):
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        fields = line.split()
+        if len(fields) > 2 or len(fields[0]) != 16:
+            fatal_error(f"Line {line_num} of the title list is invalid! Each line must contain a 16 character Title "
+                        f"ID, optionally followed by a version.")
+        try:
+            version = int(fields[1].lstrip("vV")) if len(fields) == 2 else None
+        except ValueError:
+            fatal_error(f"The version on line {line_num} of the title list must be a valid integer!")
+        titles.append((fields[0].upper(), version))
+    return titles
+
+
+def handle_nus_title(args):
+    title_version = None
+    wad_file = None
+    output_dir = None
+    wiiu_nus_enabled = False if args.wii else True
+    endpoint_override = args.endpoint if args.endpoint else None
+    jobs = args.jobs
+    cache = None if args.no_cache else NUSCache()
+
+    # Check if --version was passed, because it'll be None if it wasn't.
+    if args.version is not None:
+        try:
+            title_version = int(args.version)
+        except ValueError:
+            fatal_error("The specified Title Version must be a valid integer!")
+
+    if jobs < 1:
+        fatal_error("The number of download jobs must be at least 1!")
+
+    # Either a single Title ID or a list of them can be downloaded, but not both.
+    if args.list is not None:
+        if args.tid is not None or title_version is not None:
+            fatal_error("A Title ID or version cannot be specified when downloading from a title list!")
+        list_path = pathlib.Path(args.list)
+        if not list_path.exists():
+            fatal_error(f"The specified title list \"{list_path}\" does not exist!")
+        titles = _read_title_list(list_path)
+        if not titles:
+            fatal_error("No Title IDs were found in the provided title list!")
+    elif args.tid is None:
+        fatal_error("You must specify either a Title ID or a title list to download!")
+    else:
+        titles = [(args.tid, title_version)]
+
+    # If --wad was passed, check to make sure the path is okay. When downloading from a list, it's instead treated as a
+    # directory to put each title's WAD in.
+    if args.wad is not None:
+        wad_file = pathlib.Path(args.wad)
+        if args.list is not None:
+            if wad_file.is_file():
+                fatal_error("A file already exists with the provided directory name!")
+            wad_file.mkdir(parents=True, exist_ok=True)
+        elif wad_file.suffix != ".wad":
             wad_file = wad_file.with_suffix(".wad")
-        # Have libWiiPy dump the WAD, and write that data out.
-        pathlib.Path(wad_file).write_bytes(title.dump_wad())
 
-    print(f"Downloaded title with Title ID \"{args.tid}\"!")
+    # If --output was passed, make sure the path isn't a file. An existing directory is fine, since it most likely holds
+    # an earlier run of the same download, which will be resumed rather than started over.
+    if args.output is not None:
+        output_dir = pathlib.Path(args.output)
+        if output_dir.exists():
+            if output_dir.is_file():
+                fatal_error("A file already exists with the provided directory name!")
+        else:
+            output_dir.mkdir()
+
+    # Every request goes through one shared session, and every content download through one shared pool of workers,
+    # so --jobs limits the total number of downloads running at once no matter how many titles are being downloaded.
+    # This also means that connections to the NUS are kept alive and reused from one title to the next.
+    open_session(jobs)
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for tid, version in titles:
+            title_output_dir = output_dir
+            title_wad_file = wad_file
+            if args.list is not None:
+                title_name = tid if version is None else f"{tid}-v{version}"
+                if output_dir is not None:
+                    title_output_dir = output_dir.joinpath(title_name)
+                    title_output_dir.mkdir(exist_ok=True)
+                if wad_file is not None:
+                    title_wad_file = wad_file.joinpath(f"{title_name}.wad")
+            title_start = time.perf_counter()
+            try:
+                title_size = _download_title(tid, version, title_output_dir, title_wad_file, executor, jobs,
+                                             wiiu_nus_enabled, endpoint_override, cache, args.offline)
+            except ValueError as e:
+                if args.list is None:
+                    fatal_error(str(e))
+                print(f"\033[31mError:\033[0m {e}")
+                results.append((tid, version, 0, time.perf_counter() - title_start, str(e).splitlines()[0]))
+                continue
+            results.append((tid, version, title_size, time.perf_counter() - title_start, None))
+
+    # When downloading from a list, finish with a summary of every title, since earlier output will have scrolled away.
+    if args.list is not None:
+        failed_count = 0
+        total_size = 0
+        print(f"\nSummary:")
+        for tid, version, title_size, title_time, error in results:
+            total_size += title_size
+            version_str = "vLatest" if version is None else f"v{version}"
+            if error is None:
+                print(f"  {tid} {version_str}: {round(title_size / 1048576, 2)} MB in {round(title_time, 2)}s")
+            else:
+                failed_count += 1
+                print(f"  {tid} {version_str}: failed after {round(title_time, 2)}s ({error})")
+        print(f"Downloaded {len(results) - failed_count} of {len(results)} title(s), "
+              f"{round(total_size / 1048576, 2)} MB in total.")
+        if failed_count > 0:
+            sys.exit(1)
 
 
 def handle_nus_tmd(args):
@@ -226,8 +348,10 @@ def handle_nus_tmd(args):
     print(f"Downloading TMD for title {tid}...")
     tmd_data = None
     try:
-        tmd_data = libWiiPy.title.download_tmd(tid, version)
+        tmd_data = fetch_tmd(tid, version, cache=NUSCache() if not args.no_cache else None, offline=args.offline)
     except ValueError:
+        if args.offline:
+            fatal_error("The specified Title ID or version is not in the local NUS cache!")
         fatal_error("The specified Title ID or version could not be found!")
 
     output_path.write_bytes(tmd_data)
@@ -4,6 +4,7 @@
 import pathlib
 import libWiiPy
 from modules.core import fatal_error
+from modules.fakesign import fakesign_tmd
 from modules.title import title_edit_ios, title_edit_tid, title_edit_type
 
 
@@ -37,7 +38,7 @@ def handle_tmd_edit(args):
         fatal_error("You must specify at least one change to make!")
 
     # Fakesign the title since any changes have already invalidated the signature.
-    tmd.fakesign()
+    fakesign_tmd(tmd)
     output_path.write_bytes(tmd.dump())
 
     print("Successfully edited TMD file!")
@@ -63,7 +64,7 @@ def handle_tmd_remove(args):
         tmd.content_records.pop(args.index)
         tmd.num_contents -= 1
         # Auto fakesign because we've edited the TMD.
-        tmd.fakesign()
+        fakesign_tmd(tmd)
         output_path.write_bytes(tmd.dump())
         print(f"Removed content record at index {args.index}!")
 
@@ -80,6 +81,6 @@ def handle_tmd_remove(args):
         tmd.content_records.pop(valid_ids.index(target_cid))
         tmd.num_contents -= 1
         # Auto fakesign because we've edited the TMD.
-        tmd.fakesign()
+        fakesign_tmd(tmd)
         output_path.write_bytes(tmd.dump())
         print(f"Removed content record with Content ID \"{target_cid:08X}\"!")
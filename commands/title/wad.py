@@ -1,12 +1,17 @@
 # "commands/title/wad.py" from WiiPy by NinjaCheetah
 # https://github.com/NinjaCheetah/WiiPy
 
+import concurrent.futures
 import io
 import pathlib
+from contextlib import nullcontext
 from random import randint
 import libWiiPy
+from modules.compression import compress, decompress
 from modules.core import fatal_error
+from modules.fakesign import fakesign_title
 from modules.title import title_edit_ios, title_edit_tid, title_edit_type
+from modules.wad import WADReader, decrypt_wad_content, load_wad_file, load_wad_metadata, write_title_wad
 
 
 def handle_wad_add(args):
@@ -22,8 +27,7 @@ def handle_wad_add(args):
     if not content_path.exists():
         fatal_error(f"The specified content file \"{content_path}\" does not exist!")
 
-    title = libWiiPy.title.Title()
-    title.load_wad(input_path.read_bytes())
+    title = load_wad_file(input_path, output_path)
     content_data = content_path.read_bytes()
 
     # Prepare the CID so it's ready when we go to add this content to the WAD.
@@ -63,8 +67,8 @@ def handle_wad_add(args):
     title.add_content(content_data, target_cid, target_type)
 
     # Auto fakesign because we've edited the title.
-    title.fakesign()
-    output_path.write_bytes(title.dump_wad())
+    fakesign_title(title)
+    write_title_wad(output_path, title)
 
     print(f"Successfully added new content with Content ID \"{target_cid:08X}\" and type \"{target_type.name}\"!")
 
@@ -97,8 +101,8 @@ def handle_wad_convert(args):
     if not input_path.exists():
         fatal_error(f"The specified WAD file \"{input_path}\" does not exist!")
 
-    title = libWiiPy.title.Title()
-    title.load_wad(input_path.read_bytes())
+    # Only the Ticket and TMD change when converting, so the contents are copied over from the input untouched.
+    title = load_wad_metadata(input_path, output_path)
     # First, verify that this WAD isn't already the type we're trying to convert to.
     if title.ticket.is_dev and target == "development":
         fatal_error("This is already a development WAD!")
@@ -134,8 +138,8 @@ def handle_wad_convert(args):
             title_key_new = libWiiPy.title.encrypt_title_key(title_key, 2, title.ticket.title_id, False)
             title.ticket.common_key_index = 2
     title.ticket.title_key_enc = title_key_new
-    title.fakesign()
-    output_path.write_bytes(title.dump_wad())
+    fakesign_title(title)
+    write_title_wad(output_path, title)
     print(f"Successfully converted {source} WAD to {target} WAD \"{output_path.name}\"!")
 
 
@@ -146,8 +150,12 @@ def handle_wad_edit(args):
     else:
         output_path = pathlib.Path(args.input)
 
-    title = libWiiPy.title.Title()
-    title.load_wad(input_path.read_bytes())
+    # Changing the Title ID, IOS, or type only changes the TMD and Ticket, so unless the Channel name is being changed,
+    # which requires editing the banner, the contents are copied over from the input untouched.
+    if args.channel_name is None:
+        title = load_wad_metadata(input_path, output_path)
+    else:
+        title = load_wad_file(input_path, output_path)
 
     # State variable to make sure that changes are made.
     edits_made = False
@@ -165,9 +173,13 @@ def handle_wad_edit(args):
         title.set_title_id(new_tid)
         edits_made = True
     if args.channel_name is not None:
-        # Assess if this is actually a channel, because a channel name can't be set otherwise.
-        banner_data = title.get_content_by_index(0)
-        with io.BytesIO(banner_data) as data:
+        # Assess if this is actually a channel, because a channel name can't be set otherwise. Banners are sometimes
+        # compressed, in which case the edited banner is compressed again the same way before it's written back.
+        try:
+            banner = decompress(title.get_content_by_index(0))
+        except ValueError as e:
+            fatal_error(f"The Channel's banner could not be decompressed: {e}")
+        with io.BytesIO(banner.data) as data:
             data.seek(0x40)
             magic = data.read(4)
             if magic != b'\x49\x4D\x45\x54':
@@ -195,15 +207,21 @@ def handle_wad_edit(args):
             data.seek(target)
             data.write(imet_data)
             data.seek(0x0)
-            title.set_content(data.read(), 0)
+            banner_data = data.read()
+            if banner.compression is not None:
+                try:
+                    banner_data = compress(banner_data, banner.compression, banner.ash_tree_bits)
+                except ValueError as e:
+                    fatal_error(f"The Channel's banner could not be compressed again: {e}")
+            title.set_content(banner_data, 0)
         edits_made = True
 
     if not edits_made:
         fatal_error("You must specify at least one change to make!")
 
     # Fakesign the title since any changes have already invalidated the signature.
-    title.fakesign()
-    output_path.write_bytes(title.dump_wad())
+    fakesign_title(title)
+    write_title_wad(output_path, title)
 
     print("Successfully edited WAD file!")
 
@@ -279,8 +297,8 @@ def handle_wad_pack(args):
 
     # Fakesign the TMD and Ticket using the trucha bug, if enabled. This is built-in in libWiiPy v0.4.1+.
     if args.fakesign:
-        title.fakesign()
-    output_path.write_bytes(title.dump_wad())
+        fakesign_title(title)
+    write_title_wad(output_path, title)
 
     print("WAD file packed!")
 
@@ -295,8 +313,7 @@ def handle_wad_remove(args):
     if not input_path.exists():
         fatal_error(f"The specified WAD file \"{input_path}\" does not exist!")
 
-    title = libWiiPy.title.Title()
-    title.load_wad(input_path.read_bytes())
+    title = load_wad_file(input_path, output_path)
 
     # TODO: see if this implementation is problematic now
     if args.index is not None:
@@ -308,8 +325,8 @@ def handle_wad_remove(args):
             fatal_error("The specified content index could not be found in this title!")
         title.content.remove_content_by_index(args.index)
         # Auto fakesign because we've edited the title.
-        title.fakesign()
-        output_path.write_bytes(title.dump_wad())
+        fakesign_title(title)
+        write_title_wad(output_path, title)
         print(f"Removed content at content index {args.index}!")
 
     elif args.cid is not None:
@@ -324,8 +341,8 @@ def handle_wad_remove(args):
             fatal_error("The specified Content ID could not be found in this title!")
         title.content.remove_content_by_cid(target_cid)
         # Auto fakesign because we've edited the title.
-        title.fakesign()
-        output_path.write_bytes(title.dump_wad())
+        fakesign_title(title)
+        write_title_wad(output_path, title)
         print(f"Removed content with Content ID \"{target_cid:08X}\"!")
 
 
@@ -342,8 +359,7 @@ def handle_wad_set(args):
     if not content_path.exists():
         fatal_error(f"The specified content file \"{content_path}\" does not exist!")
 
-    title = libWiiPy.title.Title()
-    title.load_wad(input_path.read_bytes())
+    title = load_wad_file(input_path, output_path)
     content_data = content_path.read_bytes()
 
     # Get the new type of the content, if one was specified.
@@ -371,8 +387,8 @@ def handle_wad_set(args):
         else:
             title.set_content(content_data, args.index)
         # Auto fakesign because we've edited the title.
-        title.fakesign()
-        output_path.write_bytes(title.dump_wad())
+        fakesign_title(title)
+        write_title_wad(output_path, title)
         print(f"Replaced content at content index {args.index}!")
 
 
@@ -392,17 +408,35 @@ def handle_wad_set(args):
         else:
             title.set_content(content_data, target_index)
         # Auto fakesign because we've edited the title.
-        title.fakesign()
-        output_path.write_bytes(title.dump_wad())
+        fakesign_title(title)
+        write_title_wad(output_path, title)
         print(f"Replaced content with Content ID \"{target_cid:08X}\"!")
 
 
+def _check_unpacked_content(record, content: int, content_hash: str, skip_hash: bool, tmp_path: pathlib.Path,
+                            content_path: pathlib.Path) -> None:
+    # Matches the hash checking that libWiiPy does when getting a content. Contents are decrypted to a temporary file,
+    # which is only moved into place once its hash has been checked, so a content that doesn't match is never left in
+    # the output directory.
+    if content_hash != record.content_hash.decode():
+        if skip_hash:
+            print("Ignoring hash mismatch for content index " + str(content))
+        else:
+            tmp_path.unlink(missing_ok=True)
+            fatal_error(f"Content at index {content} does not match its record! The WAD may be corrupted.\n"
+                        f"Expected hash is: {record.content_hash.decode()}\n"
+                        f"Actual hash is: {content_hash}")
+    tmp_path.replace(content_path)
+
+
 def handle_wad_unpack(args):
     input_path = pathlib.Path(args.input)
     output_path = pathlib.Path(args.output)
 
     if not input_path.exists():
         fatal_error(f"The specified WAD file \"{input_path}\" does not exist!")
+    if args.jobs < 1:
+        fatal_error("The number of jobs must be at least 1!")
     # Check if the output path already exists, and if it does, ensure that it is both a directory and empty.
     if output_path.exists():
         if output_path.is_file():
@@ -410,9 +444,13 @@ def handle_wad_unpack(args):
     else:
         output_path.mkdir()
 
-    # Step through each component of a WAD and dump it to a file.
-    title = libWiiPy.title.Title()
-    title.load_wad(input_path.read_bytes())
+    # Step through each component of a WAD and dump it to a file. The WAD is read through a memory map, so only the
+    # sections that are actually needed get read from disk.
+    try:
+        wad_reader = WADReader(input_path)
+    except ValueError as e:
+        fatal_error(str(e))
+    title = wad_reader.load_title()
 
     cert_name = title.tmd.title_id + ".cert"
     output_path.joinpath(cert_name).write_bytes(title.wad.get_cert_data())
@@ -432,9 +470,38 @@ def handle_wad_unpack(args):
     else:
         skip_hash = False
 
-    for content_file in range(0, title.tmd.num_contents):
-        content_index = title.content.content_records[content_file].index
-        content_file_name = f"{content_index:08X}".lower() + ".app"
-        output_path.joinpath(content_file_name).write_bytes(title.get_content_by_index(content_file, skip_hash))
+    # Decrypt each content straight from the WAD into its own file. With --jobs, contents are spread across a pool of
+    # processes so that decrypting and hashing large titles isn't limited to a single core. Each content is checked
+    # against its record as soon as it's done.
+    content_records = title.content.content_records
+    content_offsets = wad_reader.get_content_offsets(content_records)
+    title_key = title.ticket.get_title_key()
+    wad_reader.close()
+    content_paths = [output_path.joinpath(f"{record.index:08X}".lower() + ".app") for record in content_records]
+    tmp_paths = [content_path.with_suffix(".app.tmp") for content_path in content_paths]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else nullcontext() as executor:
+        futures = {}
+        try:
+            for content in range(len(content_records)):
+                job_args = (input_path, content_offsets[content], content_records[content].index,
+                            content_records[content].content_size, title_key, tmp_paths[content])
+                if executor is None:
+                    _check_unpacked_content(content_records[content], content, decrypt_wad_content(*job_args),
+                                            skip_hash, tmp_paths[content], content_paths[content])
+                else:
+                    futures[executor.submit(decrypt_wad_content, *job_args)] = content
+            for future in concurrent.futures.as_completed(futures):
+                content = futures[future]
+                _check_unpacked_content(content_records[content], content, future.result(), skip_hash,
+                                        tmp_paths[content], content_paths[content])
+        except BaseException:
+            # Stop any contents that haven't been started, and wait for the rest to finish so that none of their
+            # temporary files are left behind.
+            for future in futures:
+                future.cancel()
+            concurrent.futures.wait(futures)
+            for tmp_path in tmp_paths:
+                tmp_path.unlink(missing_ok=True)
+            raise
 
     print("WAD file unpacked!")
@@ -0,0 +1,311 @@
+# "modules/ash.py" from WiiPy by NinjaCheetah
+# https://github.com/NinjaCheetah/WiiPy
+#
+# ASH is the compression format used by the Wii Menu (and a few other titles) for its archives. It's LZ77-style
+# compression where the symbols (literal bytes and match lengths) and the match distances are each stored in their own
+# Huffman-coded bitstream, with the Huffman trees stored at the start of each stream.
+
+import heapq
+import struct
+from modules.lz77 import build_match_chains
+
+_ash_min_length = 3
+# How many earlier positions to check for a match, from closest to furthest.
+_ash_max_chain = 16
+
+
+def _longest_match(data: bytes, pos: int, max_len: int, max_dist: int, prev: list[int]) -> (int, int):
+    # Walk the chain for this position and return the longest match found in the window as (length, distance). This
+    # works like the LZ77 match finder, but ASH matches can be much longer, so they're extended 16 bytes at a time
+    # before finding the exact end of the match.
+    best_len = 0
+    best_dist = 0
+    window_start = pos - max_dist
+    candidate = prev[pos]
+    max_chain = _ash_max_chain
+    while candidate >= 0 and candidate >= window_start and max_chain:
+        if data[candidate + best_len] == data[pos + best_len]:
+            if data[candidate:candidate + max_len] == data[pos:pos + max_len]:
+                return max_len, pos - candidate
+            # The full length didn't match, so the match is guaranteed to end before max_len (and the end of the data).
+            length = _ash_min_length
+            while data[candidate + length:candidate + length + 16] == data[pos + length:pos + length + 16]:
+                length += 16
+            while data[candidate + length] == data[pos + length]:
+                length += 1
+            if length > best_len:
+                best_len = length
+                best_dist = pos - candidate
+        candidate = prev[candidate]
+        max_chain -= 1
+    return best_len, best_dist
+
+
+def _find_matches(data: bytes, max_len: int, max_dist: int) -> (list[int], list[int]):
+    # Split the data into the symbols and distances that make up the two ASH bitstreams. Symbols below 0x100 are
+    # literal bytes, and symbols from 0x100 up are matches of (symbol - 0x100 + 3) bytes, each of which has a distance
+    # stored in the distance stream. Lazy matching is used, where a match is put off by a byte when the next position
+    # has a longer one.
+    prev = build_match_chains(data)
+    size = len(data)
+    last_match_start = size - _ash_min_length
+    symbols = []
+    distances = []
+    pos = 0
+    match_len = 0
+    match_dist = 0
+    while pos < size:
+        if match_len == 0 and pos <= last_match_start:
+            match_len, match_dist = _longest_match(data, pos, min(max_len, size - pos), max_dist, prev)
+        if _ash_min_length <= match_len < max_len and pos < last_match_start:
+            next_len, next_dist = _longest_match(data, pos + 1, min(max_len, size - pos - 1), max_dist, prev)
+            if next_len > match_len:
+                symbols.append(data[pos])
+                pos += 1
+                match_len = next_len
+                match_dist = next_dist
+                continue
+        if match_len >= _ash_min_length:
+            symbols.append(0x100 + match_len - _ash_min_length)
+            distances.append(match_dist - 1)
+            pos += match_len
+        else:
+            symbols.append(data[pos])
+            pos += 1
+        match_len = 0
+    return symbols, distances
+
+
+def _build_tree(values: list[int], width: int) -> (list[str], str):
+    # Build a Huffman tree for the values, and return the code for each value (as a string of bits, indexed by value)
+    # along with the bits that store the tree itself. The tree is stored depth-first, with a 1 for each branch, followed
+    # by its left and right sides, and a 0 for each leaf, followed by the leaf's value in the provided number of bits.
+    counts = [0] * (1 << width)
+    for value in values:
+        counts[value] += 1
+    heap = [(count, value, value) for value, count in enumerate(counts) if count]
+    # The decoder can't read a tree that's only a single leaf, so make sure that there are always at least two, even
+    # if one of them is never used.
+    for value in range(len(counts)):
+        if len(heap) >= 2:
+            break
+        if not counts[value]:
+            heap.append((0, value, value))
+    heapq.heapify(heap)
+    # Ties are broken by the order that nodes were created in, so that the same data always produces the same tree.
+    order = len(counts)
+    while len(heap) > 1:
+        left = heapq.heappop(heap)
+        right = heapq.heappop(heap)
+        heapq.heappush(heap, (left[0] + right[0], order, (left[2], right[2])))
+        order += 1
+    codes = [""] * len(counts)
+    tree_bits = []
+    stack = [(heap[0][2], "")]
+    while stack:
+        node, code = stack.pop()
+        if isinstance(node, tuple):
+            tree_bits.append("1")
+            # Right goes on the stack first so that the left side is written first.
+            stack.append((node[1], code + "1"))
+            stack.append((node[0], code + "0"))
+        else:
+            tree_bits.append("0" + format(node, f"0{width}b"))
+            codes[node] = code
+    return codes, "".join(tree_bits)
+
+
+def _pack_bits(bits: str) -> bytes:
+    # Pack a string of bits into big-endian 32-bit words. The decoder loads the next word as soon as it's finished
+    # with the current one, so there always needs to be at least one more word after the last bit that's used.
+    bit_count = (len(bits) // 32 + 1) * 32
+    return int(bits.ljust(bit_count, "0"), 2).to_bytes(bit_count // 8, 'big')
+
+
+def compress_ash(data: bytes, sym_tree_bits: int = 9, dist_tree_bits: int = 11) -> bytes:
+    # Compresses data into an ASH file using the provided symbol and distance tree leaf widths, which need to match the
+    # ones used to decompress it. The defaults match the ones used by the Wii Menu.
+    if not 9 <= sym_tree_bits <= 16:
+        raise ValueError("The number of symbol tree bits must be between 9 and 16!")
+    if not 1 <= dist_tree_bits <= 16:
+        raise ValueError("The number of distance tree bits must be between 1 and 16!")
+    if len(data) > 0xFFFFFF:
+        raise ValueError("ASH files cannot store more than 16 MiB of data!")
+    # The longest match is the largest symbol that fits in the symbol tree's leaves, and the furthest match is the
+    # largest distance that fits in the distance tree's.
+    max_len = (1 << sym_tree_bits) - 1 - 0x100 + _ash_min_length
+    max_dist = 1 << dist_tree_bits
+    symbols, distances = _find_matches(data, max_len, max_dist)
+    sym_codes, sym_tree = _build_tree(symbols, sym_tree_bits)
+    dist_codes, dist_tree = _build_tree(distances, dist_tree_bits)
+    sym_stream = _pack_bits(sym_tree + "".join(map(sym_codes.__getitem__, symbols)))
+    dist_stream = _pack_bits(dist_tree + "".join(map(dist_codes.__getitem__, distances)))
+    header = b'ASH0' + len(data).to_bytes(4, 'big') + (0xC + len(sym_stream)).to_bytes(4, 'big')
+    return header + sym_stream + dist_stream
+
+
+_read_word = struct.Struct(">I").unpack_from
+# The number of bits looked up at once when decoding. Codes longer than this are finished one bit at a time, but those
+# are rare, since they're the least common symbols.
+_ash_table_bits = 10
+
+
+def _read_tree(src: bytes, pos: int, width: int) -> (int, list[int], list[int], int):
+    # Read a Huffman tree starting at the provided bit position, and return its root along with the left and right
+    # children of each branch and the bit position after the tree. Leaves are numbered by their value and branches are
+    # numbered from (1 << width) up, in the order they're read, which is the same way that libWiiPy reads them.
+    leaf_limit = 1 << width
+    left = [0] * (2 * leaf_limit - 1)
+    right = [0] * (2 * leaf_limit - 1)
+    next_branch = leaf_limit
+    # Each entry is a branch that's still missing a side, as (branch, whether the left side has been read yet).
+    pending = []
+    while True:
+        bit = (src[pos >> 3] >> (7 - (pos & 7))) & 1
+        pos += 1
+        if bit:
+            if next_branch >= len(left):
+                raise ValueError("The tree has too many branches! Incorrect leaf width may have been used.")
+            pending.append([next_branch, False])
+            next_branch += 1
+            continue
+        node = (_read_word(src, pos >> 3)[0] >> (32 - width - (pos & 7))) & (leaf_limit - 1)
+        pos += width
+        # A finished node fills in the next missing side. When that finishes a branch, the branch itself becomes a
+        # finished node for the branch above it, and so on until a branch is still missing its right side.
+        while pending:
+            branch = pending[-1]
+            if not branch[1]:
+                left[branch[0]] = node
+                branch[1] = True
+                break
+            right[branch[0]] = node
+            node = branch[0]
+            pending.pop()
+        if not pending:
+            if node < leaf_limit:
+                raise ValueError("The tree only has a single leaf, which isn't valid in an ASH file!")
+            return node, left, right, pos
+
+
+def _build_table(root: int, left: list[int], right: list[int], leaf_limit: int) -> (list[int], int):
+    # Build a lookup table indexed by the next table_bits bits of the stream. Each entry holds (value << 5) | length
+    # for the leaf those bits lead to, so a whole code is decoded with a single lookup. If the bits don't reach a leaf
+    # yet, the entry instead holds the branch that they do reach with a length of 0, and decoding continues from there.
+    nodes = []
+    stack = [(root, 0, 0)]
+    max_depth = 0
+    while stack:
+        node, code, depth = stack.pop()
+        nodes.append((node, code, depth))
+        if node >= leaf_limit:
+            stack.append((left[node], code << 1, depth + 1))
+            stack.append((right[node], (code << 1) | 1, depth + 1))
+        elif depth > max_depth:
+            max_depth = depth
+    table_bits = min(max_depth, _ash_table_bits)
+    table = [0] * (1 << table_bits)
+    for node, code, depth in nodes:
+        if node < leaf_limit and depth <= table_bits:
+            start = code << (table_bits - depth)
+            table[start:start + (1 << (table_bits - depth))] = [(node << 5) | depth] * (1 << (table_bits - depth))
+        elif node >= leaf_limit and depth == table_bits:
+            table[code] = node << 5
+    return table, table_bits
+
+
+def _is_stream_end(src: bytes, pos: int, end: int, max_padding: int | None) -> bool:
+    # Check whether a stream that was read up to the bit position pos really ends at the bit position end, which is
+    # byte-aligned. Everything in between has to be zeroed padding, and when max_padding is set, there can't be more
+    # of it than that.
+    if pos > end or (max_padding is not None and end - pos > max_padding):
+        return False
+    return (int.from_bytes(src[pos >> 3:end >> 3], 'big') & ((1 << (end - pos)) - 1)) == 0
+
+
+def decompress_ash(ash_data: bytes, sym_tree_bits: int = 9, dist_tree_bits: int = 11, strict: bool = False) -> bytes:
+    # Decompresses an ASH file using the provided symbol and distance tree leaf widths, producing the same output as
+    # libWiiPy's decompress_ash(). Rather than walking the Huffman trees one bit at a time for every symbol, each tree
+    # is turned into a lookup table that decodes most codes in one step, and the output is written into a buffer that's
+    # allocated once up front.
+    # Wrong tree widths can still decode into garbage without running into anything invalid, so strict also requires
+    # both streams to end right where the file says they do, which is what makes it possible to detect the widths.
+    if ash_data[0:4] != b'ASH0':
+        raise ValueError("This is not a valid ASH file!")
+    if len(ash_data) < 0xC:
+        raise ValueError("Invalid ASH data! Cannot decompress.")
+    size = int.from_bytes(ash_data[4:8], 'big') & 0x00FFFFFF
+    # Padding the end means that reading a few bytes ahead never runs off the end of the data. Whether the streams
+    # actually stayed within the file is checked once decompression is done.
+    src = bytes(ash_data) + bytes(8)
+    src_bits = len(ash_data) * 8
+    sym_pos = 0xC * 8
+    dist_pos = int.from_bytes(ash_data[8:12], 'big') * 8
+    dist_start = dist_pos
+    if dist_pos >= src_bits:
+        raise ValueError("Invalid ASH data! Cannot decompress.")
+    sym_limit = 1 << sym_tree_bits
+    dist_limit = 1 << dist_tree_bits
+    try:
+        sym_root, sym_left, sym_right, sym_pos = _read_tree(src, sym_pos, sym_tree_bits)
+        dist_root, dist_left, dist_right, dist_pos = _read_tree(src, dist_pos, dist_tree_bits)
+    except (ValueError, IndexError, struct.error):
+        raise ValueError("Decompression failed while reading the trees! Incorrect leaf widths may have been used. Try "
+                         "using a different number of bits for the symbol or distance tree leaves.")
+    sym_table, sym_table_bits = _build_table(sym_root, sym_left, sym_right, sym_limit)
+    dist_table, dist_table_bits = _build_table(dist_root, dist_left, dist_right, dist_limit)
+    sym_shift = 32 - sym_table_bits
+    sym_mask = (1 << sym_table_bits) - 1
+    dist_shift = 32 - dist_table_bits
+    dist_mask = (1 << dist_table_bits) - 1
+
+    read_word = _read_word
+    out = bytearray(size)
+    pos = 0
+    try:
+        while pos < size:
+            entry = sym_table[(read_word(src, sym_pos >> 3)[0] >> (sym_shift - (sym_pos & 7))) & sym_mask]
+            length = entry & 0x1F
+            sym = entry >> 5
+            if length:
+                sym_pos += length
+            else:
+                sym_pos += sym_table_bits
+                while sym >= sym_limit:
+                    sym = sym_right[sym] if (src[sym_pos >> 3] >> (7 - (sym_pos & 7))) & 1 else sym_left[sym]
+                    sym_pos += 1
+            if sym < 0x100:
+                out[pos] = sym
+                pos += 1
+                continue
+            entry = dist_table[(read_word(src, dist_pos >> 3)[0] >> (dist_shift - (dist_pos & 7))) & dist_mask]
+            length = entry & 0x1F
+            distance = entry >> 5
+            if length:
+                dist_pos += length
+            else:
+                dist_pos += dist_table_bits
+                while distance >= dist_limit:
+                    distance = dist_right[distance] if (src[dist_pos >> 3] >> (7 - (dist_pos & 7))) & 1 \
+                        else dist_left[distance]
+                    dist_pos += 1
+            length = sym - 0x100 + 3
+            distance += 1
+            offset = pos - distance
+            if length > size - pos or offset < 0:
+                raise ValueError("Invalid ASH data! Cannot decompress.")
+            if distance >= length:
+                out[pos:pos + length] = out[offset:offset + length]
+            else:
+                out[pos:pos + length] = (out[offset:pos] * (length // distance + 1))[:length]
+            pos += length
+    except (IndexError, struct.error):
+        raise ValueError("Invalid ASH data! Cannot decompress.")
+    # The symbol stream comes before the distance stream, so it can't have run into it.
+    if sym_pos > dist_start or dist_pos > src_bits:
+        raise ValueError("Invalid ASH data! Cannot decompress.")
+    # Each stream is padded out past the word holding its last bit, since the decoder always loads one word ahead.
+    # The distance stream runs to the end of the file, which might have been padded out further.
+    if strict and not (_is_stream_end(src, sym_pos, dist_start, 63) and _is_stream_end(src, dist_pos, src_bits, None)):
+        raise ValueError("Invalid ASH data! The streams don't end where expected.")
+    return bytes(out)
@@ -0,0 +1,185 @@
+# "modules/cache.py" from WiiPy by NinjaCheetah
+# https://github.com/NinjaCheetah/WiiPy
+
+import hashlib
+import os
+import pathlib
+import tempfile
+import threading
+
+# Default maximum size of the cache, in MiB. Can be overridden with the WIIPY_CACHE_SIZE environment variable.
+_default_max_size = 4096
+_copy_chunk_size = 1048576
+
+
+def get_default_cache_dir() -> pathlib.Path:
+    # Use WIIPY_CACHE_DIR if it's set, otherwise follow each platform's usual spot for cache data.
+    if os.environ.get("WIIPY_CACHE_DIR"):
+        return pathlib.Path(os.environ["WIIPY_CACHE_DIR"])
+    if os.name == "nt" and os.environ.get("LOCALAPPDATA"):
+        return pathlib.Path(os.environ["LOCALAPPDATA"]).joinpath("NinjaCheetah", "WiiPy", "cache")
+    if os.environ.get("XDG_CACHE_HOME"):
+        return pathlib.Path(os.environ["XDG_CACHE_HOME"]).joinpath("wiipy")
+    return pathlib.Path.home().joinpath(".cache", "wiipy")
+
+
+class NUSCache:
+    # An on-disk cache for data downloaded from the NUS. TMDs are keyed by Title ID and version, Tickets by Title ID,
+    # and contents by Title ID and the index and SHA-1 hash from their content record, so a cached content is only
+    # ever reused for the exact content that a TMD asks for. Data from an endpoint other than the official ones is
+    # kept in its own directory for that endpoint, so that it never gets mixed up with data from the real NUS.
+    #
+    # Every entry is stored next to a .sha1 file holding the hash of the stored data, which is checked whenever the
+    # entry is read so that a damaged entry is dropped and downloaded again rather than used. Entries are written to a
+    # temporary file first and then moved into place, so an interrupted write never leaves a partial entry behind.
+    # The modification time of an entry is updated each time it's read, and once the cache grows past its maximum size
+    # the least recently used entries are evicted first.
+    def __init__(self, cache_dir: pathlib.Path = None, max_size: int = None):
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else get_default_cache_dir()
+        if max_size is None:
+            max_size = int(os.environ.get("WIIPY_CACHE_SIZE", _default_max_size)) * 1048576
+        self.max_size = max_size
+        self.current_size = None
+        self.lock = threading.Lock()
+
+    def _entry_path(self, *key: str, endpoint: str = None) -> pathlib.Path:
+        if endpoint is not None:
+            return self.cache_dir.joinpath("endpoint", hashlib.sha1(endpoint.encode()).hexdigest()[:16], *key)
+        return self.cache_dir.joinpath(*key)
+
+    @staticmethod
+    def _hash_path(entry_path: pathlib.Path) -> pathlib.Path:
+        return entry_path.with_name(entry_path.name + ".sha1")
+
+    def _check_entry(self, entry_path: pathlib.Path) -> bool:
+        # Verify an entry against its stored hash. Anything missing or damaged is removed so that it can be replaced.
+        hash_path = self._hash_path(entry_path)
+        if not entry_path.exists() or not hash_path.exists():
+            return False
+        entry_hash = hashlib.sha1()
+        with open(entry_path, "rb") as entry_file:
+            while chunk := entry_file.read(_copy_chunk_size):
+                entry_hash.update(chunk)
+        if entry_hash.hexdigest() != hash_path.read_text().strip():
+            self._remove_entry(entry_path)
+            return False
+        # Mark this entry as recently used.
+        os.utime(entry_path)
+        return True
+
+    def _remove_entry(self, entry_path: pathlib.Path) -> None:
+        with self.lock:
+            for path in (entry_path, self._hash_path(entry_path)):
+                try:
+                    size = path.stat().st_size
+                    path.unlink()
+                    if self.current_size is not None:
+                        self.current_size -= size
+                except FileNotFoundError:
+                    pass
+
+    def _store_entry(self, entry_path: pathlib.Path, source) -> None:
+        # Write an entry from either bytes or a path to a file, hashing it along the way.
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        entry_hash = hashlib.sha1()
+        fd, tmp_name = tempfile.mkstemp(dir=entry_path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                if isinstance(source, pathlib.Path):
+                    with open(source, "rb") as source_file:
+                        while chunk := source_file.read(_copy_chunk_size):
+                            entry_hash.update(chunk)
+                            tmp_file.write(chunk)
+                else:
+                    entry_hash.update(source)
+                    tmp_file.write(source)
+            self._hash_path(entry_path).write_text(entry_hash.hexdigest())
+            os.replace(tmp_name, entry_path)
+        except OSError:
+            # The cache is only ever an optimization, so failing to write to it shouldn't stop anything.
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+            return
+        with self.lock:
+            if self.current_size is None:
+                self.current_size = self._scan_size()
+            else:
+                self.current_size += entry_path.stat().st_size
+        self._evict()
+
+    def _scan_size(self) -> int:
+        if not self.cache_dir.exists():
+            return 0
+        return sum(file.stat().st_size for file in self.cache_dir.rglob("*") if file.is_file())
+
+    def _evict(self) -> None:
+        # Remove the least recently used entries until the cache fits within its maximum size again.
+        with self.lock:
+            if self.current_size <= self.max_size:
+                return
+            entries = [file for file in self.cache_dir.rglob("*") if file.is_file() and file.suffix != ".sha1"
+                       and not file.name.startswith(".tmp-")]
+            entries.sort(key=lambda file: file.stat().st_mtime)
+        for entry in entries:
+            if self.current_size <= self.max_size:
+                break
+            self._remove_entry(entry)
+
+    def get_tmd(self, tid: str, version: int = None, endpoint: str = None) -> bytes | None:
+        # Without a version, fall back to the newest cached TMD for the title. This is only used in offline mode, since
+        # otherwise the NUS has to be asked what the latest version actually is.
+        if version is None:
+            tmd_dir = self._entry_path("tmd", tid.lower(), endpoint=endpoint)
+            if not tmd_dir.exists():
+                return None
+            versions = [int(file.name) for file in tmd_dir.iterdir() if file.name.isdigit()]
+            for cached_version in sorted(versions, reverse=True):
+                tmd_data = self.get_tmd(tid, cached_version, endpoint)
+                if tmd_data is not None:
+                    return tmd_data
+            return None
+        entry_path = self._entry_path("tmd", tid.lower(), str(version), endpoint=endpoint)
+        if not self._check_entry(entry_path):
+            return None
+        return entry_path.read_bytes()
+
+    def put_tmd(self, tid: str, version: int, tmd_data: bytes, endpoint: str = None) -> None:
+        self._store_entry(self._entry_path("tmd", tid.lower(), str(version), endpoint=endpoint), tmd_data)
+
+    def get_ticket(self, tid: str, endpoint: str = None) -> bytes | None:
+        entry_path = self._entry_path("ticket", tid.lower(), endpoint=endpoint)
+        if not self._check_entry(entry_path):
+            return None
+        return entry_path.read_bytes()
+
+    def put_ticket(self, tid: str, ticket_data: bytes, endpoint: str = None) -> None:
+        self._store_entry(self._entry_path("ticket", tid.lower(), endpoint=endpoint), ticket_data)
+
+    def get_cert_chain(self, endpoint: str = None) -> bytes | None:
+        entry_path = self._entry_path("cert", "chain", endpoint=endpoint)
+        if not self._check_entry(entry_path):
+            return None
+        return entry_path.read_bytes()
+
+    def put_cert_chain(self, cert_data: bytes, endpoint: str = None) -> None:
+        self._store_entry(self._entry_path("cert", "chain", endpoint=endpoint), cert_data)
+
+    def _content_entry_path(self, tid: str, index: int, content_hash: str, endpoint: str = None) -> pathlib.Path:
+        # Contents are encrypted with their title's key and use their index as the IV, so two records with the same
+        # hash but different indices don't have the same encrypted data. They're grouped by Title ID and kept apart by
+        # index as well as by hash.
+        return self._entry_path("content", tid.lower(), f"{index}-{content_hash}", endpoint=endpoint)
+
+    def get_content_path(self, tid: str, index: int, content_hash: str, endpoint: str = None) -> pathlib.Path | None:
+        # Returns the path to a cached encrypted content if it exists and is intact.
+        entry_path = self._content_entry_path(tid, index, content_hash, endpoint)
+        if not self._check_entry(entry_path):
+            return None
+        return entry_path
+
+    def put_content(self, tid: str, index: int, content_hash: str, content_path: pathlib.Path,
+                    endpoint: str = None) -> None:
+        self._store_entry(self._content_entry_path(tid, index, content_hash, endpoint), content_path)
+
+    def remove_content(self, tid: str, index: int, content_hash: str, endpoint: str = None) -> None:
+        # Drop a cached content that turned out not to match its record once it was decrypted.
+        self._remove_entry(self._content_entry_path(tid, index, content_hash, endpoint))
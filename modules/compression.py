@@ -0,0 +1,123 @@
+# "modules/compression.py" from WiiPy by NinjaCheetah
+# https://github.com/NinjaCheetah/WiiPy
+#
+# A shared layer for reading data that might be compressed. Commands that accept archives or banners pass their data
+# through here, and it's transparently decompressed if it's wrapped in any of the compression formats used on the Wii.
+
+import collections
+import hashlib
+from typing import NamedTuple
+from modules.ash import compress_ash, decompress_ash
+from modules.lz77 import compress_lz77, decompress_lz11, decompress_lz77, decompress_lz77_to_file
+from modules.yaz0 import decompress_yaz0
+
+# ASH files don't store the widths of their tree leaves, so these are tried when they aren't provided. The first are
+# the ones used by the Wii Menu, and the second are the ones used by My Pokémon Ranch.
+_ash_tree_bits = ((9, 11), (9, 15))
+# Maximum total size of the decompressed data kept in memory, in bytes. Once it's exceeded, the least recently used
+# entries are dropped.
+_decompression_cache_max_size = 256 * 1048576
+_decompression_cache = collections.OrderedDict()
+_decompression_cache_size = 0
+
+
+class DecompressedData(NamedTuple):
+    data: bytes
+    # The compression format that the data was wrapped in ("LZ77", "LZ11", "ASH", or "Yaz0"), or None if it wasn't.
+    compression: str | None
+    # The (sym_tree_bits, dist_tree_bits) that an ASH file was decompressed with. Empty for every other format.
+    ash_tree_bits: tuple = ()
+
+
+def detect_compression(data: bytes) -> str | None:
+    # Identify the compression format from the header. Bare LZ77 data without the "LZ77" magic number is deliberately
+    # not matched, since a single type byte isn't enough to tell it apart from uncompressed data.
+    if data[0:5] == b'LZ77\x10':
+        return "LZ77"
+    if data[0:5] == b'LZ77\x11':
+        return "LZ11"
+    if data[0:4] == b'ASH0':
+        return "ASH"
+    if data[0:4] == b'Yaz0':
+        return "Yaz0"
+    return None
+
+
+def _detect_and_decompress_ash(data: bytes, ash_tree_bits: tuple | None) -> DecompressedData:
+    if ash_tree_bits is not None:
+        try:
+            return DecompressedData(decompress_ash(data, *ash_tree_bits), "ASH", ash_tree_bits)
+        except ValueError:
+            raise ValueError("The ASH data could not be decompressed! Incorrect leaf widths may have been used. Try "
+                             "using a different number of bits for the symbol or distance tree leaves.")
+    # Wrong widths don't always fail outright, and can decode into garbage instead, so every known set is tried with
+    # the strict checks. The widths are only trusted if exactly one set passes them.
+    results = []
+    for sym_tree_bits, dist_tree_bits in _ash_tree_bits:
+        try:
+            results.append(DecompressedData(decompress_ash(data, sym_tree_bits, dist_tree_bits, strict=True), "ASH",
+                                            (sym_tree_bits, dist_tree_bits)))
+        except ValueError:
+            pass
+    if len(results) == 1:
+        return results[0]
+    if results:
+        raise ValueError("The tree leaf widths used by this ASH file could not be detected, since more than one set of "
+                         "widths can read it! Decompress it with \"ash decompress\" and provide the widths using "
+                         "--sym-bits and --dist-bits.")
+    raise ValueError("The ASH data could not be decompressed with any known tree leaf widths! Decompress it with \"ash "
+                     "decompress\" and provide the widths using --sym-bits and --dist-bits.")
+
+
+def decompress(data: bytes, ash_tree_bits: tuple = None) -> DecompressedData:
+    # Decompress the data if it's compressed, and return it unchanged if it isn't. Results are cached by the hash of
+    # the compressed data, so when a batch runs several commands on the same archive, it only gets decompressed once.
+    # The widths for ASH trees are detected automatically unless they're provided as (sym_tree_bits, dist_tree_bits).
+    global _decompression_cache_size
+    compression = detect_compression(data)
+    if compression is None:
+        return DecompressedData(data, None)
+    key = (hashlib.sha1(data).digest(), ash_tree_bits)
+    if key in _decompression_cache:
+        _decompression_cache.move_to_end(key)
+        return _decompression_cache[key]
+    match compression:
+        case "LZ77":
+            result = DecompressedData(decompress_lz77(data), compression)
+        case "LZ11":
+            result = DecompressedData(decompress_lz11(data), compression)
+        case "ASH":
+            result = _detect_and_decompress_ash(data, ash_tree_bits)
+        case _:
+            result = DecompressedData(decompress_yaz0(data), compression)
+    if len(result.data) <= _decompression_cache_max_size:
+        _decompression_cache[key] = result
+        _decompression_cache_size += len(result.data)
+        while _decompression_cache_size > _decompression_cache_max_size:
+            _decompression_cache_size -= len(_decompression_cache.popitem(last=False)[1].data)
+    return result
+
+
+def decompress_to_file(data: bytes, output_file) -> str | None:
+    # Decompress the data straight into an open file, and return the compression format it was in. LZ77 data that
+    # isn't already cached is streamed out in chunks as it's decompressed, rather than being held in memory all at
+    # once. Since it never exists in memory, it also isn't cached.
+    compression = detect_compression(data)
+    if compression == "LZ77" and (hashlib.sha1(data).digest(), None) not in _decompression_cache:
+        decompress_lz77_to_file(data, output_file)
+        return compression
+    result = decompress(data)
+    output_file.write(result.data)
+    return result.compression
+
+
+def compress(data: bytes, compression: str, ash_tree_bits: tuple = ()) -> bytes:
+    # Compress data back into the format that it was decompressed from, so that edited data can be written back the
+    # same way it was read. Only the formats that WiiPy has a compressor for are supported.
+    match compression:
+        case "LZ77":
+            return compress_lz77(data)
+        case "ASH":
+            return compress_ash(data, *(ash_tree_bits or _ash_tree_bits[0]))
+        case _:
+            raise ValueError(f"Data cannot be compressed using {compression} compression!")
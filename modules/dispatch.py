@@ -0,0 +1,48 @@
+# "modules/dispatch.py" from WiiPy by NinjaCheetah
+# https://github.com/NinjaCheetah/WiiPy
+
+import importlib
+
+# Maps each subcommand handler to the module that it lives in. Handlers are only imported once the matching subcommand
+# has been selected, so that running a command doesn't require importing every other command (and all of their
+# dependencies) first.
+handlers = {
+    "handle_ash_compress": "commands.archive.ash",
+    "handle_ash_decompress": "commands.archive.ash",
+    "handle_lz77_compress": "commands.archive.lz77",
+    "handle_lz77_decompress": "commands.archive.lz77",
+    "handle_apply_mym": "commands.archive.theme",
+    "handle_u8_pack": "commands.archive.u8",
+    "handle_u8_unpack": "commands.archive.u8",
+    "handle_batch": "commands.batch",
+    "handle_emunand_gc": "commands.nand.emunand",
+    "handle_emunand_info": "commands.nand.emunand",
+    "handle_emunand_install_missing": "commands.nand.emunand",
+    "handle_emunand_provision": "commands.nand.emunand",
+    "handle_emunand_title": "commands.nand.emunand",
+    "handle_setting_decrypt": "commands.nand.setting",
+    "handle_setting_encrypt": "commands.nand.setting",
+    "handle_setting_gen": "commands.nand.setting",
+    "build_cios": "commands.title.ciosbuild",
+    "handle_fakesign": "commands.title.fakesign",
+    "handle_info": "commands.title.info",
+    "handle_iospatch": "commands.title.iospatcher",
+    "handle_nus_content": "commands.title.nus",
+    "handle_nus_title": "commands.title.nus",
+    "handle_nus_tmd": "commands.title.nus",
+    "handle_tmd_edit": "commands.title.tmd",
+    "handle_tmd_remove": "commands.title.tmd",
+    "handle_wad_add": "commands.title.wad",
+    "handle_wad_convert": "commands.title.wad",
+    "handle_wad_edit": "commands.title.wad",
+    "handle_wad_pack": "commands.title.wad",
+    "handle_wad_remove": "commands.title.wad",
+    "handle_wad_set": "commands.title.wad",
+    "handle_wad_unpack": "commands.title.wad",
+}
+
+
+def resolve_handler(name: str):
+    # Import the module that a handler belongs to and return the handler itself.
+    module = importlib.import_module(handlers[name])
+    return getattr(module, name)
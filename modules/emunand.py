@@ -0,0 +1,435 @@
+# "modules/emunand.py" from WiiPy by NinjaCheetah
+# https://github.com/NinjaCheetah/WiiPy
+
+import concurrent.futures
+import json
+import math
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+from typing import List, NamedTuple
+import libWiiPy
+from modules.wad import WADReader, decrypt_wad_content
+
+# The title index is stored in the root of the EmuNAND, under a name that can't be mistaken for a real NAND file.
+_index_file_name = ".wiipy-index.json"
+_index_format_version = 3
+# The Wii measures space in blocks of 128 KiB.
+_block_size = 131072
+# Scanning is almost entirely waiting on the filesystem, so it's done with more threads than there are CPUs. This
+# mostly helps on network mounts and SD cards, where each directory listing has a lot of latency.
+_scan_threads = 16
+# The Linux ioctl used to clone a file on filesystems that support copy-on-write.
+_ficlone = 0x40049409
+
+
+class StagedContent(NamedTuple):
+    content_id: int
+    content_type: int
+    content_hash: bytes
+    # None for a shared content that was already installed when the title was staged, since it didn't need decrypting.
+    path: pathlib.Path | None
+
+
+class StagedTitle(NamedTuple):
+    # A title that has been decrypted and verified into a staging directory, ready to be moved into the EmuNAND.
+    wad_path: pathlib.Path
+    title_id: str
+    title_version: int
+    tmd_data: bytes
+    ticket_data: bytes
+    meta_data: bytes
+    staging_dir: pathlib.Path
+    contents: List[StagedContent]
+    stage_time: float
+
+
+def get_shared_hashes(emunand: libWiiPy.nand.EmuNAND) -> set[bytes]:
+    content_map_path = emunand.shared1_dir.joinpath("content.map")
+    if not content_map_path.exists():
+        return set()
+    content_map = libWiiPy.title.SharedContentMap()
+    content_map.load(content_map_path.read_bytes())
+    return {record.content_hash for record in content_map.shared_records}
+
+
+def stage_wad(wad_path: pathlib.Path, staging_dir: pathlib.Path, skip_hash: bool = False,
+              shared_hashes: set[bytes] = frozenset()) -> StagedTitle:
+    # Does all the work of installing a WAD that doesn't touch the EmuNAND itself: every content that will be
+    # installed is decrypted straight from the WAD into the staging directory and has its hash checked. This is the
+    # expensive part of an install, so it's run in worker processes while another title is being committed.
+    # Shared contents that are already installed are skipped, because they'd never be written anyway.
+    start_time = time.perf_counter()
+    with WADReader(wad_path) as wad_reader:
+        tmd = libWiiPy.title.TMD()
+        tmd.load(wad_reader.get_tmd_data())
+        ticket = libWiiPy.title.Ticket()
+        ticket.load(wad_reader.get_ticket_data())
+        meta_data = wad_reader.get_meta_data()
+        content_offsets = wad_reader.get_content_offsets(tmd.content_records)
+    title_key = ticket.get_title_key()
+    contents = []
+    for content, (record, content_offset) in enumerate(zip(tmd.content_records, content_offsets)):
+        if record.content_type not in (1, 32769):
+            continue
+        if record.content_type == 32769 and record.content_hash in shared_hashes:
+            contents.append(StagedContent(record.content_id, record.content_type, record.content_hash, None))
+            continue
+        content_path = staging_dir.joinpath(f"{content}.app")
+        content_hash = decrypt_wad_content(wad_path, content_offset, record.index, record.content_size, title_key,
+                                           content_path)
+        # Matches the hash checking that libWiiPy does when installing a title.
+        if content_hash != record.content_hash.decode():
+            if skip_hash:
+                print("Ignoring hash mismatch for content index " + str(content))
+            else:
+                raise ValueError("Content hash did not match the expected hash in its record! The incorrect Title Key "
+                                 "may have been used!\n"
+                                 f"Expected hash is: {record.content_hash.decode()}\n"
+                                 f"Actual hash is: {content_hash}")
+        contents.append(StagedContent(record.content_id, record.content_type, record.content_hash, content_path))
+    return StagedTitle(wad_path, tmd.title_id, tmd.title_version, tmd.dump(), ticket.dump(), meta_data, staging_dir,
+                       contents, time.perf_counter() - start_time)
+
+
+def _clone_file(source: pathlib.Path, destination: pathlib.Path) -> None:
+    # Makes a copy-on-write clone of a file where the filesystem supports it (like Btrfs or XFS on Linux), so that the
+    # copy shares its data with the original until one of them is changed. fcntl only exists on Unix-like systems, so
+    # it's imported here rather than at the top of the file.
+    import fcntl
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        fcntl.ioctl(destination_file.fileno(), _ficlone, source_file.fileno())
+
+
+def _place_file(source: pathlib.Path, destination: pathlib.Path, link_mode: str = None) -> None:
+    # Puts a staged file into the EmuNAND. By default the file is moved, but when the same staged title is being
+    # committed to more than one EmuNAND, it's hardlinked or cloned instead, falling back on a normal copy wherever
+    # that isn't possible (like when the EmuNAND is on a different filesystem from the staged file).
+    if link_mode is None:
+        os.replace(source, destination)
+        return
+    destination.unlink(missing_ok=True)
+    try:
+        if link_mode == "hardlink":
+            os.link(source, destination)
+            return
+        elif link_mode == "reflink":
+            _clone_file(source, destination)
+            return
+    except (OSError, ImportError):
+        destination.unlink(missing_ok=True)
+    shutil.copyfile(source, destination)
+
+
+def commit_staged_title(emunand: libWiiPy.nand.EmuNAND, staged: StagedTitle, link_mode: str = None) -> None:
+    # Moves a staged title into the EmuNAND, laid out exactly the same way that EmuNAND.install_title() would lay it
+    # out. The staging directory is inside the EmuNAND's /tmp/, so every content is moved with a rename rather than
+    # being copied. When a link mode is set, the staged files are linked or copied instead, and are left in place.
+    tid_upper = staged.title_id[:8]
+    tid_lower = staged.title_id[8:]
+
+    ticket_dir = emunand.ticket_dir.joinpath(tid_upper)
+    ticket_dir.mkdir(exist_ok=True)
+    ticket_dir.joinpath(f"{tid_lower}.tik").write_bytes(staged.ticket_data)
+
+    title_dir = emunand.title_dir.joinpath(tid_upper, tid_lower)
+    title_dir.mkdir(parents=True, exist_ok=True)
+    content_dir = title_dir.joinpath("content")
+    if content_dir.exists():
+        shutil.rmtree(content_dir)  # Clear the content directory so old contents aren't left behind.
+    content_dir.mkdir(exist_ok=True)
+    content_dir.joinpath("title.tmd").write_bytes(staged.tmd_data)
+    for content in staged.contents:
+        if content.content_type == 1:
+            _place_file(content.path, content_dir.joinpath(f"{content.content_id:08X}.app".lower()), link_mode)
+    title_dir.joinpath("data").mkdir(exist_ok=True)
+
+    # Shared contents get incremental names from /shared1/content.map. The map is read again here rather than trusting
+    # the hashes the title was staged with, since other titles may have been installed since then.
+    content_map_path = emunand.shared1_dir.joinpath("content.map")
+    content_map = libWiiPy.title.SharedContentMap()
+    existing_hashes = []
+    if content_map_path.exists():
+        content_map.load(content_map_path.read_bytes())
+        existing_hashes = [record.content_hash for record in content_map.shared_records]
+    for content in staged.contents:
+        if content.content_type == 32769 and content.content_hash not in existing_hashes:
+            content_file_name = content_map.add_content(content.content_hash)
+            _place_file(content.path, emunand.shared1_dir.joinpath(f"{content_file_name}.app"), link_mode)
+    content_map_path.write_bytes(content_map.dump())
+
+    if staged.meta_data != b'':
+        meta_dir = emunand.meta_dir.joinpath(tid_upper, tid_lower)
+        meta_dir.mkdir(parents=True, exist_ok=True)
+        meta_dir.joinpath("title.met").write_bytes(staged.meta_data)
+
+
+class IndexedTitle(NamedTuple):
+    title_id: str
+    title_version: int
+    ios_tid: str
+    vwii: bool
+    # The hashes of the shared contents that the title uses.
+    shared_hashes: List[str]
+
+
+class TitleIndex:
+    # A persistent index of the titles installed to an EmuNAND, so that getting the version and required IOS of every
+    # title doesn't mean loading every TMD on the EmuNAND each time. The index is kept in the root of the EmuNAND and
+    # is checked against the tree whenever it's loaded, so it stays correct even when titles are changed by something
+    # other than WiiPy. Checking it is cheap, since it only relies on directory listings and modification times:
+    #   - The list of title directories in a category is only read again when the category's directory has changed.
+    #   - A title's TMD is only loaded again when the modification time or size of its title.tmd has changed.
+    def __init__(self, emunand: libWiiPy.nand.EmuNAND, refresh: bool = True):
+        self.emunand = emunand
+        self.index_path = emunand.emunand_root.joinpath(_index_file_name)
+        self.categories = {}
+        self.changed = False
+        try:
+            index_data = json.loads(self.index_path.read_text())
+            if index_data.get("format") == _index_format_version:
+                self.categories = index_data["categories"]
+        except (OSError, ValueError, KeyError):
+            # A missing or unreadable index is just rebuilt from scratch.
+            self.changed = True
+        if refresh:
+            self.refresh()
+
+    @staticmethod
+    def _load_entry(title_dir: pathlib.Path, tmd_stat: os.stat_result) -> dict:
+        tmd = libWiiPy.title.TMD()
+        tmd.load(title_dir.joinpath("content", "title.tmd").read_bytes())
+        shared = [record.content_hash.decode() for record in tmd.content_records if record.content_type == 32769]
+        return {"tmd_mtime": tmd_stat.st_mtime_ns, "tmd_size": tmd_stat.st_size, "version": tmd.title_version,
+                "ios": tmd.ios_tid, "vwii": bool(tmd.vwii), "shared": shared}
+
+    def _refresh_title(self, category: dict, tid_high: str, tid_low: str) -> None:
+        title_dir = self.emunand.title_dir.joinpath(tid_high, tid_low)
+        entry = category["titles"].get(tid_low)
+        try:
+            tmd_stat = title_dir.joinpath("content", "title.tmd").stat()
+        except (FileNotFoundError, NotADirectoryError):
+            # Directories without a TMD (like save data for disc titles) are remembered, but aren't installed titles.
+            if entry is not None or tid_low not in category["titles"]:
+                category["titles"][tid_low] = None
+                self.changed = True
+            return
+        if entry is not None and entry["tmd_mtime"] == tmd_stat.st_mtime_ns and entry["tmd_size"] == tmd_stat.st_size:
+            return
+        category["titles"][tid_low] = self._load_entry(title_dir, tmd_stat)
+        self.changed = True
+
+    def _refresh_category(self, tid_high: str, high_mtime: int) -> None:
+        category = self.categories.get(tid_high)
+        if category is None or category["mtime"] != high_mtime:
+            with os.scandir(self.emunand.title_dir.joinpath(tid_high)) as low_entries:
+                tid_lows = {low_entry.name.lower() for low_entry in low_entries if low_entry.is_dir()}
+            old_titles = category["titles"] if category is not None else {}
+            category = {"mtime": high_mtime, "titles": {low: old_titles.get(low) for low in tid_lows}}
+            self.categories[tid_high] = category
+            self.changed = True
+        for tid_low in list(category["titles"]):
+            self._refresh_title(category, tid_high, tid_low)
+
+    def refresh(self) -> None:
+        # Bring the index up to date with the EmuNAND.
+        found_highs = set()
+        with os.scandir(self.emunand.title_dir) as high_entries:
+            for high_entry in high_entries:
+                if high_entry.is_dir():
+                    found_highs.add(high_entry.name.lower())
+                    self._refresh_category(high_entry.name.lower(), high_entry.stat().st_mtime_ns)
+        for tid_high in set(self.categories) - found_highs:
+            del self.categories[tid_high]
+            self.changed = True
+
+    def save(self) -> None:
+        # Only write the index out if something has actually changed. It's written to a temporary file first and then
+        # moved into place, so that an interrupted write can't leave a partial index behind.
+        if not self.changed:
+            return
+        index_data = json.dumps({"format": _index_format_version, "categories": self.categories}, sort_keys=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.emunand.emunand_root, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as tmp_file:
+                tmp_file.write(index_data)
+            os.replace(tmp_name, self.index_path)
+        except OSError:
+            # The index is only ever an optimization, so failing to write it shouldn't stop anything.
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+            return
+        self.changed = False
+
+    def get_installed_titles(self) -> List[libWiiPy.nand.EmuNAND.InstalledTitles]:
+        # Returns the same thing as EmuNAND.get_installed_titles(), in a consistent order.
+        installed_titles = []
+        for tid_high in sorted(self.categories):
+            tid_lows = sorted(low.upper() for low, entry in self.categories[tid_high]["titles"].items()
+                              if entry is not None)
+            installed_titles.append(libWiiPy.nand.EmuNAND.InstalledTitles(tid_high.upper(), tid_lows))
+        return installed_titles
+
+    def get_title(self, tid: str) -> IndexedTitle | None:
+        category = self.categories.get(tid[:8].lower())
+        if category is None:
+            return None
+        entry = category["titles"].get(tid[8:].lower())
+        if entry is None:
+            return None
+        return IndexedTitle(tid.lower(), entry["version"], entry["ios"], entry["vwii"], entry["shared"])
+
+    def update_title(self, tid: str) -> None:
+        # Update the index after a title was installed or uninstalled. Only the title's own category is checked, which
+        # is much cheaper than a full refresh when the index was loaded with refresh=False.
+        tid_high = tid[:8].lower()
+        try:
+            self._refresh_category(tid_high, self.emunand.title_dir.joinpath(tid_high).stat().st_mtime_ns)
+        except FileNotFoundError:
+            if self.categories.pop(tid_high, None) is not None:
+                self.changed = True
+
+
+def size_to_blocks(size: int) -> int:
+    return math.ceil(size / _block_size)
+
+
+class SpaceUsage(NamedTuple):
+    # Space used by each part of an EmuNAND, in bytes. Title content and save data are tracked per title, keyed by
+    # Title ID.
+    title_content: dict[str, int]
+    title_data: dict[str, int]
+    shared_content: int
+    tickets: int
+    system: int
+
+    @property
+    def total(self) -> int:
+        return (sum(self.title_content.values()) + sum(self.title_data.values()) + self.shared_content + self.tickets
+                + self.system)
+
+
+def _scan_tree(path: str) -> int:
+    # Add up the size of every file under a directory. DirEntry caches what the directory listing returned, so on most
+    # platforms telling files apart from directories needs no extra system calls, and stat() is only called on files.
+    total_size = 0
+    pending = [path]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total_size += entry.stat(follow_symlinks=False).st_size
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+    return total_size
+
+
+def _list_dir(path: str) -> list[os.DirEntry]:
+    try:
+        with os.scandir(path) as entries:
+            return list(entries)
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def scan_space_usage(emunand: libWiiPy.nand.EmuNAND) -> SpaceUsage:
+    # Works out how much space each part of an EmuNAND is using. The tree is split up into many small subtrees (the
+    # content and save data of each title, shared content, tickets, and everything else) which are all scanned at the
+    # same time.
+    title_content = {}
+    title_data = {}
+    shared_content = 0
+    tickets = 0
+    system = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_scan_threads) as executor:
+        futures = {}
+        for root_entry in _list_dir(str(emunand.emunand_root)):
+            if root_entry.is_file(follow_symlinks=False):
+                system += root_entry.stat(follow_symlinks=False).st_size
+            elif root_entry.is_dir(follow_symlinks=False) and root_entry.name != "title":
+                category = {"shared1": "shared", "ticket": "tickets"}.get(root_entry.name, "system")
+                futures[executor.submit(_scan_tree, root_entry.path)] = (category, None)
+        # Every directory of a title other than its content directory (usually just data) counts as save data.
+        for high_entry in _list_dir(str(emunand.title_dir)):
+            if not high_entry.is_dir(follow_symlinks=False):
+                continue
+            for low_entry in _list_dir(high_entry.path):
+                if not low_entry.is_dir(follow_symlinks=False):
+                    continue
+                tid = f"{high_entry.name}{low_entry.name}".upper()
+                title_content[tid] = 0
+                title_data[tid] = 0
+                for title_entry in _list_dir(low_entry.path):
+                    category = "content" if title_entry.name == "content" else "data"
+                    if title_entry.is_dir(follow_symlinks=False):
+                        futures[executor.submit(_scan_tree, title_entry.path)] = (category, tid)
+                    elif title_entry.is_file(follow_symlinks=False):
+                        title_data[tid] += title_entry.stat(follow_symlinks=False).st_size
+        for future in concurrent.futures.as_completed(futures):
+            category, tid = futures[future]
+            if category == "content":
+                title_content[tid] += future.result()
+            elif category == "data":
+                title_data[tid] += future.result()
+            elif category == "shared":
+                shared_content += future.result()
+            elif category == "tickets":
+                tickets += future.result()
+            else:
+                system += future.result()
+    return SpaceUsage(title_content, title_data, shared_content, tickets, system)
+
+
+class SharedContentUsage(NamedTuple):
+    shared_id: str
+    content_hash: str
+    size: int
+    # The Title IDs of every installed title that uses this shared content.
+    titles: List[str]
+
+
+def get_shared_content_usage(emunand: libWiiPy.nand.EmuNAND,
+                             title_index: TitleIndex) -> tuple[List[SharedContentUsage], List[pathlib.Path]]:
+    # Builds a reverse index from every entry in /shared1/content.map to the installed titles that use it. Also returns
+    # any files in /shared1/ that don't belong to an entry in content.map at all.
+    references = {}
+    for category in title_index.get_installed_titles():
+        for tid_low in category.titles:
+            title_info = title_index.get_title(f"{category.type}{tid_low}")
+            for content_hash in title_info.shared_hashes:
+                references.setdefault(content_hash, []).append(title_info.title_id.upper())
+    content_map_path = emunand.shared1_dir.joinpath("content.map")
+    content_map = libWiiPy.title.SharedContentMap()
+    if content_map_path.exists():
+        content_map.load(content_map_path.read_bytes())
+    usage = []
+    mapped_files = {"content.map"}
+    for record in content_map.shared_records:
+        content_path = emunand.shared1_dir.joinpath(f"{record.shared_id}.app")
+        mapped_files.add(content_path.name)
+        size = content_path.stat().st_size if content_path.exists() else 0
+        content_hash = record.content_hash.decode()
+        usage.append(SharedContentUsage(record.shared_id, content_hash, size, references.get(content_hash, [])))
+    stray_files = sorted(file for file in emunand.shared1_dir.iterdir()
+                         if file.is_file() and file.suffix == ".app" and file.name not in mapped_files)
+    return usage, stray_files
+
+
+def remove_shared_contents(emunand: libWiiPy.nand.EmuNAND, shared_ids: set[str]) -> None:
+    # Removes the given shared contents, both their files and their entries in content.map. The remaining entries keep
+    # their names, since the TMDs that use them find them through content.map by hash. The new content.map is written
+    # before any files are removed, so an interrupted removal can only ever leave behind unused files.
+    content_map_path = emunand.shared1_dir.joinpath("content.map")
+    content_map = libWiiPy.title.SharedContentMap()
+    content_map.load(content_map_path.read_bytes())
+    content_map.shared_records = [record for record in content_map.shared_records
+                                  if record.shared_id not in shared_ids]
+    tmp_path = content_map_path.with_name("content.map.tmp")
+    tmp_path.write_bytes(content_map.dump())
+    os.replace(tmp_path, content_map_path)
+    for shared_id in shared_ids:
+        emunand.shared1_dir.joinpath(f"{shared_id}.app").unlink(missing_ok=True)
@@ -0,0 +1,77 @@
+# "modules/fakesign.py" from WiiPy by NinjaCheetah
+# https://github.com/NinjaCheetah/WiiPy
+
+import concurrent.futures
+import hashlib
+import libWiiPy
+
+# Fakesigning works by brute-forcing an unused 16-bit field until the SHA-1 of the signed body (everything after the
+# first 320 bytes) starts with a zero byte. libWiiPy does this by dumping and hashing the entire TMD or Ticket for every
+# attempt, but everything before that field never changes, so it only needs to be hashed once. Each attempt then just
+# copies that midstate and hashes the 2 changing bytes and whatever follows them.
+_signed_offset = 320
+# Offsets of the field used for brute-forcing in a dumped TMD (the minor version) and Ticket (the first 2 bytes of the
+# unused "unknown2" region).
+_tmd_field_offset = 0x1E2
+_ticket_field_offset = 0x1F2
+# How many values each worker checks at a time when the search is split across processes.
+_search_chunk_size = 4096
+_max_value = 0xFFFF
+
+
+def find_fakesign_value(data: bytes, field_offset: int, start: int = 1, stop: int = _max_value + 1) -> int | None:
+    # Find the first value in [start, stop) that, when written as a big endian 16-bit integer at field_offset, gives
+    # the signed body a hash starting with a zero byte. Returns None if there isn't one in that range.
+    prefix_hash = hashlib.sha1(data[_signed_offset:field_offset])
+    suffix = data[field_offset + 2:]
+    for value in range(start, stop):
+        attempt = prefix_hash.copy()
+        attempt.update(value.to_bytes(2) + suffix)
+        if attempt.digest()[0] == 0:
+            return value
+    return None
+
+
+def _search(data: bytes, field_offset: int, jobs: int) -> int:
+    if jobs <= 1:
+        value = find_fakesign_value(data, field_offset)
+    else:
+        # Chunks are searched in waves of one per worker, and the lowest match from the earliest wave that has one is
+        # used. This always picks the same value that a single process would, so the output doesn't depend on jobs.
+        value = None
+        chunks = [(start, min(start + _search_chunk_size, _max_value + 1))
+                  for start in range(1, _max_value + 1, _search_chunk_size)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            for wave_start in range(0, len(chunks), jobs):
+                wave = [executor.submit(find_fakesign_value, data, field_offset, start, stop)
+                        for start, stop in chunks[wave_start:wave_start + jobs]]
+                found = [future.result() for future in wave]
+                found = [result for result in found if result is not None]
+                if found:
+                    value = min(found)
+                    break
+    if value is None:
+        raise Exception("An error occurred during fakesigning. The signed data could not be fakesigned!")
+    return value
+
+
+def fakesign_tmd(tmd: libWiiPy.title.TMD, jobs: int = 1) -> None:
+    # A drop-in replacement for TMD.fakesign() that produces the exact same result.
+    tmd.signature = b'\x00' * 256
+    tmd.minor_version = 0
+    tmd.minor_version = _search(tmd.dump(), _tmd_field_offset, jobs)
+
+
+def fakesign_ticket(ticket: libWiiPy.title.Ticket, jobs: int = 1) -> None:
+    # A drop-in replacement for Ticket.fakesign() that produces the exact same result.
+    ticket.signature = b'\x00' * 256
+    ticket.unknown2 = b'\x00\x00' + ticket.unknown2[2:]
+    value = _search(ticket.dump(), _ticket_field_offset, jobs)
+    ticket.unknown2 = value.to_bytes(2) + ticket.unknown2[2:]
+
+
+def fakesign_title(title: libWiiPy.title.Title, jobs: int = 1) -> None:
+    # A drop-in replacement for Title.fakesign() that produces the exact same result.
+    title.tmd.num_contents = title.content.num_contents  # This needs to be updated in case it was changed
+    fakesign_tmd(title.tmd, jobs)
+    fakesign_ticket(title.ticket, jobs)
@@ -0,0 +1,285 @@
+# "modules/lz77.py" from WiiPy by NinjaCheetah
+# https://github.com/NinjaCheetah/WiiPy
+#
+# See https://wiibrew.org/wiki/LZ77 for details about the LZ77 compression format.
+
+_lz_max_distance = 0x1000
+_lz_min_length = 3
+_lz_max_length = 0x12
+# Compression levels, as (how many earlier positions to check for a match, whether to use lazy matching). Higher levels
+# produce smaller files, but take longer. None means that the entire window is searched.
+_lz77_levels = {
+    1: (16, False),
+    2: (32, True),
+    3: (None, True),
+}
+
+
+def build_match_chains(data: bytes) -> list[int]:
+    # Link every position to the closest earlier position that starts with the same 3 bytes, or -1 if there isn't one.
+    # Following these links from a position walks back through every earlier position that could start a match there,
+    # from closest to furthest. The chains are keyed on the bytes themselves, so no hash collisions are possible and
+    # every position on a chain is known to match the first 3 bytes already. The ASH compressor finds its matches with
+    # these as well.
+    heads = {}
+    prev = []
+    prev_append = prev.append
+    heads_get = heads.get
+    for pos, key in enumerate([data[pos:pos + 3] for pos in range(len(data) - 2)]):
+        prev_append(heads_get(key, -1))
+        heads[key] = pos
+    return prev
+
+
+def _longest_match(data: bytes, pos: int, max_len: int, prev: list[int], max_chain: int) -> (int, int):
+    # Walk the chain for this position and return the longest match found in the window as (length, distance).
+    best_len = 0
+    best_dist = 0
+    window_start = pos - _lz_max_distance
+    candidate = prev[pos]
+    while candidate >= 0 and candidate >= window_start and max_chain:
+        # A candidate can only beat the current best if it also matches the byte just past the current best, so
+        # check that first before comparing the rest.
+        if data[candidate + best_len] == data[pos + best_len]:
+            if data[candidate:candidate + max_len] == data[pos:pos + max_len]:
+                return max_len, pos - candidate
+            length = _lz_min_length
+            while data[candidate + length] == data[pos + length]:
+                length += 1
+            if length > best_len:
+                best_len = length
+                best_dist = pos - candidate
+        candidate = prev[candidate]
+        max_chain -= 1
+    return best_len, best_dist
+
+
+def _longest_match_window(data: bytes, pos: int, max_len: int, prev: list[int], max_chain: int) -> (int, int):
+    # Find the longest match anywhere in the window. Rather than checking every position one at a time, this searches
+    # the window for the closest copy of the bytes matched so far plus one more with rfind(), which runs in C, and
+    # then extends whatever it finds for as long as it keeps matching. Each search after the first only runs when the
+    # previous one found a match, so only a few searches are needed for each position.
+    best_len = 0
+    best_dist = 0
+    window_start = max(pos - _lz_max_distance, 0)
+    length = _lz_min_length
+    while length <= max_len:
+        # The end of the search range lets the match overlap the current position, but not start at it.
+        candidate = data.rfind(data[pos:pos + length], window_start, pos + length - 1)
+        if candidate < 0:
+            break
+        while length < max_len and data[candidate + length] == data[pos + length]:
+            length += 1
+        best_len = length
+        best_dist = pos - candidate
+        length += 1
+    return best_len, best_dist
+
+
+def compress_lz77(data: bytes, level: int = 1) -> bytes:
+    # Compresses data in the LZ77 (type 0x10) format used on the Wii. Rather than searching every position in the
+    # 4 KiB window for a match like libWiiPy does, each position is linked to the earlier positions that start with the
+    # same 3 bytes, so only positions that match at least the minimum length are ever checked.
+    #
+    # Level 1 takes the best match found at each position. Levels 2 and 3 use lazy matching, where a match is put off
+    # by a byte when the next position has a longer one, which gives smaller output for a little more time. Level 3
+    # also searches the whole window instead of following the chains, which gives the smallest output but is the
+    # slowest.
+    if level not in _lz77_levels:
+        raise ValueError(f"Invalid compression level \"{level}\"!")
+    max_chain, lazy = _lz77_levels[level]
+    if max_chain is None:
+        longest_match = _longest_match_window
+        prev = []
+    else:
+        longest_match = _longest_match
+        prev = build_match_chains(data)
+    size = len(data)
+    out = bytearray(b'LZ77\x10')  # The LZ type on the Wii is *always* 0x10.
+    out += size.to_bytes(3, 'little')
+    # Positions from here on have fewer than 3 bytes left and can't start a match.
+    last_match_start = size - _lz_min_length
+    flag_pos = 0
+    flag_bit = 0
+    pos = 0
+    match_len = 0
+    match_dist = 0
+    while pos < size:
+        if flag_bit == 0:
+            flag_pos = len(out)
+            out.append(0)
+            flag_bit = 0x80
+        # Find the longest match at this position, unless lazy matching already found it while checking the previous
+        # position.
+        if match_len == 0 and pos <= last_match_start:
+            match_len, match_dist = longest_match(data, pos, min(_lz_max_length, size - pos), prev, max_chain)
+        if lazy and _lz_min_length <= match_len < _lz_max_length and pos < last_match_start:
+            # See if starting the match one byte later would be better, and if it would, write this byte on its own.
+            next_len, next_dist = longest_match(data, pos + 1, min(_lz_max_length, size - pos - 1), prev, max_chain)
+            if next_len > match_len:
+                out.append(data[pos])
+                pos += 1
+                flag_bit >>= 1
+                match_len = next_len
+                match_dist = next_dist
+                continue
+        if match_len >= _lz_min_length:
+            encoded = ((match_len - _lz_min_length) << 12) | (match_dist - 1)
+            out.append(encoded >> 8)
+            out.append(encoded & 0xFF)
+            out[flag_pos] |= flag_bit
+            pos += match_len
+        else:
+            out.append(data[pos])
+            pos += 1
+        flag_bit >>= 1
+        match_len = 0
+    return bytes(out)
+
+
+def _read_lz77_header(data: bytes) -> (int, int):
+    # Returns the decompressed size and where the compressed data starts. Like libWiiPy, this supports data both with
+    # and without the "LZ77" magic number, since it may not be present if the data is embedded in something else.
+    start = 4 if data[0:4] == b'LZ77' else 0
+    if len(data) < start + 4:
+        raise ValueError("The LZ77 data is too short to contain a valid header!")
+    if data[start] != 0x10:
+        raise ValueError("This data is using an unsupported compression type!")
+    return int.from_bytes(data[start + 1:start + 4], 'little'), start + 4
+
+
+def _decompress_lz77(data: bytes, write=None, chunk_size: int = 0) -> bytearray:
+    # Decompresses into a single bytearray that's allocated once up front, rather than growing it or building a list
+    # of ints. Back-references that don't overlap the bytes they produce are copied as one slice, and ones that do are
+    # made by repeating the referenced bytes, so nothing is ever copied one byte at a time except for literals.
+    #
+    # When a write function is provided, the output is streamed instead. The buffer is then only large enough to hold
+    # one chunk plus the 4 KiB window that references can reach back into, and every time it fills up, everything but
+    # the window is written out and the window is moved back to the start of the buffer.
+    size, src = _read_lz77_header(data)
+    data_len = len(data)
+    if write is None:
+        out = bytearray(size)
+        flush_at = size
+    else:
+        # One flag byte can produce at most 8 references' worth of data, so a flush is only needed between flags.
+        out = bytearray(chunk_size + _lz_max_distance + 8 * _lz_max_length)
+        flush_at = chunk_size + _lz_max_distance
+    # The end of the output, relative to the start of the buffer. This only changes when streamed data is flushed.
+    end = size
+    pos = 0
+    try:
+        while pos < end:
+            if pos >= flush_at:
+                keep_from = pos - _lz_max_distance
+                write(out[:keep_from])
+                out[:_lz_max_distance] = out[keep_from:pos]
+                pos -= keep_from
+                end -= keep_from
+            flag = data[src]
+            src += 1
+            # A flag of 0 means the next 8 bytes are all literals, which is very common in data that doesn't compress
+            # well, so those can be copied all at once.
+            if flag == 0 and pos + 8 <= end and src + 8 <= data_len:
+                out[pos:pos + 8] = data[src:src + 8]
+                pos += 8
+                src += 8
+                continue
+            for bit in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+                if pos >= end:
+                    break
+                if flag & bit:
+                    reference = (data[src] << 8) | data[src + 1]
+                    src += 2
+                    length = (reference >> 12) + _lz_min_length
+                    distance = (reference & 0xFFF) + 1
+                    offset = pos - distance
+                    if offset < 0:
+                        raise ValueError("The LZ77 data references data before the start of the output!")
+                    # Avoids a buffer overrun if the copy length would extend past the end of the file.
+                    if length > end - pos:
+                        length = end - pos
+                    if distance >= length:
+                        out[pos:pos + length] = out[offset:offset + length]
+                    else:
+                        out[pos:pos + length] = (out[offset:pos] * (length // distance + 1))[:length]
+                    pos += length
+                else:
+                    out[pos] = data[src]
+                    pos += 1
+                    src += 1
+    except IndexError:
+        raise ValueError("The LZ77 data ended before all of the data could be decompressed!")
+    if write is not None:
+        write(out[:pos])
+    return out
+
+
+def decompress_lz77(data: bytes) -> bytes:
+    # Decompresses LZ77 (type 0x10) data and returns the result. This produces the same output as libWiiPy's
+    # decompress_lz77(), and supports data both with and without the "LZ77" magic number.
+    return bytes(_decompress_lz77(data))
+
+
+def decompress_lz77_to_file(data: bytes, output_file, chunk_size: int = 0x100000) -> int:
+    # Decompresses LZ77 data directly into an open file, writing it out in chunks as it goes so that the full
+    # decompressed data never has to be held in memory at once. Returns the size of the decompressed data.
+    _decompress_lz77(data, output_file.write, chunk_size)
+    return _read_lz77_header(data)[0]
+
+
+def decompress_lz11(data: bytes) -> bytes:
+    # Decompresses LZ77 type 0x11 data, which is sometimes called LZ11. It works like type 0x10, but references can
+    # be 2, 3, or 4 bytes long to allow for much longer matches, which is chosen by the top 4 bits of the first byte.
+    start = 4 if data[0:4] == b'LZ77' else 0
+    if len(data) < start + 4:
+        raise ValueError("The LZ11 data is too short to contain a valid header!")
+    if data[start] != 0x11:
+        raise ValueError("This data is using an unsupported compression type!")
+    size = int.from_bytes(data[start + 1:start + 4], 'little')
+    src = start + 4
+    # Sizes too large to fit in 3 bytes are stored in an extra 4 bytes after the header instead.
+    if size == 0:
+        size = int.from_bytes(data[src:src + 4], 'little')
+        src += 4
+    out = bytearray(size)
+    pos = 0
+    try:
+        while pos < size:
+            flag = data[src]
+            src += 1
+            for bit in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+                if pos >= size:
+                    break
+                if flag & bit:
+                    first = data[src]
+                    indicator = first >> 4
+                    if indicator == 0:
+                        length = (((first & 0xF) << 4) | (data[src + 1] >> 4)) + 0x11
+                        distance = (((data[src + 1] & 0xF) << 8) | data[src + 2]) + 1
+                        src += 3
+                    elif indicator == 1:
+                        length = (((first & 0xF) << 12) | (data[src + 1] << 4) | (data[src + 2] >> 4)) + 0x111
+                        distance = (((data[src + 2] & 0xF) << 8) | data[src + 3]) + 1
+                        src += 4
+                    else:
+                        length = indicator + 1
+                        distance = (((first & 0xF) << 8) | data[src + 1]) + 1
+                        src += 2
+                    offset = pos - distance
+                    if offset < 0:
+                        raise ValueError("The LZ11 data references data before the start of the output!")
+                    if length > size - pos:
+                        length = size - pos
+                    if distance >= length:
+                        out[pos:pos + length] = out[offset:offset + length]
+                    else:
+                        out[pos:pos + length] = (out[offset:pos] * (length // distance + 1))[:length]
+                    pos += length
+                else:
+                    out[pos] = data[src]
+                    pos += 1
+                    src += 1
+    except IndexError:
+        raise ValueError("The LZ11 data ended before all of the data could be decompressed!")
+    return bytes(out)
@@ -0,0 +1,353 @@
+# "modules/nus.py" from WiiPy by NinjaCheetah
+# https://github.com/NinjaCheetah/WiiPy
+
+import hashlib
+import pathlib
+import shutil
+import struct
+import tempfile
+import threading
+from contextlib import nullcontext
+import libWiiPy
+import requests
+from requests.adapters import HTTPAdapter
+from Crypto.Cipher import AES
+from modules.cache import NUSCache
+
+_nus_endpoint = ["http://nus.cdn.shop.wii.com/ccs/download/", "http://ccs.cdn.wup.shop.nintendo.net/ccs/download/"]
+# Size of each chunk read from the NUS. This is what bounds memory usage per download, since nothing larger than one
+# chunk is ever held in memory at once.
+_chunk_size = 1048576
+_user_agent = 'wii libnup/1.0'
+# Timeouts for requests to the NUS, in seconds, as (connecting, waiting for data). Without these, a connection that
+# stalls would leave whatever is waiting on it hanging forever.
+_request_timeout = (15, 60)
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_endpoint_url(wiiu_endpoint: bool = False, endpoint_override: str = None) -> str:
+    # Matches how libWiiPy picks an endpoint, where an override always takes priority over the Wii U endpoint setting.
+    if endpoint_override is not None:
+        return endpoint_override
+    if wiiu_endpoint:
+        return _nus_endpoint[1]
+    return _nus_endpoint[0]
+
+
+def open_session(pool_size: int = 10) -> requests.Session:
+    # Sets up the session that every request to the NUS goes through. Sharing one session means that connections are
+    # kept alive and reused between requests instead of a new connection being opened for every file, which adds up
+    # fast when downloading many titles. The pool size should be at least the number of downloads running at once.
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = requests.Session()
+        _session.headers["User-Agent"] = _user_agent
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
+
+
+def get_session() -> requests.Session:
+    if _session is None:
+        return open_session()
+    return _session
+
+
+def _download_file(file_url: str) -> bytes | None:
+    # Downloads a small file from the NUS, returning None if it doesn't exist.
+    try:
+        with get_session().get(url=file_url, timeout=_request_timeout) as file_request:
+            if file_request.status_code != 200:
+                return None
+            return file_request.content
+    except requests.exceptions.RequestException:
+        raise ValueError("A connection could not be made to the NUS endpoint. Please make sure that your endpoint "
+                         "is valid and that the NUS is available.")
+
+
+def download_tmd(title_id: str, title_version: int = None, wiiu_endpoint: bool = False,
+                 endpoint_override: str = None) -> bytes:
+    # These work the same way as their libWiiPy equivalents, but go through the shared session.
+    tmd_url = get_endpoint_url(wiiu_endpoint, endpoint_override) + title_id + "/tmd"
+    if title_version is not None:
+        tmd_url += "." + str(title_version)
+    raw_tmd = _download_file(tmd_url)
+    if raw_tmd is None:
+        raise ValueError("The requested Title ID or TMD version does not exist. Please check the Title ID and Title"
+                         " version and then try again.")
+    # The TMD from the NUS has certificates appended to it, so load it and dump it again to get only the TMD.
+    tmd = libWiiPy.title.TMD()
+    tmd.load(raw_tmd)
+    return tmd.dump()
+
+
+def download_ticket(title_id: str, wiiu_endpoint: bool = False, endpoint_override: str = None) -> bytes:
+    cetk = _download_file(get_endpoint_url(wiiu_endpoint, endpoint_override) + title_id + "/cetk")
+    if cetk is None:
+        raise ValueError("The requested Title ID does not exist, or refers to a non-free title. Tickets can only"
+                         " be downloaded for titles that are free on the NUS.")
+    ticket = libWiiPy.title.Ticket()
+    ticket.load(cetk)
+    return ticket.dump()
+
+
+def download_cert_chain(wiiu_endpoint: bool = False, endpoint_override: str = None) -> bytes:
+    # The certificate chain is assembled from the certificates appended to the TMD and Ticket for System Menu 4.3U.
+    endpoint_url = get_endpoint_url(wiiu_endpoint, endpoint_override)
+    tmd = _download_file(endpoint_url + "0000000100000002/tmd.513")
+    cetk = _download_file(endpoint_url + "0000000100000002/cetk")
+    if tmd is None or cetk is None:
+        raise ValueError("The certificate chain could not be downloaded from the NUS.")
+    return cetk[0x2A4 + 768:] + tmd[0x328:0x328 + 768] + cetk[0x2A4:0x2A4 + 768]
+
+
+class ContentDecryptor:
+    # Decrypts a content piece by piece while it's being downloaded or read, and hashes the decrypted data along the
+    # way so that it can be verified against its content record without ever holding the whole content in memory.
+    # AES-CBC carries its state between calls, so feeding the cipher sequential chunks gives the same result as
+    # decrypting everything at once as long as each chunk is a multiple of 16 bytes. Leftover bytes are held back
+    # until the next chunk arrives.
+    def __init__(self, title_key: bytes, content_index: int, content_size: int, output_file=None):
+        iv = struct.pack(">H", content_index) + (b'\x00' * 14)
+        self.aes = AES.new(title_key, AES.MODE_CBC, iv)
+        self.remaining = content_size
+        self.output_file = output_file
+        self.sha1 = hashlib.sha1()
+        self.pending = b''
+
+    def _write(self, dec_data: bytes) -> None:
+        # Decrypted data is trimmed to the size listed in the content record, since anything past that is padding.
+        dec_data = dec_data[:self.remaining]
+        self.remaining -= len(dec_data)
+        self.sha1.update(dec_data)
+        if self.output_file is not None:
+            self.output_file.write(dec_data)
+
+    def update(self, enc_data: bytes) -> None:
+        enc_data = self.pending + enc_data
+        usable = len(enc_data) - (len(enc_data) % 16)
+        self.pending = enc_data[usable:]
+        if usable:
+            self._write(self.aes.decrypt(enc_data[:usable]))
+
+    def finish(self) -> str:
+        # Zero-pad any partial final block the same way libWiiPy does, then return the hash of the decrypted content.
+        if self.pending:
+            self._write(self.aes.decrypt(self.pending + (b'\x00' * (16 - len(self.pending)))))
+            self.pending = b''
+        return self.sha1.hexdigest()
+
+
+def _feed_existing_file(path: pathlib.Path, decryptor: ContentDecryptor) -> None:
+    with open(path, "rb") as existing_file:
+        while chunk := existing_file.read(_chunk_size):
+            decryptor.update(chunk)
+
+
+def download_content_to_file(title_id: str, content_id: int, output_path: pathlib.Path,
+                             decryptor: ContentDecryptor = None, wiiu_endpoint: bool = False,
+                             endpoint_override: str = None, resume: bool = False) -> int:
+    # Streams a content from the NUS straight into a file, optionally passing each chunk through a decryptor as it
+    # arrives. Returns the number of bytes downloaded. Errors are raised as ValueErrors to match libWiiPy.
+    # If resume is set and the output file already has data in it, only the rest of the content is requested using an
+    # HTTP range request. The existing data is passed through the decryptor first so that its state picks up where the
+    # file left off. Servers that ignore the range and send the whole content just cause the file to be started over.
+    content_url = get_endpoint_url(wiiu_endpoint, endpoint_override) + title_id + f"/{content_id:08x}"
+    headers = {}
+    offset = output_path.stat().st_size if (resume and output_path.exists()) else 0
+    if offset:
+        headers['Range'] = f"bytes={offset}-"
+    try:
+        content_request = get_session().get(url=content_url, headers=headers, stream=True, timeout=_request_timeout)
+    except requests.exceptions.RequestException:
+        raise ValueError("A connection could not be made to the NUS endpoint. Please make sure that your endpoint "
+                         "is valid and that the NUS is available.")
+    with content_request:
+        # A 416 means that the range starts at or past the end of the content, so the existing file is already whole.
+        if offset and content_request.status_code == 416:
+            if decryptor is not None:
+                _feed_existing_file(output_path, decryptor)
+            return 0
+        if offset and content_request.status_code == 206:
+            if decryptor is not None:
+                _feed_existing_file(output_path, decryptor)
+            file_mode = "ab"
+        elif content_request.status_code == 200:
+            file_mode = "wb"
+        else:
+            raise ValueError("The requested Title ID does not exist, or an invalid Content ID is present in the"
+                             " content records provided.\n Failed while downloading Content ID: " +
+                             f"{content_id:08X}")
+        downloaded_size = 0
+        try:
+            with open(output_path, file_mode) as output_file:
+                for chunk in content_request.iter_content(_chunk_size):
+                    output_file.write(chunk)
+                    downloaded_size += len(chunk)
+                    if decryptor is not None:
+                        decryptor.update(chunk)
+        except requests.exceptions.RequestException:
+            raise ValueError(f"The connection to the NUS was lost while downloading Content ID {content_id:08X}!")
+    return downloaded_size
+
+
+def _offline_error(item: str) -> ValueError:
+    return ValueError(f"{item} is not in the local NUS cache, and cannot be downloaded because --offline was passed!")
+
+
+def fetch_tmd(title_id: str, title_version: int = None, wiiu_endpoint: bool = False, endpoint_override: str = None,
+              cache: NUSCache = None, offline: bool = False) -> bytes:
+    # Gets a TMD from the cache if possible, and downloads it otherwise. Without a version, the NUS always has to be
+    # asked for the latest TMD since a cached one may be outdated, unless we're offline and have no other choice.
+    if cache is not None and (title_version is not None or offline):
+        tmd_data = cache.get_tmd(title_id, title_version, endpoint_override)
+        if tmd_data is not None:
+            return tmd_data
+    if offline:
+        raise _offline_error(f"The TMD for title {title_id}")
+    tmd_data = download_tmd(title_id, title_version, wiiu_endpoint, endpoint_override)
+    if cache is not None:
+        tmd = libWiiPy.title.TMD()
+        tmd.load(tmd_data)
+        cache.put_tmd(title_id, tmd.title_version, tmd_data, endpoint_override)
+    return tmd_data
+
+
+def fetch_ticket(title_id: str, wiiu_endpoint: bool = False, endpoint_override: str = None, cache: NUSCache = None,
+                 offline: bool = False) -> bytes:
+    if cache is not None:
+        ticket_data = cache.get_ticket(title_id, endpoint_override)
+        if ticket_data is not None:
+            return ticket_data
+    if offline:
+        raise _offline_error(f"The Ticket for title {title_id}")
+    ticket_data = download_ticket(title_id, wiiu_endpoint, endpoint_override)
+    if cache is not None:
+        cache.put_ticket(title_id, ticket_data, endpoint_override)
+    return ticket_data
+
+
+def fetch_cert_chain(wiiu_endpoint: bool = False, endpoint_override: str = None, cache: NUSCache = None,
+                     offline: bool = False) -> bytes:
+    if cache is not None:
+        cert_data = cache.get_cert_chain(endpoint_override)
+        if cert_data is not None:
+            return cert_data
+    if offline:
+        raise _offline_error("The certificate chain")
+    cert_data = download_cert_chain(wiiu_endpoint, endpoint_override)
+    if cache is not None:
+        cache.put_cert_chain(cert_data, endpoint_override)
+    return cert_data
+
+
+def _copy_content_file(source_path: pathlib.Path, output_path: pathlib.Path,
+                       decryptor: ContentDecryptor = None) -> None:
+    if decryptor is None:
+        shutil.copyfile(source_path, output_path)
+        return
+    with open(source_path, "rb") as source_file, open(output_path, "wb") as output_file:
+        while chunk := source_file.read(_chunk_size):
+            output_file.write(chunk)
+            decryptor.update(chunk)
+
+
+def _check_content_file(content_path: pathlib.Path, record, title_key: bytes = None,
+                        dec_path: pathlib.Path = None) -> bool:
+    # Checks whether a previously downloaded content is complete and intact. Without a Title Key, this can only check
+    # that the content is the right size.
+    if content_path.stat().st_size != record.content_size + (-record.content_size % 16):
+        return False
+    if title_key is None:
+        return True
+    with open(dec_path, "wb") if dec_path is not None else nullcontext() as dec_file:
+        decryptor = ContentDecryptor(title_key, record.index, record.content_size, dec_file)
+        _feed_existing_file(content_path, decryptor)
+        return decryptor.finish() == record.content_hash.decode()
+
+
+def fetch_content_to_file(title_id: str, record, output_path: pathlib.Path, title_key: bytes = None,
+                          dec_path: pathlib.Path = None, wiiu_endpoint: bool = False, endpoint_override: str = None,
+                          cache: NUSCache = None, offline: bool = False, resume: bool = False) -> int:
+    # Gets the encrypted content for a content record and writes it to a file, from the cache if possible and from the
+    # NUS otherwise. If the Title Key is available, the content is also decrypted along the way so that its hash can be
+    # checked, and the decrypted content is written to dec_path if one is given. Returns the number of bytes that had
+    # to be downloaded, which is 0 when the content came from the cache.
+    # With resume set, a content left in place by an earlier run is kept if it checks out, and downloads go to a .part
+    # file first, which is only moved into place once it's complete. If a run is interrupted, the next run picks up
+    # from the end of the .part file rather than downloading the whole content again.
+    if resume and output_path.exists():
+        if _check_content_file(output_path, record, title_key, dec_path):
+            return 0
+        output_path.unlink()
+    download_path = output_path.with_name(output_path.name + ".part") if resume else output_path
+    cached_path = cache.get_content_path(title_id, record.index, record.content_hash.decode(), endpoint_override) \
+        if cache is not None else None
+    if cached_path is None and offline:
+        raise _offline_error(f"Content with Content ID {record.content_id:08X}")
+    dec_file = open(dec_path, "wb") if (title_key is not None and dec_path is not None) else None
+    try:
+        decryptor = ContentDecryptor(title_key, record.index, record.content_size, dec_file) \
+            if title_key is not None else None
+        if cached_path is not None:
+            _copy_content_file(cached_path, output_path, decryptor)
+            downloaded_size = 0
+        else:
+            downloaded_size = download_content_to_file(title_id, record.content_id, download_path, decryptor,
+                                                       wiiu_endpoint=wiiu_endpoint,
+                                                       endpoint_override=endpoint_override, resume=resume)
+        content_hash = decryptor.finish() if decryptor is not None else None
+    finally:
+        if dec_file is not None:
+            dec_file.close()
+    if content_hash is not None and content_hash != record.content_hash.decode() and cached_path is not None:
+        # Contents cached without a Title Key only had their size checked, so a bad one can make it into the cache. Drop
+        # it and download the content again, which won't find it in the cache anymore.
+        cache.remove_content(title_id, record.index, record.content_hash.decode(), endpoint_override)
+        if offline:
+            raise ValueError(f"The cached copy of Content ID {record.content_id:08X} does not match its record and has "
+                             f"been removed from the local NUS cache! It cannot be downloaded again because --offline "
+                             f"was passed.")
+        return fetch_content_to_file(title_id, record, output_path, title_key, dec_path, wiiu_endpoint,
+                                     endpoint_override, cache, offline, resume)
+    if content_hash is not None and content_hash != record.content_hash.decode():
+        # A partial download that doesn't match can't be resumed from, so remove it and start over next time.
+        if cached_path is None and resume:
+            download_path.unlink(missing_ok=True)
+        raise ValueError(f"Content with Content ID {record.content_id:08X} does not match its record! The download "
+                         f"may be corrupted.\n"
+                         f"Expected hash is: {record.content_hash.decode()}\n"
+                         f"Actual hash is: {content_hash}")
+    if cached_path is None and resume:
+        download_path.replace(output_path)
+    # Only cache contents that were verified against their record. Without a Title Key that isn't possible, so instead
+    # settle for making sure that the content is the expected size, which catches incomplete downloads.
+    if cache is not None and cached_path is None:
+        if content_hash is not None or output_path.stat().st_size == record.content_size + (-record.content_size % 16):
+            cache.put_content(title_id, record.index, record.content_hash.decode(), output_path, endpoint_override)
+    return downloaded_size
+
+
+def fetch_title(title_id: str, title_version: int = None, wiiu_endpoint: bool = False, endpoint_override: str = None,
+                cache: NUSCache = None, offline: bool = False) -> libWiiPy.title.Title:
+    # A cache-aware version of libWiiPy's download_title(). Contents are passed through a temporary directory so that
+    # they can be verified and cached the same way as they are when downloading a title with nus title.
+    title = libWiiPy.title.Title()
+    title.load_cert_chain(fetch_cert_chain(wiiu_endpoint, endpoint_override, cache, offline))
+    title.load_tmd(fetch_tmd(title_id, title_version, wiiu_endpoint, endpoint_override, cache, offline))
+    title.load_ticket(fetch_ticket(title_id, wiiu_endpoint, endpoint_override, cache, offline))
+    title.load_content_records()
+    title_key = title.ticket.get_title_key()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        content_list = []
+        for record in title.content.content_records:
+            content_path = pathlib.Path(tmp_dir).joinpath(f"{record.content_id:08X}".lower())
+            fetch_content_to_file(title_id, record, content_path, title_key, wiiu_endpoint=wiiu_endpoint,
+                                  endpoint_override=endpoint_override, cache=cache, offline=offline)
+            content_list.append(content_path.read_bytes())
+    title.content.content_list = content_list
+    return title
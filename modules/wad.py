@@ -0,0 +1,445 @@
+# "modules/wad.py" from WiiPy by NinjaCheetah
+# https://github.com/NinjaCheetah/WiiPy
+
+import io
+import mmap
+import os
+import pathlib
+import shutil
+import tempfile
+from typing import List, NamedTuple
+import libWiiPy
+from modules.nus import ContentDecryptor
+
+# Size of each chunk copied when writing content stored on disk into a WAD.
+_copy_chunk_size = 1048576
+_journal_magic = b'WIIPYJNL'
+
+
+def _align_value(value: int, alignment: int = 64) -> int:
+    if (value % alignment) != 0:
+        return value + (alignment - (value % alignment))
+    return value
+
+
+def _write_padded(wad_file, data: bytes) -> None:
+    # Every section of a WAD starts on a 64 byte boundary, so pad after each one.
+    wad_file.write(data)
+    wad_file.write(b'\x00' * (_align_value(wad_file.tell()) - wad_file.tell()))
+
+
+class FileRange(NamedTuple):
+    # A range of bytes in a file on disk. Used to copy a content straight from one WAD into another without reading it.
+    path: pathlib.Path
+    offset: int
+    size: int
+
+
+def _copy_file_range(wad_file, source: FileRange) -> None:
+    # Copies a range of another file into the WAD being written. Where the OS supports it, the copy is done entirely by
+    # the kernel using copy_file_range() or sendfile(), so the data never has to pass through Python at all, and some
+    # filesystems can even share the blocks rather than copying them. Otherwise, it falls back to a regular copy.
+    wad_file.flush()
+    dst_offset = wad_file.tell()
+    copied = 0
+    at_eof = False
+    with open(source.path, "rb") as source_file:
+        try:
+            if hasattr(os, "copy_file_range"):
+                while copied < source.size:
+                    count = os.copy_file_range(source_file.fileno(), wad_file.fileno(), source.size - copied,
+                                               source.offset + copied, dst_offset + copied)
+                    if count == 0:
+                        at_eof = True
+                        break
+                    copied += count
+            elif hasattr(os, "sendfile"):
+                os.lseek(wad_file.fileno(), dst_offset, os.SEEK_SET)
+                while copied < source.size:
+                    count = os.sendfile(wad_file.fileno(), source_file.fileno(), source.offset + copied,
+                                        source.size - copied)
+                    if count == 0:
+                        at_eof = True
+                        break
+                    copied += count
+        except OSError:
+            # Not every filesystem supports these, so anything that couldn't be copied this way is copied normally.
+            pass
+        wad_file.seek(dst_offset + copied)
+        source_file.seek(source.offset + copied)
+        while not at_eof and copied < source.size:
+            chunk = source_file.read(min(_copy_chunk_size, source.size - copied))
+            if not chunk:
+                break
+            wad_file.write(chunk)
+            copied += len(chunk)
+
+
+def get_content_region_size(content_records) -> int:
+    # This matches how libWiiPy calculates the content size stored in the WAD header, which counts the padding between
+    # contents but not the padding after the final one.
+    content_region_size = 0
+    for record in content_records[:-1]:
+        content_region_size += _align_value(record.content_size, 64)
+    if content_records:
+        content_region_size += content_records[-1].content_size
+    return content_region_size
+
+
+def _journal_path(wad_path: pathlib.Path) -> pathlib.Path:
+    return wad_path.with_name(wad_path.name + ".journal")
+
+
+def _fsync_dir(dir_path: pathlib.Path) -> None:
+    # Makes sure that a file being created or removed in a directory is actually on disk. Windows doesn't support this,
+    # and doesn't need it to get the same guarantee.
+    try:
+        dir_fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def recover_wad(wad_path: pathlib.Path) -> None:
+    # If an in-place write to a WAD was interrupted, its journal will still be there. The journal holds the original
+    # data for every range that was being overwritten, so writing that back undoes the partial write and leaves the WAD
+    # as it was before.
+    journal_path = _journal_path(wad_path)
+    if not journal_path.exists():
+        return
+    journal = journal_path.read_bytes()
+    if journal[:8] != _journal_magic:
+        raise ValueError(f"The journal for the WAD \"{wad_path}\" is not valid, so an interrupted write could not be "
+                         f"undone!")
+    with open(wad_path, "r+b") as wad_file:
+        journal_offset = 8
+        while journal_offset < len(journal):
+            range_offset = int.from_bytes(journal[journal_offset:journal_offset + 8])
+            range_size = int.from_bytes(journal[journal_offset + 8:journal_offset + 12])
+            journal_offset += 12
+            wad_file.seek(range_offset)
+            wad_file.write(journal[journal_offset:journal_offset + range_size])
+            journal_offset += range_size
+        wad_file.flush()
+        os.fsync(wad_file.fileno())
+    journal_path.unlink()
+    _fsync_dir(wad_path.parent)
+
+
+def _changed_ranges(old_data: bytes, new_data: bytes, base_offset: int) -> List[tuple[int, bytes, bytes]]:
+    # Finds which 64 byte blocks differ between the old and new data, merging neighbouring blocks into one range.
+    # Returns the offset of each range along with both its old and new data.
+    ranges = []
+    for block in range(0, len(new_data), 64):
+        if old_data[block:block + 64] != new_data[block:block + 64]:
+            if ranges and ranges[-1][0] + len(ranges[-1][2]) == base_offset + block:
+                range_start = ranges[-1][0] - base_offset
+                ranges[-1] = (ranges[-1][0], old_data[range_start:block + 64], new_data[range_start:block + 64])
+            else:
+                ranges.append((base_offset + block, old_data[block:block + 64], new_data[block:block + 64]))
+    return ranges
+
+
+def _write_wad_in_place(output_path: pathlib.Path, prefix: bytes, contents: List[bytes | pathlib.Path | FileRange],
+                        suffix: bytes) -> bool:
+    # When every content is being copied from the WAD being written, and from exactly where it would be written to, then
+    # none of the sections before it have changed size and the content region is already in place. In that case only
+    # the byte ranges that actually changed are written, which for something like fakesigning is a few KB no matter how
+    # large the WAD is. Returns False if the WAD can't be written this way.
+    content_offset = len(prefix)
+    for content in contents:
+        if not isinstance(content, FileRange) or content.offset != content_offset:
+            return False
+        if not output_path.samefile(content.path):
+            return False
+        content_offset += _align_value(content.size)
+    if output_path.stat().st_size != content_offset + len(suffix):
+        return False
+    with open(output_path, "r+b") as wad_file:
+        old_prefix = wad_file.read(len(prefix))
+        wad_file.seek(content_offset)
+        old_suffix = wad_file.read(len(suffix))
+        changes = _changed_ranges(old_prefix, prefix, 0) + _changed_ranges(old_suffix, suffix, content_offset)
+        if not changes:
+            return True
+        # Save the original data for every range that's about to be overwritten into a journal first. The journal is
+        # only moved into place once it's completely written, so if it exists then it can be trusted, and if writing
+        # the WAD is interrupted then recover_wad() can use it to put the WAD back the way it was.
+        journal = _journal_magic
+        for change_offset, old_data, _ in changes:
+            journal += int.to_bytes(change_offset, 8) + int.to_bytes(len(old_data), 4) + old_data
+        journal_path = _journal_path(output_path)
+        fd, tmp_name = tempfile.mkstemp(dir=output_path.parent, prefix=f".{journal_path.name}-", suffix=".tmp")
+        with os.fdopen(fd, "wb") as journal_file:
+            journal_file.write(journal)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(tmp_name, journal_path)
+        _fsync_dir(output_path.parent)
+        for change_offset, _, new_data in changes:
+            wad_file.seek(change_offset)
+            wad_file.write(new_data)
+        wad_file.flush()
+        os.fsync(wad_file.fileno())
+    journal_path.unlink()
+    _fsync_dir(output_path.parent)
+    return True
+
+
+def write_wad(output_path: pathlib.Path, cert_data: bytes, ticket_data: bytes, tmd_data: bytes, content_records,
+              contents: List[bytes | pathlib.Path | FileRange], meta_data: bytes = b'', crl_data: bytes = b'',
+              wad_type: str = "Is") -> None:
+    # Writes a WAD directly to a file, one section at a time, producing the same output as libWiiPy's dump_wad(). Each
+    # entry in contents is either the encrypted content itself, a path to a file containing it, which will be copied
+    # in chunks so that large contents never need to be loaded into memory, or a range of an existing WAD to copy it
+    # from directly.
+    # Everything before the content region is small, so it's assembled up front.
+    with io.BytesIO() as prefix_data:
+        header = b'\x00\x00\x00\x20' + wad_type.encode() + b'\x00\x00'
+        header += int.to_bytes(len(cert_data), 4)
+        header += int.to_bytes(len(crl_data), 4)
+        header += int.to_bytes(len(ticket_data), 4)
+        header += int.to_bytes(len(tmd_data), 4)
+        header += int.to_bytes(get_content_region_size(content_records), 4)
+        header += int.to_bytes(len(meta_data), 4)
+        _write_padded(prefix_data, header)
+        _write_padded(prefix_data, cert_data)
+        _write_padded(prefix_data, crl_data)
+        _write_padded(prefix_data, ticket_data)
+        _write_padded(prefix_data, tmd_data)
+        prefix = prefix_data.getvalue()
+    # The meta section always starts on a 64 byte boundary, so it can be padded on its own.
+    suffix = meta_data + (b'\x00' * (_align_value(len(meta_data)) - len(meta_data)))
+
+    # If any content is being copied out of the file that's about to be written, then either only the parts that
+    # changed are written in place, or if that isn't possible, the WAD is written to a temporary file next to it first
+    # and then moved into place, so that the source isn't truncated before it's been read.
+    sources = [content.path if isinstance(content, FileRange) else content for content in contents
+               if isinstance(content, (pathlib.Path, FileRange))]
+    if output_path.exists() and any(output_path.samefile(source) for source in sources):
+        recover_wad(output_path)
+        if _write_wad_in_place(output_path, prefix, contents, suffix):
+            return
+        fd, tmp_name = tempfile.mkstemp(dir=output_path.parent, prefix=f".{output_path.name}-", suffix=".tmp")
+        os.close(fd)
+        try:
+            write_wad(pathlib.Path(tmp_name), cert_data, ticket_data, tmd_data, content_records, contents, meta_data,
+                      crl_data, wad_type)
+            os.replace(tmp_name, output_path)
+        finally:
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+        return
+    with open(output_path, "wb") as wad_file:
+        wad_file.write(prefix)
+        # Contents are padded to 16 bytes for encryption, and then the next content starts at the next 64 byte
+        # boundary, which padding every content to 64 bytes covers.
+        for content in contents:
+            if isinstance(content, pathlib.Path):
+                with open(content, "rb") as content_file:
+                    shutil.copyfileobj(content_file, wad_file, _copy_chunk_size)
+                _write_padded(wad_file, b'')
+            elif isinstance(content, FileRange):
+                _copy_file_range(wad_file, content)
+                _write_padded(wad_file, b'')
+            else:
+                _write_padded(wad_file, content)
+        wad_file.write(suffix)
+
+
+def write_title_wad(output_path: pathlib.Path, title: libWiiPy.title.Title) -> None:
+    # A streaming replacement for output_path.write_bytes(title.dump_wad()). The same updates that dump_wad() makes to
+    # the title are made first, and then each section is written straight to the output file, so the WAD is never
+    # assembled in memory on top of the contents that are already there.
+    if title.tmd.title_id == "0000000100000001":
+        title.wad.wad_type = "ib"
+    title.tmd.content_records = title.content.content_records
+    title.tmd.num_contents = len(title.content.content_records)
+    write_wad(output_path, title.cert_chain.dump(), title.ticket.dump(), title.tmd.dump(),
+              title.content.content_records, title.content.content_list, title.wad.wad_meta_data,
+              title.wad.wad_crl_data, title.wad.wad_type)
+
+
+class WADReader:
+    # Reads a WAD through a memory map, so that only the parts of it that actually get used are ever read from disk.
+    # The header is parsed to find where each section starts, and contents are handed out as memoryviews into the map
+    # rather than being copied out, which means that opening a large WAD to look at its TMD or banner only costs as
+    # much as reading those few KB would. The reader must stay open for as long as any of those contents are in use.
+    def __init__(self, wad_path: pathlib.Path):
+        # A WAD with an interrupted in-place write is only partly written, so it can't be read until that write has been
+        # undone. Undoing it means writing to the WAD, which reading shouldn't ever do (and can't do at all if the WAD
+        # is read-only), so that's left to the commands that write to it.
+        if _journal_path(wad_path).exists():
+            raise ValueError(f"The WAD \"{wad_path}\" has an unfinished in-place write that needs to be undone before "
+                             f"it can be read! Any command that writes to this WAD in place will undo it first.")
+        self.wad_file = open(wad_path, "rb")
+        try:
+            self.wad_map = mmap.mmap(self.wad_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap can't map an empty file.
+            self.wad_file.close()
+            raise ValueError("The provided WAD file is empty!")
+        self.views = []
+        header = self.wad_map[:0x20]
+        if len(header) < 0x20:
+            self.close()
+            raise ValueError("The provided WAD file is too small to contain a valid header!")
+        self.wad_hdr_size = int.from_bytes(header[0x0:0x4])
+        self.wad_type = header[0x4:0x6].decode(errors="replace")
+        self.wad_version = header[0x6:0x8]
+        self.wad_cert_size = int.from_bytes(header[0x8:0xC])
+        self.wad_crl_size = int.from_bytes(header[0xC:0x10])
+        self.wad_tik_size = int.from_bytes(header[0x10:0x14])
+        self.wad_tmd_size = int.from_bytes(header[0x14:0x18])
+        # Like in libWiiPy, the content region is read out to the end of its final 16 byte block.
+        self.wad_content_size = _align_value(int.from_bytes(header[0x18:0x1C]), 16)
+        self.wad_meta_size = int.from_bytes(header[0x1C:0x20])
+        # Every section of the WAD is padded out to a multiple of 64 bytes.
+        self.wad_cert_offset = _align_value(self.wad_hdr_size)
+        self.wad_crl_offset = _align_value(self.wad_cert_offset + self.wad_cert_size)
+        self.wad_tik_offset = _align_value(self.wad_crl_offset + self.wad_crl_size)
+        self.wad_tmd_offset = _align_value(self.wad_tik_offset + self.wad_tik_size)
+        self.wad_content_offset = _align_value(self.wad_tmd_offset + self.wad_tmd_size)
+        self.wad_meta_offset = _align_value(self.wad_content_offset + self.wad_content_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        # Every view into the map has to be released before the map itself can be closed.
+        for view in self.views:
+            view.release()
+        self.views = []
+        self.wad_map.close()
+        self.wad_file.close()
+
+    def _view(self, offset: int, size: int) -> memoryview:
+        view = memoryview(self.wad_map)[offset:offset + size]
+        self.views.append(view)
+        return view
+
+    def get_cert_data(self) -> bytes:
+        return self.wad_map[self.wad_cert_offset:self.wad_cert_offset + self.wad_cert_size]
+
+    def get_crl_data(self) -> bytes:
+        return self.wad_map[self.wad_crl_offset:self.wad_crl_offset + self.wad_crl_size]
+
+    def get_ticket_data(self) -> bytes:
+        return self.wad_map[self.wad_tik_offset:self.wad_tik_offset + self.wad_tik_size]
+
+    def get_tmd_data(self) -> bytes:
+        return self.wad_map[self.wad_tmd_offset:self.wad_tmd_offset + self.wad_tmd_size]
+
+    def get_meta_data(self) -> bytes:
+        return self.wad_map[self.wad_meta_offset:self.wad_meta_offset + self.wad_meta_size]
+
+    def get_content_offsets(self, content_records) -> List[int]:
+        # Contents are padded to 16 bytes for encryption, and each one starts at the next 64 byte boundary after the
+        # last.
+        content_offsets = []
+        content_offset = self.wad_content_offset
+        for record in content_records:
+            content_offsets.append(content_offset)
+            content_offset += _align_value(record.content_size)
+        return content_offsets
+
+    def get_content_views(self, content_records) -> List[memoryview | bytes]:
+        # A content cut short by a truncated WAD is copied out instead, since libWiiPy pads short contents by
+        # concatenating bytes onto them, which a memoryview doesn't support.
+        content_views = []
+        for record, content_offset in zip(content_records, self.get_content_offsets(content_records)):
+            content_size = _align_value(record.content_size, 16)
+            content_view = self._view(content_offset, content_size)
+            if len(content_view) < content_size:
+                content_view = bytes(content_view)
+            content_views.append(content_view)
+        return content_views
+
+    def load_title(self) -> libWiiPy.title.Title:
+        # Builds a Title the same way that libWiiPy's load_wad() does, except that the content list is made up of views
+        # into the memory map. Nothing is read from the content region until a content is actually used.
+        title = libWiiPy.title.Title()
+        title.wad.wad_hdr_size = self.wad_hdr_size
+        title.wad.wad_type = self.wad_type
+        title.wad.wad_version = self.wad_version
+        title.wad.wad_cert_size = self.wad_cert_size
+        title.wad.wad_crl_size = self.wad_crl_size
+        title.wad.wad_tik_size = self.wad_tik_size
+        title.wad.wad_tmd_size = self.wad_tmd_size
+        title.wad.wad_content_size = self.wad_content_size
+        title.wad.wad_meta_size = self.wad_meta_size
+        title.wad.wad_cert_data = self.get_cert_data()
+        title.wad.wad_crl_data = self.get_crl_data()
+        title.wad.wad_tik_data = self.get_ticket_data()
+        title.wad.wad_tmd_data = self.get_tmd_data()
+        title.wad.wad_meta_data = self.get_meta_data()
+        title.load_cert_chain(title.wad.wad_cert_data)
+        title.load_tmd(title.wad.wad_tmd_data)
+        title.load_ticket(title.wad.wad_tik_data)
+        title.load_content_records()
+        title.content.content_list = self.get_content_views(title.tmd.content_records)
+        return title
+
+
+def decrypt_wad_content(wad_path: pathlib.Path, content_offset: int, content_index: int, content_size: int,
+                        title_key: bytes, output_path: pathlib.Path) -> str:
+    # Decrypts a single content straight from a WAD into a file, a chunk at a time, and returns the SHA-1 hash of the
+    # decrypted data so that it can be checked against the content's record. Everything passed in is small enough to
+    # send to a worker process, which maps the WAD itself rather than having the content's data sent to it.
+    with open(wad_path, "rb") as wad_file, mmap.mmap(wad_file.fileno(), 0, access=mmap.ACCESS_READ) as wad_map:
+        with open(output_path, "wb") as output_file:
+            decryptor = ContentDecryptor(title_key, content_index, content_size, output_file)
+            content_end = content_offset + _align_value(content_size, 16)
+            for chunk_offset in range(content_offset, content_end, _copy_chunk_size):
+                decryptor.update(wad_map[chunk_offset:min(chunk_offset + _copy_chunk_size, content_end)])
+            return decryptor.finish()
+
+
+def _recover_if_in_place(wad_path: pathlib.Path, output_path: pathlib.Path | None) -> None:
+    # Commands that are about to write a WAD back over itself undo any interrupted in-place write to it first, since
+    # the WAD can't be read otherwise. This is the only time that loading a WAD writes to it.
+    if output_path is not None and output_path.exists() and output_path.samefile(wad_path):
+        recover_wad(wad_path)
+
+
+def load_wad_file(wad_path: pathlib.Path, output_path: pathlib.Path = None) -> libWiiPy.title.Title:
+    # Loads a WAD for a command that's going to modify it. Unlike load_wad(read_bytes()), which holds the raw file, the
+    # WAD's content region and the content list all at once, each content is read straight from the file into the
+    # content list, so the WAD's data is only ever in memory a single time. Contents are read with regular reads rather
+    # than being copied out of the memory map, so that the mapped pages don't take up memory as well. The file is
+    # closed again before returning, so it's safe for the output to overwrite it.
+    # If the output path is the same WAD, any interrupted in-place write to it is undone first.
+    _recover_if_in_place(wad_path, output_path)
+    with WADReader(wad_path) as wad_reader:
+        title = wad_reader.load_title()
+        content_offsets = wad_reader.get_content_offsets(title.content.content_records)
+    content_list = []
+    with open(wad_path, "rb") as wad_file:
+        for record, content_offset in zip(title.content.content_records, content_offsets):
+            wad_file.seek(content_offset)
+            content_list.append(wad_file.read(_align_value(record.content_size, 16)))
+    title.content.content_list = content_list
+    return title
+
+
+def load_wad_metadata(wad_path: pathlib.Path, output_path: pathlib.Path = None) -> libWiiPy.title.Title:
+    # Loads everything in a WAD except for its contents, for commands that only edit the TMD and Ticket. Contents are
+    # encrypted using their index as the IV, and the Title Key itself never changes even when it's re-encrypted for a
+    # new Title ID or common key, so none of those edits change the encrypted contents. Instead of being read, each
+    # content is left as a range of the original file, and write_title_wad() copies them over byte-for-byte. This makes
+    # these edits cost about as much as the TMD and Ticket themselves, no matter how large the title is.
+    # The contents can't be decrypted from a title loaded this way, so use load_wad_file() if they're needed.
+    _recover_if_in_place(wad_path, output_path)
+    with WADReader(wad_path) as wad_reader:
+        title = wad_reader.load_title()
+        content_offsets = wad_reader.get_content_offsets(title.content.content_records)
+    title.content.content_list = [FileRange(wad_path, content_offset, _align_value(record.content_size, 16))
+                                  for record, content_offset in zip(title.content.content_records, content_offsets)]
+    return title
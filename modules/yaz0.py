@@ -0,0 +1,52 @@
+# "modules/yaz0.py" from WiiPy by NinjaCheetah
+# https://github.com/NinjaCheetah/WiiPy
+#
+# Yaz0 is an LZ77-style compression format used by many first-party Wii games. It has a 16 byte header, and unlike
+# Nintendo's other LZ77 formats, a set flag bit means a literal byte rather than a reference.
+
+
+def decompress_yaz0(data: bytes) -> bytes:
+    # Decompresses Yaz0 data and returns the result.
+    if data[0:4] != b'Yaz0':
+        raise ValueError("This is not valid Yaz0 data!")
+    if len(data) < 0x10:
+        raise ValueError("The Yaz0 data is too short to contain a valid header!")
+    size = int.from_bytes(data[4:8], 'big')
+    src = 0x10
+    out = bytearray(size)
+    pos = 0
+    try:
+        while pos < size:
+            flag = data[src]
+            src += 1
+            for bit in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+                if pos >= size:
+                    break
+                if flag & bit:
+                    out[pos] = data[src]
+                    pos += 1
+                    src += 1
+                    continue
+                # References are 2 bytes, with the length in the top 4 bits. When those bits are 0, the length is too
+                # long to fit there and is stored in a third byte instead.
+                first = data[src]
+                distance = (((first & 0xF) << 8) | data[src + 1]) + 1
+                if first >> 4:
+                    length = (first >> 4) + 2
+                    src += 2
+                else:
+                    length = data[src + 2] + 0x12
+                    src += 3
+                offset = pos - distance
+                if offset < 0:
+                    raise ValueError("The Yaz0 data references data before the start of the output!")
+                if length > size - pos:
+                    length = size - pos
+                if distance >= length:
+                    out[pos:pos + length] = out[offset:offset + length]
+                else:
+                    out[pos:pos + length] = (out[offset:pos] * (length // distance + 1))[:length]
+                pos += length
+    except IndexError:
+        raise ValueError("The Yaz0 data ended before all of the data could be decompressed!")
+    return bytes(out)
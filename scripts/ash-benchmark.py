@@ -0,0 +1,63 @@
+import pathlib
+import sys
+import time
+import libWiiPy
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+from modules.ash import compress_ash, decompress_ash  # noqa: E402
+
+# Compares the decompression speed of WiiPy's ASH decoder against libWiiPy's. ASH files (like the ones in the Wii
+# Menu's files) are used as-is, and anything else is compressed with WiiPy's ASH compressor first, which is timed too.
+# The output of both decoders is checked to make sure that it matches. Tree widths default to the Wii Menu's, and can
+# be changed for files that use different ones.
+# Usage: python3 scripts/ash-benchmark.py <file> [file ...] [--sym-bits N] [--dist-bits N]
+
+args = sys.argv[1:]
+sym_bits = 9
+dist_bits = 11
+for option in ("--sym-bits", "--dist-bits"):
+    if option in args:
+        value = int(args[args.index(option) + 1])
+        del args[args.index(option):args.index(option) + 2]
+        if option == "--sym-bits":
+            sym_bits = value
+        else:
+            dist_bits = value
+if not args:
+    print("Usage: python3 scripts/ash-benchmark.py <file> [file ...] [--sym-bits N] [--dist-bits N]")
+    sys.exit(1)
+
+
+def timed(function, *function_args):
+    start = time.perf_counter()
+    result = function(*function_args)
+    return result, time.perf_counter() - start
+
+
+failed = False
+total_size = 0
+total_times = {"libWiiPy": 0.0, "WiiPy": 0.0}
+for file in args:
+    data = pathlib.Path(file).read_bytes()
+    if data[0:4] != b'ASH0':
+        compressed, elapsed = timed(compress_ash, data, sym_bits, dist_bits)
+        print(f"{file}: compressed {len(data)} bytes to {len(compressed)} bytes at "
+              f"{len(data) / elapsed / 1048576:.3f} MB/s")
+        data = compressed
+    expected, lib_time = timed(libWiiPy.archive.decompress_ash, data, sym_bits, dist_bits)
+    output, wiipy_time = timed(decompress_ash, data, sym_bits, dist_bits)
+    matches = output == expected
+    failed |= not matches
+    total_size += len(expected)
+    total_times["libWiiPy"] += lib_time
+    total_times["WiiPy"] += wiipy_time
+    print(f"{file} ({len(data)} bytes compressed, {len(expected)} bytes decompressed)")
+    print(f"  libWiiPy  {len(expected) / lib_time / 1048576:8.3f} MB/s  {lib_time:.4f}s")
+    print(f"  WiiPy     {len(expected) / wiipy_time / 1048576:8.3f} MB/s  {wiipy_time:.4f}s  "
+          f"{lib_time / wiipy_time:.1f}x  [{'OK' if matches else 'MISMATCH'}]")
+
+if len(args) > 1:
+    print(f"\nTotal: libWiiPy {total_size / total_times['libWiiPy'] / 1048576:.3f} MB/s, "
+          f"WiiPy {total_size / total_times['WiiPy'] / 1048576:.3f} MB/s "
+          f"({total_times['libWiiPy'] / total_times['WiiPy']:.1f}x)")
+sys.exit(1 if failed else 0)
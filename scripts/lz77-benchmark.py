@@ -0,0 +1,45 @@
+import pathlib
+import sys
+import time
+import libWiiPy
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+from modules.lz77 import compress_lz77  # noqa: E402
+
+# Compares the speed and compression ratio of WiiPy's LZ77 compressor at each level against libWiiPy's compressor.
+# libWiiPy's compressor is very slow on large files, so only the first part of each file is used for it, which can be
+# set with the optional sample size (in KiB). Every result is decompressed again to make sure it round-trips.
+# Usage: python3 scripts/lz77-benchmark.py <file> [file ...] [--sample KiB]
+
+args = sys.argv[1:]
+sample_size = 64 * 1024
+if "--sample" in args:
+    sample_size = int(args[args.index("--sample") + 1]) * 1024
+    del args[args.index("--sample"):args.index("--sample") + 2]
+if not args:
+    print("Usage: python3 scripts/lz77-benchmark.py <file> [file ...] [--sample KiB]")
+    sys.exit(1)
+
+
+def run(name: str, data: bytes, compress) -> bool:
+    start = time.perf_counter()
+    compressed = compress(data)
+    elapsed = time.perf_counter() - start
+    round_trips = libWiiPy.archive.decompress_lz77(compressed) == data
+    print(f"  {name:<20} {len(data) / elapsed / 1048576:8.3f} MB/s  ratio: {len(compressed) / max(len(data), 1):.3f}  "
+          f"[{'OK' if round_trips else 'MISMATCH'}]")
+    return round_trips
+
+
+failed = False
+for file in args:
+    data = pathlib.Path(file).read_bytes()
+    print(f"{file} ({len(data)} bytes)")
+    for level in (1, 2, 3):
+        failed |= not run(f"WiiPy level {level}", data, lambda d: compress_lz77(d, level))
+    sample = data[:sample_size]
+    print(f"  First {len(sample)} bytes:")
+    failed |= not run("WiiPy level 1", sample, lambda d: compress_lz77(d, 1))
+    failed |= not run("libWiiPy level 1", sample, lambda d: libWiiPy.archive.compress_lz77(d, 1))
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,56 @@
+import io
+import pathlib
+import sys
+import time
+import libWiiPy
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+from modules.lz77 import compress_lz77, decompress_lz77, decompress_lz77_to_file  # noqa: E402
+
+# Compares the decompression speed of WiiPy's LZ77 decompressor against libWiiPy's, both in memory and when streamed to
+# a file. Files that are already LZ77-compressed (like compressed U8 archives from a channel's banner) are used as-is,
+# and anything else is compressed first. The output of each decompressor is checked against libWiiPy's.
+# Usage: python3 scripts/lz77-decompress-benchmark.py <file> [file ...] [--runs N]
+
+args = sys.argv[1:]
+runs = 3
+if "--runs" in args:
+    runs = int(args[args.index("--runs") + 1])
+    del args[args.index("--runs"):args.index("--runs") + 2]
+if not args:
+    print("Usage: python3 scripts/lz77-decompress-benchmark.py <file> [file ...] [--runs N]")
+    sys.exit(1)
+
+
+def stream(data: bytes) -> bytes:
+    with io.BytesIO() as output_file:
+        decompress_lz77_to_file(data, output_file)
+        return output_file.getvalue()
+
+
+def run(name: str, data: bytes, decompress, expected: bytes) -> bool:
+    # Take the best of the runs to keep other activity on the system from skewing the results.
+    best = None
+    output = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = decompress(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    matches = output == expected
+    print(f"  {name:<20} {len(expected) / best / 1048576:8.3f} MB/s  {best:.4f}s  [{'OK' if matches else 'MISMATCH'}]")
+    return matches
+
+
+failed = False
+for file in args:
+    data = pathlib.Path(file).read_bytes()
+    if data[0:4] != b'LZ77':
+        data = compress_lz77(data)
+    expected = libWiiPy.archive.decompress_lz77(data)
+    print(f"{file} ({len(data)} bytes compressed, {len(expected)} bytes decompressed)")
+    failed |= not run("libWiiPy", data, libWiiPy.archive.decompress_lz77, expected)
+    failed |= not run("WiiPy", data, decompress_lz77, expected)
+    failed |= not run("WiiPy (streamed)", data, stream, expected)
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,37 @@
+import pathlib
+import subprocess
+import sys
+import time
+
+# Measures how long WiiPy takes to start up and reach a subcommand. Each command is run with --help so that only
+# argument parsing and handler lookup are measured, not the work the command itself does.
+# Usage: python3 scripts/startup-benchmark.py [runs] [target_ms]
+
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+target_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 150.0
+wiipy = pathlib.Path(__file__).parent.parent.joinpath("wiipy.py")
+
+commands = [
+    ["--help"],
+    ["info", "--help"],
+    ["fakesign", "--help"],
+    ["wad", "unpack", "--help"],
+    ["nus", "title", "--help"],
+]
+
+failed = False
+for command in commands:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(wiipy)] + command, stdout=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    median = times[len(times) // 2]
+    status = "OK" if median <= target_ms else "SLOW"
+    if median > target_ms:
+        failed = True
+    print(f"{' '.join(command):<24} median: {median:7.1f} ms  min: {times[0]:7.1f} ms  [{status}]")
+
+print(f"\nTarget: {target_ms} ms median startup")
+sys.exit(1 if failed else 0)
@@ -2,30 +2,27 @@
 # https://github.com/NinjaCheetah/WiiPy
 
 import argparse
-from importlib.metadata import version
-
-from commands.archive.ash import *
-from commands.archive.lz77 import *
-from commands.archive.theme import *
-from commands.archive.u8 import *
-from commands.nand.emunand import *
-from commands.nand.setting import *
-from commands.title.ciosbuild import *
-from commands.title.fakesign import *
-from commands.title.info import *
-from commands.title.iospatcher import *
-from commands.title.nus import *
-from commands.title.tmd import *
-from commands.title.wad import *
+from modules.dispatch import resolve_handler
 
 wiipy_ver = "1.5.1"
 
+
+class _VersionAction(argparse.Action):
+    # Looking up libWiiPy's version requires scanning installed package metadata, which is slow enough to be noticeable
+    # on every run, so only do it when --version is actually passed.
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from importlib.metadata import version
+        parser.exit(message=f"WiiPy v{wiipy_ver}, based on libWiiPy v{version('libWiiPy')} (from branch \'main\')\n")
+
+
 if __name__ == "__main__":
     # Main argument parser.
     parser = argparse.ArgumentParser(
         description="A simple command line tool to manage file formats used by the Wii.")
-    parser.add_argument("--version", action="version",
-                        version=f"WiiPy v{wiipy_ver}, based on libWiiPy v{version('libWiiPy')} (from branch \'main\')")
+    parser.add_argument("--version", action=_VersionAction, help="show program's version number and exit")
     subparsers = parser.add_subparsers(title="subcommands", dest="subcommand", required=True)
 
     # Argument parser for the ASH subcommand.
@@ -36,7 +33,7 @@ if __name__ == "__main__":
     ash_compress_parser = ash_subparsers.add_parser("compress", help="compress a file into an ASH file",
                                                     description="compress a file into an ASH file; by default, this "
                                                                 "will output to <input file>.ash")
-    ash_compress_parser.set_defaults(func=handle_ash_compress)
+    ash_compress_parser.set_defaults(func="handle_ash_compress")
     ash_compress_parser.add_argument("input", metavar="IN", type=str, help="file to compress")
     ash_compress_parser.add_argument("--sym-bits", metavar="SYM_BITS", type=int,
                             help="number of bits in each symbol tree leaf (default: 9)", default=9)
@@ -48,19 +45,33 @@ if __name__ == "__main__":
     ash_decompress_parser = ash_subparsers.add_parser("decompress", help="decompress an ASH file",
                                                       description="decompress an ASH file; by default, this will "
                                                                   "output to <input file>.arc")
-    ash_decompress_parser.set_defaults(func=handle_ash_decompress)
+    ash_decompress_parser.set_defaults(func="handle_ash_decompress")
     ash_decompress_parser.add_argument("input", metavar="IN", type=str, help="ASH file to decompress")
     ash_decompress_parser.add_argument("--sym-bits", metavar="SYM_BITS", type=int,
-                            help="number of bits in each symbol tree leaf (default: 9)", default=9)
+                            help="number of bits in each symbol tree leaf (default: detected automatically)")
     ash_decompress_parser.add_argument("--dist-bits", metavar="DIST_BITS", type=int,
-                            help="number of bits in each distance tree leaf (default: 11)", default=11)
+                            help="number of bits in each distance tree leaf (default: detected automatically)")
     ash_decompress_parser.add_argument("-o", "--output", metavar="OUT", type=str,
                                      help="file to output the ASH file to (optional)")
 
+    # Argument parser for the batch subcommand.
+    batch_parser = subparsers.add_parser("batch", help="run many WiiPy commands in a single process",
+                                         description="run many WiiPy commands in a single process; each line of "
+                                                     "the job list is one command, written either as it would be on "
+                                                     "the command line (eg. \"wad unpack a.wad out\") or as a JSON "
+                                                     "array of arguments")
+    batch_parser.set_defaults(func="handle_batch", parser=parser)
+    batch_parser.add_argument("jobs", metavar="JOBS", type=str, nargs="?", default="-",
+                              help="file containing the job list (optional, reads from stdin if not specified)")
+    batch_parser.add_argument("-x", "--exit-on-error", action="store_true",
+                              help="stop running jobs after the first one that fails")
+    batch_parser.add_argument("-r", "--results", metavar="RESULTS", type=str,
+                              help="file to write the result of each job to as JSON lines (optional)")
+
     # Argument parser for the cIOS command
     cios_parser = subparsers.add_parser("cios", help="build a cIOS from a base IOS and provided map",
                                         description="build a cIOS from a base IOS and provided map")
-    cios_parser.set_defaults(func=build_cios)
+    cios_parser.set_defaults(func="build_cios")
     cios_parser.add_argument("base", metavar="BASE", type=str, help="base IOS WAD")
     cios_parser.add_argument("map", metavar="MAP", type=str, help="cIOS map file")
     cios_parser.add_argument("output", metavar="OUT", type=str, help="file to output the cIOS to")
@@ -77,10 +88,22 @@ if __name__ == "__main__":
     emunand_parser = subparsers.add_parser("emunand", help="manage Wii EmuNAND directories",
                                            description="manage Wii EmuNAND directories")
     emunand_subparsers = emunand_parser.add_subparsers(title="emunand", dest="emunand", required=True)
+    # GC EmuNAND subcommand.
+    emunand_gc_parser = emunand_subparsers.add_parser("gc", help="remove unused shared contents from an EmuNAND",
+                                                      description="remove shared contents that aren't used by any "
+                                                                  "installed title from an EmuNAND, like the ones left "
+                                                                  "behind after uninstalling titles")
+    emunand_gc_parser.set_defaults(func="handle_emunand_gc")
+    emunand_gc_parser.add_argument("emunand", metavar="EMUNAND", type=str,
+                                   help="path of the EmuNAND directory")
+    emunand_gc_parser.add_argument("-n", "--dry-run", action="store_true",
+                                   help="only list the shared contents that would be removed, without removing them")
+    emunand_gc_parser.add_argument("-v", "--verbose", action="store_true",
+                                   help="list which titles use each shared content that's kept")
     # Info EmuNAND subcommand.
     emunand_info_parser = emunand_subparsers.add_parser("info", help="show info about an EmuNAND",
                                                         description="show info about an EmuNAND")
-    emunand_info_parser.set_defaults(func=handle_emunand_info)
+    emunand_info_parser.set_defaults(func="handle_emunand_info")
     emunand_info_parser.add_argument("emunand", metavar="EMUNAND", type=str,
                                      help="path of the EmuNAND directory")
     # Install-Missing EmuNAND command.
@@ -90,16 +113,58 @@ if __name__ == "__main__":
                                                                                "checking installed titles and finding "
                                                                                "their required IOSes, then downloading "
                                                                                "and installing any that are missing")
-    emunand_install_missing_parser.set_defaults(func=handle_emunand_install_missing)
+    emunand_install_missing_parser.set_defaults(func="handle_emunand_install_missing")
     emunand_install_missing_parser.add_argument("emunand", metavar="EMUNAND", type=str,
                                                 help="path of the EmuNAND directory")
     emunand_install_missing_parser.add_argument("--vwii", action="store_true",
                                                 help="override the automatic vWii detection based on the installed "
                                                      "System Menu and use vWii IOSes")
+    emunand_install_missing_parser.add_argument("-w", "--wad-dir", metavar="DIR", type=str,
+                                                help="directory of IOS WADs to install from before downloading "
+                                                     "anything (optional)")
+    emunand_install_missing_parser.add_argument("-j", "--jobs", metavar="JOBS", type=int, default=4,
+                                                help="number of IOSes to download at once (optional, defaults to 4)")
+    emunand_install_missing_parser.add_argument("-e", "--endpoint", metavar="ENDPOINT", type=str,
+                                                help="use the specified NUS endpoint instead of the official one")
+    emunand_install_missing_cache_group = emunand_install_missing_parser.add_mutually_exclusive_group()
+    emunand_install_missing_cache_group.add_argument("--offline", action="store_true",
+                                                     help="only use data from the local NUS cache, and never connect "
+                                                          "to the NUS")
+    emunand_install_missing_cache_group.add_argument("--no-cache", action="store_true",
+                                                     help="don't read from or write to the local NUS cache")
+    # Provision EmuNAND subcommand.
+    emunand_provision_parser = emunand_subparsers.add_parser("provision",
+                                                             help="install the titles in a manifest to EmuNANDs",
+                                                             description="install every title in a manifest to one or "
+                                                                         "more EmuNANDs, decrypting each title only "
+                                                                         "once; each line of the manifest is either "
+                                                                         "the path to a WAD or a Title ID to download, "
+                                                                         "optionally followed by a version")
+    emunand_provision_parser.set_defaults(func="handle_emunand_provision")
+    emunand_provision_parser.add_argument("manifest", metavar="MANIFEST", type=str,
+                                          help="manifest of titles to install")
+    emunand_provision_parser.add_argument("emunands", metavar="EMUNAND", type=str, nargs="+",
+                                          help="path of each target EmuNAND directory (created if it doesn't exist)")
+    emunand_provision_parser.add_argument("-l", "--link", choices=["hardlink", "reflink", "copy"], default="hardlink",
+                                          help="how to share installed files between EmuNANDs; falls back on copying "
+                                               "when not possible (optional, defaults to hardlink)")
+    emunand_provision_parser.add_argument("-j", "--jobs", metavar="JOBS", type=int, default=1,
+                                          help="number of titles to decrypt and verify at once, using separate "
+                                               "processes (optional, defaults to 1)")
+    emunand_provision_parser.add_argument("-s", "--skip-hash", action="store_true",
+                                          help="skips validating the hashes of decrypted content")
+    emunand_provision_parser.add_argument("-e", "--endpoint", metavar="ENDPOINT", type=str,
+                                          help="use the specified NUS endpoint instead of the official one")
+    emunand_provision_cache_group = emunand_provision_parser.add_mutually_exclusive_group()
+    emunand_provision_cache_group.add_argument("--offline", action="store_true",
+                                               help="only use data from the local NUS cache, and never connect to the "
+                                                    "NUS")
+    emunand_provision_cache_group.add_argument("--no-cache", action="store_true",
+                                               help="don't read from or write to the local NUS cache")
     # Title EmuNAND subcommand.
     emunand_title_parser = emunand_subparsers.add_parser("title", help="manage titles on an EmuNAND",
                                                          description="manage titles on an EmuNAND")
-    emunand_title_parser.set_defaults(func=handle_emunand_title)
+    emunand_title_parser.set_defaults(func="handle_emunand_title")
     emunand_title_parser.add_argument("emunand", metavar="EMUNAND", type=str,
                                       help="path of the target EmuNAND directory")
     emunand_title_install_group = emunand_title_parser.add_mutually_exclusive_group(required=True)
@@ -113,26 +178,39 @@ if __name__ == "__main__":
                                       "content (install only)", action="store_true")
     emunand_title_parser.add_argument("-v", "--verbose", action="store_true",
                                       help="show verbose installation/uninstallation details")
+    emunand_title_parser.add_argument("-j", "--jobs", metavar="JOBS", type=int, default=1,
+                                      help="number of WADs to decrypt and verify at once when installing a folder of "
+                                           "WADs, using separate processes (optional, defaults to 1)")
 
     # Argument parser for the fakesign subcommand.
     fakesign_parser = subparsers.add_parser("fakesign", help="fakesign a TMD, Ticket, or WAD (trucha bug)",
                                             description="fakesign a TMD, Ticket, or WAD (trucha bug); by default, this "
-                                                        "will overwrite the input file if no output file is specified")
-    fakesign_parser.set_defaults(func=handle_fakesign)
-    fakesign_parser.add_argument("input", metavar="IN", type=str, help="input file")
-    fakesign_parser.add_argument("-o", "--output", metavar="OUT", type=str, help="output file (optional)")
+                                                        "will overwrite the input file if no output file is specified. "
+                                                        "Directories and glob patterns can also be provided to "
+                                                        "fakesign many files at once, and files that are already "
+                                                        "fakesigned are skipped")
+    fakesign_parser.set_defaults(func="handle_fakesign")
+    fakesign_parser.add_argument("input", metavar="IN", type=str, nargs="+",
+                                 help="input file(s), directories, or glob patterns")
+    fakesign_parser.add_argument("-o", "--output", metavar="OUT", type=str,
+                                 help="output file, or output directory when fakesigning more than one file (optional)")
+    fakesign_parser.add_argument("-j", "--jobs", metavar="JOBS", type=int, default=1,
+                                 help="number of processes to use, either to fakesign several files at once or to "
+                                      "split the search for a single file (optional, defaults to 1)")
+    fakesign_parser.add_argument("-r", "--results", metavar="RESULTS", type=str,
+                                 help="file to write the result for each file to as JSON lines (optional)")
 
     # Argument parser for the info command.
     info_parser = subparsers.add_parser("info", help="get information about a TMD, Ticket, or WAD",
                                         description="get information about a TMD, Ticket, or WAD")
-    info_parser.set_defaults(func=handle_info)
+    info_parser.set_defaults(func="handle_info")
     info_parser.add_argument("input", metavar="IN", type=str, help="input file")
 
     # Argument parser for the iospatch command.
     iospatch_parser = subparsers.add_parser("iospatch", help="patch IOS WADs to re-enable exploits",
                                             description="patch IOS WADs to re-enable exploits; by default, this will "
                                                         "overwrite the input file in place unless you use -o/--output")
-    iospatch_parser.set_defaults(func=handle_iospatch)
+    iospatch_parser.set_defaults(func="handle_iospatch")
     iospatch_parser.add_argument("input", metavar="IN", type=str, help="input file")
     iospatch_parser.add_argument("-o", "--output", metavar="OUT", type=str, help="output file (optional)")
     iospatch_parser.add_argument("-fs", "--fakesigning", action="store_true", help="patch in fakesigning support")
@@ -157,15 +235,18 @@ if __name__ == "__main__":
     lz77_compress_parser = lz77_subparsers.add_parser("compress", help="compress a file with LZ77 compression",
                                                     description="compress a file with LZ77 compression; by default, "
                                                                 "this will output to <input file>.lz77")
-    lz77_compress_parser.set_defaults(func=handle_lz77_compress)
+    lz77_compress_parser.set_defaults(func="handle_lz77_compress")
     lz77_compress_parser.add_argument("input", metavar="IN", type=str, help="file to compress")
     lz77_compress_parser.add_argument("-o", "--output", metavar="OUT", type=str,
                                       help="file to output the compressed data to (optional)")
+    lz77_compress_parser.add_argument("-l", "--level", metavar="LEVEL", type=int, choices=[1, 2, 3], default=1,
+                                      help="compression level from 1 to 3, where higher levels produce smaller files "
+                                           "but take longer (optional, defaults to 1)")
     # LZ77 decompress parser.
     lz77_decompress_parser = lz77_subparsers.add_parser("decompress", help="decompress an LZ77-compressed file",
                                                         description="decompress an LZ77-compressed file; by default, "
                                                                     "this will output to <input file>.out")
-    lz77_decompress_parser.set_defaults(func=handle_lz77_decompress)
+    lz77_decompress_parser.set_defaults(func="handle_lz77_decompress")
     lz77_decompress_parser.add_argument("input", metavar="IN", type=str,
                                         help="LZ77-compressed file to decompress")
     lz77_decompress_parser.add_argument("-o", "--output", metavar="OUT", type=str,
@@ -178,8 +259,13 @@ if __name__ == "__main__":
     # Title NUS subcommand.
     nus_title_parser = nus_subparsers.add_parser("title", help="download a title from the NUS",
                                                  description="download a title from the NUS")
-    nus_title_parser.set_defaults(func=handle_nus_title)
-    nus_title_parser.add_argument("tid", metavar="TID", type=str, help="Title ID to download")
+    nus_title_parser.set_defaults(func="handle_nus_title")
+    nus_title_parser.add_argument("tid", metavar="TID", type=str, nargs="?",
+                                  help="Title ID to download (optional if --list is used)")
+    nus_title_parser.add_argument("-l", "--list", metavar="LIST", type=str,
+                                  help="download every title in a list file instead, with one Title ID and an "
+                                       "optional version per line; --output and --wad are treated as directories "
+                                       "to download each title into")
     nus_title_parser.add_argument("-v", "--version", metavar="VERSION", type=int,
                                   help="version to download (optional)")
     nus_title_out_group_label = nus_title_parser.add_argument_group(title="output types (required)")
@@ -192,10 +278,18 @@ if __name__ == "__main__":
                                   action="store_true")
     nus_title_parser.add_argument("-e", "--endpoint", metavar="ENDPOINT", type=str,
                                   help="use the specified NUS endpoint instead of the official one")
+    nus_title_parser.add_argument("-j", "--jobs", metavar="JOBS", type=int, default=4,
+                                  help="number of contents to download at once, across all titles (optional, "
+                                       "defaults to 4)")
+    nus_title_cache_group = nus_title_parser.add_mutually_exclusive_group()
+    nus_title_cache_group.add_argument("--offline", action="store_true",
+                                       help="only use data from the local NUS cache, and never connect to the NUS")
+    nus_title_cache_group.add_argument("--no-cache", action="store_true",
+                                       help="don't read from or write to the local NUS cache")
     # Content NUS subcommand.
     nus_content_parser = nus_subparsers.add_parser("content", help="download a specific content from the NUS",
                                                    description="download a specific content from the NUS")
-    nus_content_parser.set_defaults(func=handle_nus_content)
+    nus_content_parser.set_defaults(func="handle_nus_content")
     nus_content_parser.add_argument("tid", metavar="TID", type=str, help="Title ID the content belongs to")
     nus_content_parser.add_argument("cid", metavar="CID", type=str,
                                     help="Content ID to download (in \"000000xx\" format)")
@@ -204,14 +298,24 @@ if __name__ == "__main__":
     nus_content_parser.add_argument("-o", "--output", metavar="OUT", type=str,
                                     help="path to download the content to (optional)")
     nus_content_parser.add_argument("-d", "--decrypt", action="store_true", help="decrypt this content")
+    nus_content_cache_group = nus_content_parser.add_mutually_exclusive_group()
+    nus_content_cache_group.add_argument("--offline", action="store_true",
+                                         help="only use data from the local NUS cache, and never connect to the NUS")
+    nus_content_cache_group.add_argument("--no-cache", action="store_true",
+                                         help="don't read from or write to the local NUS cache")
     # TMD NUS subcommand.
     nus_tmd_parser = nus_subparsers.add_parser("tmd", help="download a tmd from the NUS",
                                                description="download a tmd from the NUS")
-    nus_tmd_parser.set_defaults(func=handle_nus_tmd)
+    nus_tmd_parser.set_defaults(func="handle_nus_tmd")
     nus_tmd_parser.add_argument("tid", metavar="TID", type=str, help="Title ID the TMD is for")
     nus_tmd_parser.add_argument("-v", "--version", metavar="VERSION", type=int, help="version of the TMD to download")
     nus_tmd_parser.add_argument("-o", "--output", metavar="OUT", type=str,
                                 help="path to download the TMD to (optional)")
+    nus_tmd_cache_group = nus_tmd_parser.add_mutually_exclusive_group()
+    nus_tmd_cache_group.add_argument("--offline", action="store_true",
+                                     help="only use data from the local NUS cache, and never connect to the NUS")
+    nus_tmd_cache_group.add_argument("--no-cache", action="store_true",
+                                     help="don't read from or write to the local NUS cache")
 
     # Argument parser for the setting subcommand.
     setting_parser = subparsers.add_parser("setting", help="manage setting.txt",
@@ -221,7 +325,7 @@ if __name__ == "__main__":
     setting_dec_parser = setting_subparsers.add_parser("decrypt", help="decrypt setting.txt",
                                                        description="decrypt setting.txt; by default, this will output "
                                                                    "to setting_dec.txt")
-    setting_dec_parser.set_defaults(func=handle_setting_decrypt)
+    setting_dec_parser.set_defaults(func="handle_setting_decrypt")
     setting_dec_parser.add_argument("input", metavar="IN", type=str, help="encrypted setting.txt file to decrypt")
     setting_dec_parser.add_argument("-o", "--output", metavar="OUT", type=str,
                                     help="path to output the decrypted file to (optional)")
@@ -229,7 +333,7 @@ if __name__ == "__main__":
     setting_enc_parser = setting_subparsers.add_parser("encrypt", help="encrypt setting.txt",
                                                        description="encrypt setting.txt; by default, this will output "
                                                                    "to setting.txt")
-    setting_enc_parser.set_defaults(func=handle_setting_encrypt)
+    setting_enc_parser.set_defaults(func="handle_setting_encrypt")
     setting_enc_parser.add_argument("input", metavar="IN", type=str, help="decrypted setting.txt file to encrypt")
     setting_enc_parser.add_argument("-o", "--output", metavar="OUT", type=str,
                                     help="path to output the encrypted file to (optional)")
@@ -237,7 +341,7 @@ if __name__ == "__main__":
     setting_gen_parser = setting_subparsers.add_parser("gen",
                                                        help="generate a new setting.txt based on the provided values",
                                                        description="generate a new setting.txt based on the provided values")
-    setting_gen_parser.set_defaults(func=handle_setting_gen)
+    setting_gen_parser.set_defaults(func="handle_setting_gen")
     setting_gen_parser.add_argument("serno", metavar="SERNO", type=str,
                                            help="serial number of the console these settings are for")
     setting_gen_parser.add_argument("region", metavar="REGION", type=str,
@@ -250,7 +354,7 @@ if __name__ == "__main__":
     # MYM theme subcommand.
     theme_mym_parser = theme_subparsers.add_parser("mym", help="apply an MYM theme to the Wii Menu",
                                                    description="apply an MYM theme to the Wii Menu")
-    theme_mym_parser.set_defaults(func=handle_apply_mym)
+    theme_mym_parser.set_defaults(func="handle_apply_mym")
     theme_mym_parser.add_argument("mym", metavar="MYM", type=str, help="MYM theme to apply")
     theme_mym_parser.add_argument("base", metavar="BASE", type=str,
                                   help="base Wii Menu assets to apply the theme to (000000xx.app)")
@@ -265,7 +369,7 @@ if __name__ == "__main__":
     tmd_edit_parser = tmd_subparsers.add_parser("edit", help="edit the properties of a TMD file",
                                                 description="edit the properties of a TMD file; by default, this will "
                                                             "overwrite the input file unless an output is specified")
-    tmd_edit_parser.set_defaults(func=handle_tmd_edit)
+    tmd_edit_parser.set_defaults(func="handle_tmd_edit")
     tmd_edit_parser.add_argument("input", metavar="IN", type=str, help="TMD file to edit")
     tmd_edit_parser.add_argument("--tid", metavar="TID", type=str,
                                  help="a new Title ID for this title (formatted as 4 ASCII characters)")
@@ -281,7 +385,7 @@ if __name__ == "__main__":
                                                   description="remove a content record from a TMD file, either by its "
                                                               "CID or by its index; by default, this will overwrite "
                                                               "the input file unless an output is specified")
-    tmd_remove_parser.set_defaults(func=handle_tmd_remove)
+    tmd_remove_parser.set_defaults(func="handle_tmd_remove")
     tmd_remove_parser.add_argument("input", metavar="IN", type=str, help="TMD file to remove a content record from")
     tmd_remove_targets = tmd_remove_parser.add_mutually_exclusive_group(required=True)
     tmd_remove_targets.add_argument("-i", "--index", metavar="INDEX", type=int,
@@ -298,13 +402,13 @@ if __name__ == "__main__":
     # Pack U8 subcommand.
     u8_pack_parser = u8_subparsers.add_parser("pack", help="pack a folder into U8 archive",
                                               description="pack a folder into U8 archive")
-    u8_pack_parser.set_defaults(func=handle_u8_pack)
+    u8_pack_parser.set_defaults(func="handle_u8_pack")
     u8_pack_parser.add_argument("input", metavar="IN", type=str, help="folder to pack")
     u8_pack_parser.add_argument("output", metavar="OUT", type=str, help="output U8 archive")
     # Unpack U8 subcommand.
     u8_unpack_parser = u8_subparsers.add_parser("unpack", help="unpack a U8 archive into a folder",
                                                 description="unpack a U8 archive into a folder")
-    u8_unpack_parser.set_defaults(func=handle_u8_unpack)
+    u8_unpack_parser.set_defaults(func="handle_u8_unpack")
     u8_unpack_parser.add_argument("input", metavar="IN", type=str, help="U8 archive to unpack")
     u8_unpack_parser.add_argument("output", metavar="OUT", type=str, help="folder to output to")
 
@@ -316,7 +420,7 @@ if __name__ == "__main__":
     wad_add_parser = wad_subparsers.add_parser("add", help="add decrypted content to a WAD file",
                                                description="add decrypted content to a WAD file; by default, this "
                                                         "will overwrite the input file unless an output is specified")
-    wad_add_parser.set_defaults(func=handle_wad_add)
+    wad_add_parser.set_defaults(func="handle_wad_add")
     wad_add_parser.add_argument("input", metavar="IN", type=str, help="WAD file to add to")
     wad_add_parser.add_argument("content", metavar="CONTENT", type=str, help="decrypted content to add")
     wad_add_parser.add_argument("-c", "--cid", metavar="CID", type=str,
@@ -332,7 +436,7 @@ if __name__ == "__main__":
                                                    description="re-encrypt a WAD file with a different key, making it "
                                                                "possible to use the WAD in a different environment; "
                                                                "this fakesigns the WAD by default")
-    wad_convert_parser.set_defaults(func=handle_wad_convert)
+    wad_convert_parser.set_defaults(func="handle_wad_convert")
     wad_convert_parser.add_argument("input", metavar="IN", type=str, help="WAD file to re-encrypt")
     wad_convert_targets_lbl = wad_convert_parser.add_argument_group(title="target keys")
     wad_convert_targets = wad_convert_targets_lbl.add_mutually_exclusive_group(required=True)
@@ -351,7 +455,7 @@ if __name__ == "__main__":
     wad_edit_parser = wad_subparsers.add_parser("edit", help="edit the properties of a WAD file",
                                                 description="edit the properties of a WAD file; by default, this will "
                                                             "overwrite the input file unless an output is specified")
-    wad_edit_parser.set_defaults(func=handle_wad_edit)
+    wad_edit_parser.set_defaults(func="handle_wad_edit")
     wad_edit_parser.add_argument("input", metavar="IN", type=str, help="WAD file to edit")
     wad_edit_parser.add_argument("--tid", metavar="TID", type=str,
                                  help="a new Title ID for this WAD (formatted as 4 ASCII characters)")
@@ -367,7 +471,7 @@ if __name__ == "__main__":
     # Pack WAD subcommand.
     wad_pack_parser = wad_subparsers.add_parser("pack", help="pack a directory to a WAD file",
                                                  description="pack a directory to a WAD file")
-    wad_pack_parser.set_defaults(func=handle_wad_pack)
+    wad_pack_parser.set_defaults(func="handle_wad_pack")
     wad_pack_parser.add_argument("input", metavar="IN", type=str, help="input directory")
     wad_pack_parser.add_argument("output", metavar="OUT", type=str, help="WAD file to pack")
     wad_pack_parser.add_argument("-f", "--fakesign", help="fakesign the TMD and Ticket (trucha bug)",
@@ -377,7 +481,7 @@ if __name__ == "__main__":
                                                   description="remove content from a WAD file, either by its CID or"
                                                               "by its index; by default, this will overwrite the input "
                                                               "file unless an output is specified")
-    wad_remove_parser.set_defaults(func=handle_wad_remove)
+    wad_remove_parser.set_defaults(func="handle_wad_remove")
     wad_remove_parser.add_argument("input", metavar="IN", type=str, help="WAD file to remove content from")
     wad_remove_targets = wad_remove_parser.add_mutually_exclusive_group(required=True)
     wad_remove_targets.add_argument("-i", "--index", metavar="INDEX", type=int,
@@ -391,7 +495,7 @@ if __name__ == "__main__":
                                                description="replace existing content in a WAD file with new decrypted "
                                                            "data; by default, this will overwrite the input file "
                                                            "unless an output is specified")
-    wad_set_parser.set_defaults(func=handle_wad_set)
+    wad_set_parser.set_defaults(func="handle_wad_set")
     wad_set_parser.add_argument("input", metavar="IN", type=str, help="WAD file to replace content in")
     wad_set_parser.add_argument("content", metavar="CONTENT", type=str, help="new decrypted content")
     wad_set_targets = wad_set_parser.add_mutually_exclusive_group(required=True)
@@ -407,13 +511,16 @@ if __name__ == "__main__":
     # Unpack WAD subcommand.
     wad_unpack_parser = wad_subparsers.add_parser("unpack", help="unpack a WAD file to a directory",
                                                   description="unpack a WAD file to a directory")
-    wad_unpack_parser.set_defaults(func=handle_wad_unpack)
+    wad_unpack_parser.set_defaults(func="handle_wad_unpack")
     wad_unpack_parser.add_argument("input", metavar="IN", type=str, help="WAD file to unpack")
     wad_unpack_parser.add_argument("output", metavar="OUT", type=str, help="output directory")
     wad_unpack_parser.add_argument("-s", "--skip-hash", help="skips validating the hashes of decrypted "
                                    "content", action="store_true")
+    wad_unpack_parser.add_argument("-j", "--jobs", metavar="JOBS", type=int, default=1,
+                                   help="number of contents to decrypt at once, using separate processes (optional, "
+                                        "defaults to 1)")
 
 
     # Parse all the args, and call the appropriate function with all of those args if a valid subcommand was passed.
     args = parser.parse_args()
-    args.func(args)
+    resolve_handler(args.func)(args)